@@ -0,0 +1 @@
+"""Benchmarks for the download paths, run against a local mock CDN."""
@@ -0,0 +1,256 @@
+"""A local stand-in for xvideos.com and its CDN, for benchmarks and offline tests.
+
+It serves the watch page, VIDEO_API, master/variant m3u8 playlists, TS segments,
+Range-capable MP4 files and the profile/channel activity pages, with optional
+latency, per-connection bandwidth, error injection and dropped connections.
+"""
+
+from typing import ContextManager, Dict, Iterator, List, Optional, Tuple
+
+import hashlib
+import json
+import random
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from xvideos_dl import cache
+from xvideos_dl import constant as c
+from xvideos_dl import xvideos_dl
+from xvideos_dl.cache import MetadataCache
+
+
+@contextmanager
+def patch_host(host: str) -> Iterator[str]:
+    """Point xvideos_dl at a mock server, with a metadata cache of its own instead of the one on disk."""
+    names = ["HOST", "VIDEO_PAGE", "USER_UPLOAD_API", "PLAYLIST_API", "CHANNEL_API", "VIDEO_API"]
+    saved = {name: getattr(c, name) for name in names}
+    for name in names:
+        setattr(c, name, saved[name].replace(saved["HOST"], host))
+    # Every module that imported the cache by name is given the stand-in
+    modules = [cache, xvideos_dl]
+    caches = {module: module.metadata_cache for module in modules}
+    with tempfile.TemporaryDirectory() as tmp:
+        metadata_cache = MetadataCache(Path(tmp) / "cache.sqlite3")
+        metadata_cache.enabled = False
+        for module in modules:
+            setattr(module, "metadata_cache", metadata_cache)
+        try:
+            yield host
+        finally:
+            for name, value in saved.items():
+                setattr(c, name, value)
+            for module, original in caches.items():
+                setattr(module, "metadata_cache", original)
+            metadata_cache.close()
+
+
+VARIANTS = [("250p", 155648, "250x444"), ("360p", 423936, "360x640"), ("720p", 1572864, "720x1280")]
+
+
+class MockCDN:
+    def __init__(
+        self,
+        mp4_size: int = 1024 ** 2 * 8,
+        segments: int = 20,
+        segment_size: int = 1024 * 256,
+        videos_per_page: int = 36,
+        pages: int = 3,
+        latency: float = 0.0,
+        bandwidth: Optional[float] = None,
+        error_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.mp4_size = mp4_size
+        self.segments = segments
+        self.segment_size = segment_size
+        self.videos_per_page = videos_per_page
+        self.pages = pages
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.requests = 0
+        self.paths: List[str] = []
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._blobs: Dict[Tuple[str, int], bytes] = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        # Clients hanging up mid-response are expected, e.g. when a download is cancelled
+        self.server.handle_error = lambda request, client_address: None  # type: ignore
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def blob(self, name: str, size: int) -> bytes:
+        """Deterministic content for a file, the same for every request."""
+        with self._lock:
+            if (name, size) not in self._blobs:
+                block = hashlib.sha256(name.encode()).digest() * 2048  # 64KB
+                self._blobs[(name, size)] = (block * (size // len(block) + 1))[:size]
+            return self._blobs[(name, size)]
+
+    def mp4(self, vid: str) -> bytes:
+        return self.blob(f"mp4-{vid}", self.mp4_size)
+
+    def segment(self, vid: str, name: str, index: int) -> bytes:
+        return self.blob(f"ts-{vid}-{name}-{index}", self.segment_size)
+
+    def start(self) -> "MockCDN":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "MockCDN":
+        return self.start()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+    def patch(self) -> ContextManager[str]:
+        return patch_host(self.host)
+
+    def _route(self, method: str, path: str) -> Tuple[int, str, bytes]:
+        path = path.split("?")[0]
+        find = re.fullmatch(r"/video-download/(\d+)/", path)
+        if find:
+            vid = find.group(1)
+            data = {"URL": f"{self.host}/mp4/{vid}.mp4", "URL_LOW": f"{self.host}/mp4/{vid}.mp4", "logged": True}
+            return 200, "application/json", json.dumps(data).encode()
+        find = re.fullmatch(r"/video(\d+)/.*", path)
+        if find:
+            vid = find.group(1)
+            page = (
+                f'<html><head><meta property="og:title" content="Mock video {vid}" />\n</head><body>'
+                + "<div>filler</div>" * 4096
+                + "<script>"
+                + f"html5player.setVideoUrlLow('{self.host}/mp4/{vid}.mp4');"
+                + f"html5player.setVideoUrlHigh('{self.host}/mp4/{vid}.mp4');"
+                + f"html5player.setVideoHLS('{self.host}/hls/{vid}/hls.m3u8');"
+                + "</script></body></html>"
+            )
+            return 200, "text/html", page.encode()
+        find = re.fullmatch(r"/hls/(\d+)/hls\.m3u8", path)
+        if find:
+            lines = ["#EXTM3U"]
+            for name, bandwidth, resolution in VARIANTS:
+                lines.append(
+                    f'#EXT-X-STREAM-INF:PROGRAM-ID=1,BANDWIDTH={bandwidth},RESOLUTION={resolution},NAME="{name}"'
+                )
+                lines.append(f"hls-{name}.m3u8")
+            return 200, "application/vnd.apple.mpegurl", "\n".join(lines).encode()
+        find = re.fullmatch(r"/hls/(\d+)/hls-(\w+)\.m3u8", path)
+        if find:
+            name = find.group(2)
+            lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:10", "#EXT-X-MEDIA-SEQUENCE:0"]
+            for index in range(self.segments):
+                lines += ["#EXTINF:10.000,", f"hls-{name}-{index}.ts"]
+            lines.append("#EXT-X-ENDLIST")
+            return 200, "application/vnd.apple.mpegurl", "\n".join(lines).encode()
+        find = re.fullmatch(r"/hls/(\d+)/hls-(\w+)-(\d+)\.ts", path)
+        if find:
+            return 200, "video/mp2t", self.segment(find.group(1), find.group(2), int(find.group(3)))
+        find = re.fullmatch(r"/mp4/(\d+)\.mp4", path)
+        if find:
+            return 200, "video/mp4", self.mp4(find.group(1))
+        find = re.fullmatch(r"/(?:profiles/(\w+)/activity|channels/(\w+)/activity/straight)/(\d+)", path)
+        if find and method == "POST":
+            return 200, "text/html", self.activity_page(int(find.group(3))).encode()
+        return 404, "text/plain", b"Not Found"
+
+    def activity_page(self, aid: int) -> str:
+        page = aid // 1000
+        next_aid = (page + 1) * 1000 if page + 1 < self.pages else 0
+        blocks = []
+        for i in range(self.videos_per_page):
+            vid = 10000 + page * self.videos_per_page + i
+            blocks.append(
+                f'<div id="video_{vid}" data-id="{vid}" class="thumb-block thumb-block-profile">'
+                f'<div class="thumb-inside"><img src="{vid}.jpg"/></div><div class="thumb-under">'
+                f'<p class="title"><a href="/video{vid}/_" title="Mock video {vid}">Mock video {vid}</a></p>'
+                f'<p class="metadata">10 min</p></div></div>'
+            )
+        return f"{next_aid}\n" + "\n".join(blocks)
+
+    def _handler(self) -> type:
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: object) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                self.respond("GET")
+
+            def do_HEAD(self) -> None:
+                self.respond("HEAD")
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                self.rfile.read(length)
+                self.respond("POST")
+
+            def respond(self, method: str) -> None:
+                with cdn._lock:
+                    cdn.requests += 1
+                    cdn.paths.append(self.path)
+                    failed = cdn._random.random() < cdn.error_rate
+                    dropped = cdn._random.random() < cdn.drop_rate
+                if cdn.latency:
+                    time.sleep(cdn.latency)
+                if failed:
+                    status, content_type, body = 503, "text/plain", b"Service Unavailable"
+                else:
+                    status, content_type, body = cdn._route(method, self.path)
+
+                headers: List[Tuple[str, str]] = [("Content-Type", content_type), ("Accept-Ranges", "bytes")]
+                find = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                if status == 200 and find:
+                    start = int(find.group(1))
+                    end = min(int(find.group(2) or len(body) - 1), len(body) - 1)
+                    headers.append(("Content-Range", f"bytes {start}-{end}/{len(body)}"))
+                    status, body = 206, body[start : end + 1]
+                headers.append(("Content-Length", str(len(body))))
+
+                self.send_response(status)
+                for key, value in headers:
+                    self.send_header(key, value)
+                self.end_headers()
+                if method == "HEAD":
+                    return
+                if dropped and len(body) > 1:
+                    # Hang up halfway through the body
+                    self.send_body(body[: len(body) // 2])
+                    self.close_connection = True
+                else:
+                    self.send_body(body)
+
+            def send_body(self, body: bytes) -> None:
+                step = 1024 * 64
+                started = time.time()
+                for offset in range(0, len(body), step):
+                    self.wfile.write(body[offset : offset + step])
+                    if cdn.bandwidth:
+                        # Sleep until this connection is back under its bandwidth budget
+                        ahead = (offset + step) / cdn.bandwidth - (time.time() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+                with cdn._lock:
+                    cdn.bytes_sent += len(body)
+
+        return Handler
@@ -0,0 +1,102 @@
+"""Micro-benchmarks of the manifest, cookie and watch page parsers.
+
+    python -m benchmarks.parsers
+    python -m benchmarks.parsers --json
+
+The playlists and the cookie in benchmarks/fixtures are shaped like the ones
+the site serves. The watch page is built around the same player setup, padded
+to the size of a real page, with the player in the middle of it.
+"""
+
+from typing import Any, Callable, Dict, List, Tuple
+
+import json
+import timeit
+from pathlib import Path
+
+import typer
+from rich.console import Console
+from rich.table import Table
+from xvideos_dl.auth import parse_cookies
+from xvideos_dl.m3u8 import parse_master, parse_media
+from xvideos_dl.page import scan_page
+from xvideos_dl.xvideos_dl import parse_hls_list, parse_media_playlist, parse_video_hls, parse_video_title
+
+console = Console()
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+PLAYLIST_URL = "https://hls-hw.xvideos-cdn.com/videos/hls/3c/3b/de/3c3bde289827a1e121613e06e401602d/hls.m3u8"
+PAGE_SIZE = 1024 * 400
+CHUNK = 1024 * 64
+
+
+def watch_page() -> bytes:
+    head = '<html><head><meta property="og:title" content="Asian Webcam #2 camsex4u.life &amp; more" />\n</head>'
+    player = (
+        "<script>html5player.setVideoUrlLow('https://video-hw.xvideos-cdn.com/videos/3gp/3/c/3/low.mp4?e=1');"
+        "html5player.setVideoUrlHigh('https://video-hw.xvideos-cdn.com/videos/mp4/3/c/3/high.mp4?e=1');"
+        f"html5player.setVideoHLS('{PLAYLIST_URL}');</script>"
+    )
+    filler = '<div class="thumb-block"><p class="title"><a href="/video1/_" title="related">related</a></p></div>\n'
+    half = filler * (PAGE_SIZE // 2 // len(filler))
+    return (head + "<body>" + half + player + half + "</body></html>").encode()
+
+
+def chunks(data: bytes) -> List[bytes]:
+    return [data[i : i + CHUNK] for i in range(0, len(data), CHUNK)]
+
+
+def full_text_page(pieces: List[bytes]) -> Tuple[str, str]:
+    """What reading a watch page took before: the whole body decoded, then searched once per field."""
+    text = b"".join(pieces).decode()
+    return parse_video_title(text), parse_video_hls(text)
+
+
+def cases() -> List[Tuple[str, Callable[[], Any], int]]:
+    master = (FIXTURES / "master.m3u8").read_text()
+    media = (FIXTURES / "media.m3u8").read_text()
+    cookie = (FIXTURES / "cookie.txt").read_text().strip()
+    page = chunks(watch_page())
+    size = sum(len(piece) for piece in page)
+    return [
+        ("m3u8 master", lambda: parse_master(master), len(master)),
+        ("m3u8 master to HLS list", lambda: parse_hls_list(PLAYLIST_URL, master), len(master)),
+        ("m3u8 media", lambda: parse_media(media), len(media)),
+        ("m3u8 media to segments", lambda: parse_media_playlist(media, PLAYLIST_URL), len(media)),
+        ("cookie", lambda: parse_cookies(cookie), len(cookie)),
+        ("watch page, streamed scan", lambda: scan_page(iter(page)), size),
+        ("watch page, full text regex", lambda: full_text_page(page), size),
+    ]
+
+
+def measure(func: Callable[[], Any], repeat: int = 5) -> float:
+    """Best seconds per call over a few runs of about 0.2s each."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+app = typer.Typer(add_completion=False)
+
+
+@app.command()
+def main(as_json: bool = typer.Option(False, "--json", help="Print one JSON object per parser instead of a table.")):
+    """Benchmark the parsers on recorded fixtures."""
+    results: List[Dict[str, Any]] = []
+    for name, func, size in cases():
+        seconds = measure(func)
+        results.append(dict(parser=name, bytes=size, microseconds=seconds * 1e6, mb_per_second=size / seconds / 1e6))
+
+    if as_json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    table = Table("Parser", "Input", "µs per call", "MB/s")
+    for r in results:
+        table.add_row(
+            r["parser"], f"{r['bytes'] / 1024:.1f} KB", f"{r['microseconds']:.1f}", f"{r['mb_per_second']:.0f}"
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,215 @@
+"""Benchmark the download paths against the local mock CDN.
+
+    python -m benchmarks.run                     # every scenario, as a table
+    python -m benchmarks.run -s mp4 -s listing --latency 0.02 --bandwidth 4 --json
+
+Each scenario runs in its own Python process with HOME pointed at a scratch
+directory, so CPU time and peak RSS belong to the client alone and the real
+cookie and metadata cache are never touched. The mock CDN runs in this process
+and counts the requests each scenario makes.
+"""
+
+from typing import Any, Callable, Dict, List
+
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from .mock_cdn import MockCDN, patch_host
+
+console = Console()
+ROOT = Path(__file__).resolve().parent.parent
+FIRST_VID = 1000
+
+
+def run_mp4(workdir: Path, videos: int, connections: int, jobs: int) -> int:
+    from xvideos_dl.xvideos_dl import Video, download_mp4_resource
+
+    size = 0
+    for i in range(videos):
+        vid = str(FIRST_VID + i)
+        video = Video(vid=vid, vname=vid, pname="", uname="", vpage="")
+        path = download_mp4_resource(video, workdir / f"{vid}.mp4", True, False, False, connections, quiet=True)
+        size += path.stat().st_size
+    return size
+
+
+def run_hls(workdir: Path, videos: int, connections: int, jobs: int) -> int:
+    from xvideos_dl import constant as c
+    from xvideos_dl.xvideos_dl import Video, download_hls_stream, get_hls_list
+
+    size = 0
+    for i in range(videos):
+        vid = str(FIRST_VID + i)
+        video = Video(vid=vid, vname=vid, pname="", uname="", vpage=c.VIDEO_PAGE.format(vid=vid))
+        hls = get_hls_list(video)[-1]
+        path = download_hls_stream(hls.url, workdir / f"{vid}.mp4", True, connections, quiet=True)
+        size += path.stat().st_size
+    return size
+
+
+def run_listing(workdir: Path, videos: int, connections: int, jobs: int) -> int:
+    from xvideos_dl import constant as c
+    from xvideos_dl.xvideos_dl import get_videos_from_user_page
+
+    found = get_videos_from_user_page(f"{c.HOST}/profiles/mock", "0", c.USER_UPLOAD_API, [])
+    if not found:
+        raise RuntimeError("no videos found in the mock profile")
+    return 0
+
+
+def run_main(workdir: Path, videos: int, connections: int, jobs: int) -> int:
+    from typer.testing import CliRunner
+    from xvideos_dl import constant as c
+    from xvideos_dl.__main__ import app
+
+    urls = [c.VIDEO_PAGE.format(vid=FIRST_VID + i) + "/mock" for i in range(videos)]
+    args = urls + ["-d", str(workdir), "-q", "low", "-c", str(connections), "-j", str(jobs), "--progress", "quiet"]
+    result = CliRunner().invoke(app, args + ["--no-cache"])
+    if result.exit_code != 0:
+        raise RuntimeError(f"main exited with {result.exit_code}:\n{result.output}")
+    return sum(path.stat().st_size for path in workdir.rglob("*.mp4"))
+
+
+SCENARIOS: Dict[str, Callable[[Path, int, int, int], int]] = {
+    "mp4": run_mp4,
+    "hls": run_hls,
+    "listing": run_listing,
+    "main": run_main,
+}
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def measure(scenario: str, host: str, videos: int, connections: int, jobs: int) -> Dict[str, Any]:
+    """Run one scenario in this process, which the parent started just for it."""
+    with tempfile.TemporaryDirectory() as tmp, patch_host(host):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        size = SCENARIOS[scenario](Path(tmp), videos, connections, jobs)
+        seconds = time.perf_counter() - started
+        used = resource.getrusage(resource.RUSAGE_SELF)
+    return dict(
+        seconds=seconds,
+        bytes=size,
+        cpu=used.ru_utime - usage.ru_utime + used.ru_stime - usage.ru_stime,
+        rss=peak_rss(),
+    )
+
+
+def spawn(scenario: str, cdn: MockCDN, videos: int, connections: int, jobs: int) -> Dict[str, Any]:
+    requests = cdn.requests
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home, PYTHONPATH=os.pathsep.join([str(ROOT), os.environ.get("PYTHONPATH", "")]))
+        args = ["--child", scenario, "--host", cdn.host, "-n", str(videos), "-c", str(connections), "-j", str(jobs)]
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.run"] + args,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"scenario {scenario} failed:\n{proc.stderr or proc.stdout}")
+        result = json.loads((Path(home) / "result.json").read_text())
+    result.update(
+        scenario=scenario,
+        requests=cdn.requests - requests,
+        mb_per_second=result["bytes"] / 1024 ** 2 / result["seconds"],
+        requests_per_second=(cdn.requests - requests) / result["seconds"],
+    )
+    return result
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    table = Table("Scenario", "Time", "MB", "MB/s", "Requests", "Req/s", "CPU", "Peak RSS")
+    for r in results:
+        table.add_row(
+            r["scenario"],
+            f"{r['seconds']:.2f}s",
+            f"{r['bytes'] / 1024 ** 2:.1f}",
+            f"{r['mb_per_second']:.1f}",
+            str(r["requests"]),
+            f"{r['requests_per_second']:.0f}",
+            f"{r['cpu']:.2f}s",
+            f"{r['rss'] / 1024 ** 2:.0f} MB",
+        )
+    console.print(table)
+
+
+app = typer.Typer(add_completion=False)
+
+
+@app.command()
+def main(
+    scenarios: List[str] = typer.Option(
+        None, "-s", "--scenario", help=f"Scenarios to run, any of {', '.join(SCENARIOS)}. Defaults to all."
+    ),
+    videos: int = typer.Option(3, "-n", "--videos", min=1, help="Videos to download per scenario."),
+    connections: int = typer.Option(4, "-c", "--connections", min=1, help="Connections per video."),
+    jobs: int = typer.Option(1, "-j", "--jobs", min=1, help="Videos at the same time, for the main scenario."),
+    mp4_size: float = typer.Option(8, "--mp4-size", help="Size of every MP4 file in MB."),
+    segments: int = typer.Option(20, "--segments", help="Segments per HLS variant."),
+    segment_size: float = typer.Option(256, "--segment-size", help="Size of every HLS segment in KB."),
+    pages: int = typer.Option(3, "--pages", help="Pages of the mock profile listing."),
+    latency: float = typer.Option(0.0, "--latency", help="Seconds before the server answers each request."),
+    bandwidth: float = typer.Option(0.0, "--bandwidth", help="MB/s per connection, 0 for unlimited."),
+    error_rate: float = typer.Option(0.0, "--error-rate", help="Fraction of requests answered with 503."),
+    drop_rate: float = typer.Option(0.0, "--drop-rate", help="Fraction of responses cut off halfway."),
+    as_json: bool = typer.Option(False, "--json", help="Print one JSON object per scenario instead of a table."),
+    child: str = typer.Option(None, "--child", hidden=True),
+    host: str = typer.Option(None, "--host", hidden=True),
+):
+    """Benchmark xvideos-dl against a local mock CDN."""
+    if child:
+        # stdout belongs to the code under test, hand the numbers back through a file
+        result = measure(child, host, videos, connections, jobs)
+        (Path.home() / "result.json").write_text(json.dumps(result))
+        return
+
+    for scenario in scenarios or []:
+        if scenario not in SCENARIOS:
+            console.print(f"[red]Unknown scenario {scenario}, choose from {', '.join(SCENARIOS)}[/]")
+            raise typer.Exit(2)
+    scenarios = scenarios or list(SCENARIOS)
+    if "hls" in scenarios and not shutil.which("ffmpeg"):
+        console.print("[yellow]ffmpeg is not installed, skip the hls scenario[/]")
+        scenarios = [s for s in scenarios if s != "hls"]
+
+    cdn = MockCDN(
+        mp4_size=int(mp4_size * 1024 ** 2),
+        segments=segments,
+        segment_size=int(segment_size * 1024),
+        pages=pages,
+        latency=latency,
+        bandwidth=bandwidth * 1024 ** 2 or None,
+        error_rate=error_rate,
+        drop_rate=drop_rate,
+    )
+    results = []
+    with cdn:
+        for scenario in scenarios:
+            result = spawn(scenario, cdn, videos, connections, jobs)
+            results.append(result)
+            if as_json:
+                print(json.dumps(result))
+    if not as_json:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1 @@
+# Keeps the repository root on sys.path, so the tests can import the benchmarks package
@@ -0,0 +1,57 @@
+from xvideos_dl import adaptive
+from xvideos_dl import constant as c
+from xvideos_dl.adaptive import Controller, RangeAllocator
+
+
+def test_controller_sizes_from_throughput():
+    controller = Controller(4)
+    controller.observe(1024 ** 2 * 100, 1)  # 100MB/s
+    assert controller.fragment == c.FRAGMENT_SIZE
+    assert controller.chunk == c.MAX_CHUNK_SIZE
+
+    slow = Controller(4)
+    slow.observe(1024 * 10, 1)  # 10KB/s
+    assert slow.fragment == c.MIN_FRAGMENT_SIZE
+    assert slow.chunk == c.MIN_CHUNK_SIZE
+
+    medium = Controller(4)
+    medium.observe(1024 ** 2, 1)  # 1MB/s
+    assert medium.fragment == 1024 ** 2 * c.RANGE_SECONDS
+    assert c.MIN_CHUNK_SIZE <= medium.chunk <= c.MAX_CHUNK_SIZE
+    assert medium.chunk & (medium.chunk - 1) == 0
+
+
+def test_controller_climbs_connections(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(adaptive.time, "time", lambda: now[0])
+    controller = Controller(4)
+    assert controller.connections == 2
+
+    def window(total_rate):
+        now[0] += 1
+        for _ in range(controller.connections):
+            controller.observe(int(total_rate / controller.connections), 1)
+
+    window(1000)
+    assert controller.connections == 3
+    window(2000)
+    assert controller.connections == 4
+    window(2100)  # no better, stay
+    assert controller.connections == 4
+    window(1000)  # worse, step back
+    assert controller.connections == 3
+
+
+def test_range_allocator_covers_gaps():
+    size = c.MIN_FRAGMENT_SIZE * 10
+    ranges = RangeAllocator([(0, size // 2), (size // 2 + 100, size)])
+    pieces = []
+    while 1:
+        piece = ranges.take(c.MIN_FRAGMENT_SIZE * 3, connections=2)
+        if piece is None:
+            break
+        pieces.append(piece)
+    assert pieces[0] == (0, c.MIN_FRAGMENT_SIZE * 3)
+    assert sum(end - start for start, end in pieces) == size - 100
+    assert all(end - start <= c.MIN_FRAGMENT_SIZE * 3 for start, end in pieces)
+    assert ranges.remaining == 0
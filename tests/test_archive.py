@@ -0,0 +1,25 @@
+from xvideos_dl.archive import Archive
+
+
+def test_archive_add_and_lookup(tmp_path):
+    archive = Archive(tmp_path / "archive.sqlite3")
+    assert "1" not in archive
+    archive.add("1", tmp_path / "one(#1).mp4", 1024, "720p")
+    assert "1" in archive
+    assert "1" in Archive(tmp_path / "archive.sqlite3")
+    assert len(archive) == 1
+
+
+def test_archive_rebuild(tmp_path):
+    dest = tmp_path / "xvideos"
+    (dest / "someone").mkdir(parents=True)
+    (dest / "one(#1).mp4").write_bytes(b"1")
+    (dest / "someone" / "two(#2).mp4").write_bytes(b"22")
+    (dest / "someone" / "three(#3).mp4").write_bytes(b"3")
+    (dest / "someone" / "three(#3).mp4.journal").write_text("{}")
+    (dest / "notes.mp4").write_bytes(b"")
+
+    archive = Archive(tmp_path / "archive.sqlite3")
+    archive.add("9", dest / "gone(#9).mp4", 9)
+    assert archive.rebuild(dest) == 2
+    assert ("1" in archive, "2" in archive, "3" in archive, "9" in archive) == (True, True, False, False)
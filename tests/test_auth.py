@@ -0,0 +1,86 @@
+import os
+import threading
+
+import pytest
+from xvideos_dl import xvideos_dl
+from xvideos_dl.auth import CookieExpired, CookieStore, SessionPool
+from xvideos_dl.xvideos_dl import get_session, request_with_cookie
+
+
+@pytest.fixture
+def pool(tmp_path):
+    return SessionPool(get_session, CookieStore(tmp_path))
+
+
+def test_cookie_store_reads_a_file_once_until_it_changes(tmp_path):
+    store = CookieStore(tmp_path)
+    assert store.read() is None
+    store.save("a=1")
+    path = tmp_path / "cookie"
+    stat = path.stat()
+    path.write_text("a=2")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert store.read() == "a=1"
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert store.read() == "a=2"
+
+
+def test_accounts_are_taken_in_turn(pool, tmp_path):
+    pool.store.save("a=1")
+    pool.store.save("b=2", "second")
+    assert [account.name for account in pool.accounts()] == ["default", "second"]
+    assert {pool.take().name for _ in range(4)} == {"default", "second"}
+    second = pool.accounts()[1]
+    assert second.session.cookies.get("b") == "2"
+    assert second.session.get_adapter("https://") is get_session().get_adapter("https://")
+
+    pool.expire(second)
+    assert {pool.take().name for _ in range(4)} == {"default"}
+    pool.store.save("b=3", "second")
+    assert [account.cookie for account in pool.accounts()] == ["a=1", "b=3"]
+
+
+def test_expired_without_terminal(pool):
+    pool.interactive = False
+    pool.store.save("a=1")
+    pool.expire(pool.take())
+    with pytest.raises(CookieExpired):
+        pool.take()
+
+
+def test_one_thread_asks_for_a_cookie(pool, monkeypatch):
+    pool.store.save("a=1")
+    pool.expire(pool.take())
+    asked = []
+    monkeypatch.setattr("builtins.input", lambda prompt: asked.append(prompt) or "a=2")
+    taken = []
+    threads = [threading.Thread(target=lambda: taken.append(pool.take().cookie)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(asked) == 1
+    assert taken == ["a=2"] * 8
+    assert pool.store.read() == "a=2"
+
+
+def test_request_with_cookie_expires_rejected_accounts(monkeypatch, tmp_path):
+    pool = SessionPool(get_session, CookieStore(tmp_path))
+    pool.store.save("session=old")
+    pool.store.save("session=good", "second")
+    monkeypatch.setattr(xvideos_dl, "session_pool", pool)
+
+    class Response:
+        def __init__(self, data):
+            self.data = data
+
+        def json(self):
+            return self.data
+
+    def fake_request(method, url, session=None):
+        return Response({"logged": session.cookies.get("session") == "good"})
+
+    monkeypatch.setattr(xvideos_dl, "session_request", fake_request)
+    for _ in range(3):
+        assert request_with_cookie("POST", "https://www.xvideos.com/api", "logged", False) == {"logged": True}
+    assert [account.name for account in pool.accounts()] == ["second"]
@@ -0,0 +1,68 @@
+import threading
+from email.utils import formatdate
+
+import pytest
+from requests import HTTPError, Response
+from xvideos_dl import backoff
+from xvideos_dl.backoff import CircuitBreaker, is_retryable, retry_after
+
+
+def make_response(status, **headers):
+    resp = Response()
+    resp.status_code = status
+    resp.headers.update(headers)
+    return resp
+
+
+def test_retry_after():
+    assert retry_after(make_response(429, **{"Retry-After": "7"})) == 7
+    assert 50 < retry_after(make_response(503, **{"Retry-After": formatdate(backoff.time.time() + 60)})) <= 60
+    assert retry_after(make_response(503)) is None
+    assert retry_after(None) is None
+
+
+def test_is_retryable():
+    assert is_retryable(HTTPError(response=make_response(503)))
+    assert is_retryable(HTTPError(response=make_response(429)))
+    assert not is_retryable(HTTPError(response=make_response(403)))
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(threshold=2, cooldown=0.2)
+    breaker.acquire("a")
+    breaker.failure("a")
+    breaker.acquire("a")
+    breaker.failure("a")
+    breaker.acquire("b")  # other hosts are not affected
+
+    started = backoff.time.time()
+    breaker.acquire("a")  # the probe, once the cooldown is over
+    assert backoff.time.time() - started >= 0.15
+
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (breaker.acquire("a"), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.1)  # waits for the outcome of the probe
+    breaker.success("a")
+    assert acquired.wait(5)
+    waiter.join()
+
+
+def test_call_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr(backoff, "breaker", CircuitBreaker())
+    monkeypatch.setattr(backoff.time, "sleep", lambda seconds: None)
+    statuses = [503, 429, 200]
+
+    def request():
+        resp = make_response(statuses.pop(0))
+        resp.raise_for_status()
+        return resp
+
+    assert backoff.call(request, "https://example.com/").status_code == 200
+    assert not statuses
+
+    def forbidden():
+        make_response(403).raise_for_status()
+
+    with pytest.raises(HTTPError):
+        backoff.call(forbidden, "https://example.com/")
@@ -0,0 +1,43 @@
+import time
+
+from xvideos_dl.cache import MetadataCache
+
+
+def test_cache_persists_across_instances(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    MetadataCache(path).set("title:1", "One", ttl=60)
+    assert MetadataCache(path).get("title:1") == "One"
+    assert MetadataCache(path).get("title:2") is None
+
+
+def test_cache_expires(tmp_path, monkeypatch):
+    cache = MetadataCache(tmp_path / "cache.sqlite3")
+    cache.set("hls:1", [["360p", "423936", "360x640", "https://cdn/1.m3u8"]], ttl=10)
+    assert cache.get("hls:1") == [["360p", "423936", "360x640", "https://cdn/1.m3u8"]]
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("hls:1") is None
+    assert MetadataCache(cache.path).get("hls:1") is None
+
+
+def test_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    path = tmp_path / "cache.sqlite3"
+    cache = MetadataCache(path, max_entries=2)
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(time, "time", lambda: next(clock))
+    cache.set("a", 1, ttl=100)
+    cache.set("b", 2, ttl=100)
+    assert MetadataCache(path).get("a") == 1  # a is now more recent than b
+    cache.set("c", 3, ttl=100)
+
+    fresh = MetadataCache(path)
+    assert (fresh.get("a"), fresh.get("b"), fresh.get("c")) == (1, None, 3)
+
+
+def test_cache_disabled_keeps_memo_only(tmp_path):
+    cache = MetadataCache(tmp_path / "cache.sqlite3")
+    cache.enabled = False
+    cache.set("title:1", "One", ttl=60)
+    assert cache.get("title:1") == "One"
+    assert not cache.path.exists()
@@ -0,0 +1,211 @@
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+import pytest
+from benchmarks.mock_cdn import MockCDN
+from typer.testing import CliRunner
+from xvideos_dl import backoff, cache
+from xvideos_dl import constant as c
+from xvideos_dl import xvideos_dl
+from xvideos_dl.__main__ import app
+from xvideos_dl.integrity import read_sidecar
+from xvideos_dl.ratelimit import TokenBucket
+from xvideos_dl.xvideos_dl import Video, download_mp4_resource, get_videos_from_user_page
+
+
+@pytest.fixture
+def cdn(tmp_path, monkeypatch):
+    # The cookie is read from and saved to the home directory
+    monkeypatch.setenv("HOME", str(tmp_path))
+    with MockCDN(mp4_size=1024 ** 2, pages=2, videos_per_page=5) as cdn, cdn.patch():
+        yield cdn
+
+
+def test_download_mp4_resource_offline(cdn, tmp_path):
+    video = Video(vid="1", vname="one", pname="", uname="", vpage="")
+    path = download_mp4_resource(video, tmp_path / "one(#1).mp4", True, False, False, connections=3, quiet=True)
+    assert path.read_bytes() == cdn.mp4("1")
+
+
+def test_get_videos_from_user_page_offline(cdn):
+    videos = get_videos_from_user_page(f"{c.HOST}/profiles/mock", "0", c.USER_UPLOAD_API, [])
+    assert len(videos) == 10
+    assert cdn.requests == 2
+
+
+def test_main_offline(cdn, tmp_path):
+    url = c.VIDEO_PAGE.format(vid=2)
+    result = CliRunner().invoke(app, [url, "-d", str(tmp_path / "xvideos"), "-q", "low", "--progress", "quiet"])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "xvideos" / "Mock video 2(#2).mp4").read_bytes() == cdn.mp4("2")
+
+
+def test_download_mp4_resource_resumes_broken_ranges(cdn, tmp_path, monkeypatch):
+    monkeypatch.setattr(xvideos_dl.time, "sleep", lambda seconds: None)
+    cdn.drop_rate = 0.5
+    video = Video(vid="3", vname="three", pname="", uname="", vpage="")
+    path = download_mp4_resource(video, tmp_path / "three(#3).mp4", True, False, False, connections=2, quiet=True)
+    assert path.read_bytes() == cdn.mp4("3")
+
+
+def test_download_mp4_resource_limit_rate(cdn, tmp_path):
+    video = Video(vid="4", vname="four", pname="", uname="", vpage="")
+    limit = TokenBucket(1024 ** 2 * 4, burst=0)
+    started = time.time()
+    download_mp4_resource(video, tmp_path / "four(#4).mp4", True, False, False, 2, True, limit)
+    assert time.time() - started >= 0.24
+
+
+def test_main_verify_archive(cdn, tmp_path):
+    dest = tmp_path / "xvideos"
+    args = ["-d", str(dest), "--archive", str(tmp_path / "archive.sqlite3")]
+    url = c.VIDEO_PAGE.format(vid=5)
+    result = CliRunner().invoke(app, [url, "-q", "low", "--progress", "quiet"] + args)
+    assert result.exit_code == 0, result.output
+    path = dest / "Mock video 5(#5).mp4"
+    assert read_sidecar(path)["size"] == len(cdn.mp4("5"))
+
+    result = CliRunner().invoke(app, ["--verify-archive", "--verify", "full"] + args)
+    assert result.exit_code == 0, result.output
+    with open(path, "r+b") as f:
+        f.write(b"broken")
+    result = CliRunner().invoke(app, ["--verify-archive", "--verify", "full"] + args)
+    assert result.exit_code == 1
+    assert "(#5).mp4" in result.output
+
+
+def test_main_metrics_file(cdn, tmp_path):
+    url = c.VIDEO_PAGE.format(vid=8)
+    args = [
+        url,
+        "-d",
+        str(tmp_path / "xvideos"),
+        "-q",
+        "low",
+        "--progress",
+        "quiet",
+        "--metrics-file",
+        str(tmp_path / "m.jsonl"),
+    ]
+    result = CliRunner().invoke(app, args + ["--profile", str(tmp_path / "download.prof")])
+    assert result.exit_code == 0, result.output
+    events = [json.loads(line) for line in (tmp_path / "m.jsonl").read_text().splitlines()]
+    names = {event["event"] for event in events}
+    assert {"http_request", "resolve", "fragment", "stage", "summary"} <= names
+    assert (tmp_path / "download.prof").is_file()
+
+
+def test_main_resolves_from_one_page_fetch(cdn, tmp_path):
+    url = c.VIDEO_PAGE.format(vid=9)
+    result = CliRunner().invoke(app, [url, "-d", str(tmp_path / "xvideos"), "-q", "middle", "--progress", "quiet"])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "xvideos" / "Mock video 9(#9).mp4").read_bytes() == cdn.mp4("9")
+    assert sum(path.startswith("/video9/") for path in cdn.paths) == 1
+    assert not [path for path in cdn.paths if path.startswith("/video-download/")]
+
+
+def test_main_shards_split_a_playlist(cdn, tmp_path):
+    url = f"{c.HOST}/profiles/mock"
+    downloaded = []
+    for shard in ("1/2", "2/2"):
+        dest = tmp_path / shard.replace("/", "of")
+        args = [url, "-d", str(dest), "-q", "low", "--progress", "quiet", "--shard", shard, "-j", "2"]
+        result = CliRunner().invoke(app, args + ["--ledger", str(tmp_path / "ledger.sqlite3")])
+        assert result.exit_code == 0, result.output
+        downloaded.append({path.name for path in dest.rglob("*.mp4")})
+    assert downloaded[0] and downloaded[1] and not downloaded[0] & downloaded[1]
+    assert len(downloaded[0] | downloaded[1]) == 10
+
+
+def test_download_mp4_resource_leaves_no_partial_file(cdn, tmp_path):
+    video = Video(vid="6", vname="six", pname="", uname="", vpage="")
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(xvideos_dl.Cancelled):
+        download_mp4_resource(video, tmp_path / "six(#6).mp4", True, False, False, 2, True, cancel=cancel)
+    assert not (tmp_path / "six(#6).mp4").exists()
+    assert (tmp_path / "six(#6).mp4.part").is_file()
+
+    path = download_mp4_resource(video, tmp_path / "six(#6).mp4", False, False, False, 2, True)
+    assert path.read_bytes() == cdn.mp4("6")
+    assert not (tmp_path / "six(#6).mp4.part").exists()
+
+
+def test_main_plan(cdn, tmp_path):
+    dest = tmp_path / "xvideos"
+    url = f"{c.HOST}/profiles/mock"
+    result = CliRunner().invoke(app, [url, "-d", str(dest), "-q", "low", "--plan", "--progress", "json", "-j", "2"])
+    assert result.exit_code == 0, result.output
+    plan = json.loads(result.output.splitlines()[-1])
+    assert plan["videos"] == len(plan["estimates"]) == 10
+    assert plan["download_bytes"] == 10 * len(cdn.mp4("1"))
+    assert plan["fits"] and plan["throughput"] > 0 and plan["eta_seconds"] > 0
+    assert not dest.exists()
+    # Only a sample of two videos was fetched, for the throughput
+    assert cdn.bytes_sent < 4 * len(cdn.mp4("1"))
+
+    result = CliRunner().invoke(app, [url, "-d", str(dest), "-q", "high", "--plan"])
+    assert result.exit_code == 0, result.output
+    assert "≈" in result.output and "ETA" in result.output
+
+
+def test_fetch_hls_stream_resumes_broken_segments(cdn, tmp_path, monkeypatch):
+    monkeypatch.setattr(xvideos_dl.time, "sleep", lambda seconds: None)
+    cdn.drop_rate = 0.3
+    hls = xvideos_dl.get_hls_list(Video(vid="7", vname="seven", pname="", uname="", vpage=c.VIDEO_PAGE.format(vid=7)))
+    path, stream = xvideos_dl.fetch_hls_stream(hls[0].url, tmp_path / "seven(#7).mp4", False, connections=3, quiet=True)
+    segments = [cdn.segment("7", hls[0].name, i) for i in range(cdn.segments)]
+    assert stream.read_bytes() == b"".join(segments)
+
+
+def test_main_waits_out_an_open_circuit(cdn, tmp_path, monkeypatch):
+    breaker = backoff.CircuitBreaker(threshold=1, cooldown=0.3)
+    monkeypatch.setattr(backoff, "breaker", breaker)
+    breaker.failure(urlsplit(cdn.host).netloc)
+    dest = tmp_path / "xvideos"
+    started = time.time()
+    args = [f"{c.HOST}/profiles/mock", "-d", str(dest), "-q", "low", "--progress", "quiet", "-j", "4"]
+    result = CliRunner().invoke(app, args + ["--ledger", str(tmp_path / "ledger.sqlite3")])
+    assert result.exit_code == 0, result.output
+    assert time.time() - started >= 0.3
+    assert len(list(dest.rglob("*.mp4"))) == 10
+
+
+def test_fetch_hls_stream_resumes_only_the_same_variant(cdn, tmp_path):
+    hls = xvideos_dl.get_hls_list(Video(vid="7", vname="seven", pname="", uname="", vpage=c.VIDEO_PAGE.format(vid=7)))
+    low, high = hls[0], hls[-1]
+    save_name = tmp_path / "seven(#7).mp4"
+    xvideos_dl.fetch_hls_stream(high.url, save_name, False, connections=3, quiet=True)
+    # Resumed as another variant, with as many segments, the stream starts over
+    path, stream = xvideos_dl.fetch_hls_stream(low.url, save_name, False, connections=3, quiet=True)
+    assert stream.read_bytes() == b"".join(cdn.segment("7", low.name, i) for i in range(cdn.segments))
+
+    requests = len(cdn.paths)
+    path, stream = xvideos_dl.fetch_hls_stream(low.url, save_name, True, connections=3, quiet=True)
+    assert stream.read_bytes() == b"".join(cdn.segment("7", low.name, i) for i in range(cdn.segments))
+    assert sum(p.endswith(".ts") for p in cdn.paths[requests:]) == cdn.segments
+
+
+def test_mock_cdn_leaves_the_metadata_cache_alone(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    metadata_cache = cache.MetadataCache(tmp_path / "cache.sqlite3")
+    metadata_cache.set("title:1", "Kept", ttl=60)
+    monkeypatch.setattr(cache, "metadata_cache", metadata_cache)
+    monkeypatch.setattr(xvideos_dl, "metadata_cache", metadata_cache)
+    with MockCDN(mp4_size=1024) as cdn, cdn.patch():
+        url = c.VIDEO_PAGE.format(vid=1)
+        result = CliRunner().invoke(app, [url, "-d", str(tmp_path / "xvideos"), "-q", "low", "--progress", "quiet"])
+        assert result.exit_code == 0, result.output
+    assert cache.metadata_cache is metadata_cache
+    assert cache.MetadataCache(tmp_path / "cache.sqlite3").get("title:1") == "Kept"
+
+
+def test_main_json_progress_keeps_stdout_to_json(cdn, tmp_path):
+    url = c.VIDEO_PAGE.format(vid=2)
+    result = CliRunner().invoke(app, [url, "-d", str(tmp_path / "xvideos"), "-q", "low", "--progress", "json"])
+    assert result.exit_code == 0, result.output
+    states = [json.loads(line) for line in result.stdout.splitlines()]
+    assert states[-1]["finished"]
+    assert "Video ID" in result.stderr
@@ -0,0 +1,62 @@
+import os
+import random
+
+from xvideos_dl.integrity import BlockHasher, Verifier, hash_blocks, hash_file, read_sidecar, write_sidecar
+
+BLOCK = 1024
+
+
+def test_block_hasher_out_of_order(tmp_path):
+    data = os.urandom(BLOCK * 5 + 100)
+    path = tmp_path / "video.mp4"
+    path.write_bytes(data)
+    pieces = [(offset, data[offset : offset + 300]) for offset in range(0, len(data), 300)]
+    random.Random(1).shuffle(pieces)
+
+    hasher = BlockHasher(len(data), BLOCK)
+    for offset, piece in pieces:
+        hasher.update(offset, piece)
+    expected = hash_blocks(path, block=BLOCK)
+    assert hasher.digests(path) == [expected[i] for i in range(6)]
+
+
+def test_block_hasher_reads_back_missing_blocks(tmp_path):
+    data = os.urandom(BLOCK * 3)
+    path = tmp_path / "video.mp4"
+    path.write_bytes(data)
+    hasher = BlockHasher(len(data), BLOCK)
+    hasher.update(BLOCK + 10, data[BLOCK + 10 :])  # the rest was written by an earlier run
+    expected = hash_blocks(path, block=BLOCK)
+    assert hasher.digests(path) == [expected[i] for i in range(3)]
+
+
+def test_verifier_modes(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(os.urandom(BLOCK * 8))
+    blocks = hash_blocks(path, block=BLOCK)
+    root = write_sidecar(path, [blocks[i] for i in range(8)], BLOCK)
+    assert read_sidecar(path)["root"] == root
+    for mode in ("fast", "sample", "full"):
+        assert Verifier(mode).verify(str(path))
+
+    # Flip a byte in the middle but keep the size and modification time
+    stat = path.stat()
+    with open(path, "r+b") as f:
+        f.seek(BLOCK * 4)
+        byte = f.read(1)
+        f.seek(BLOCK * 4)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert Verifier("fast").verify(str(path))
+    assert not Verifier("full").verify(str(path))
+
+    with open(path, "ab") as f:
+        f.write(b"\0")
+    assert not Verifier("sample").verify(str(path))
+
+
+def test_hash_file(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"")
+    assert hash_file(path) == read_sidecar(path)["root"]
+    assert Verifier("full").verify(str(path))
@@ -0,0 +1,40 @@
+from xvideos_dl.journal import Journal, checksum, verified_ranges, verified_segments
+
+
+def test_journal_roundtrip(tmp_path):
+    target = tmp_path / "video.mp4"
+    journal = Journal(target)
+    header = {"kind": "mp4", "size": 8}
+    assert journal.load(header) == []
+
+    journal.start(header, [])
+    journal.record(start=0, end=4, crc=1)
+    with open(journal.path, "a") as f:
+        f.write('{"start": 4, "en')  # interrupted while writing
+    assert journal.path.name == "video.mp4.journal"
+    assert journal.load(header) == [{"start": 0, "end": 4, "crc": 1}]
+    assert journal.load({"kind": "mp4", "size": 9}) == []
+
+    journal.remove()
+    assert not journal.exists()
+
+
+def test_verified_ranges(tmp_path):
+    target = tmp_path / "video.mp4"
+    target.write_bytes(b"abcdefgh")
+    records = [
+        {"start": 0, "end": 4, "crc": checksum(b"abcd")},
+        {"start": 4, "end": 8, "crc": checksum(b"xxxx")},
+    ]
+    assert verified_ranges(target, records) == records[:1]
+
+
+def test_verified_segments(tmp_path):
+    stream = tmp_path / "video.mp4.ts"
+    stream.write_bytes(b"aaabbbccc")
+    records = [
+        {"index": 1, "offset": 3, "length": 3, "crc": checksum(b"bbb")},
+        {"index": 0, "offset": 0, "length": 3, "crc": checksum(b"aaa")},
+        {"index": 3, "offset": 9, "length": 3, "crc": checksum(b"ddd")},
+    ]
+    assert [r["index"] for r in verified_segments(stream, records)] == [0, 1]
@@ -0,0 +1,131 @@
+import types
+
+import pytest
+from xvideos_dl import ledger as ledger_module
+from xvideos_dl import xvideos_dl
+from xvideos_dl.ledger import Ledger, in_shard, parse_shard
+from xvideos_dl.xvideos_dl import Video, download_many
+
+LEASE = 60
+
+
+def video(vid):
+    return Video(vid=vid, vname=f"v{vid}", pname="", uname="", vpage=f"https://www.xvideos.com/video{vid}/_")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ledger_module, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def ledgers(tmp_path, clock):
+    opened = []
+
+    def open_ledger(worker):
+        ledger = Ledger(tmp_path / "ledger.sqlite3", worker, lease=LEASE)
+        opened.append(ledger)
+        return ledger
+
+    yield open_ledger
+    for ledger in opened:
+        ledger.close()
+
+
+@pytest.mark.parametrize("shard", ["0/3", "3", "a/b", "2/1"])
+def test_parse_shard_invalid(shard):
+    with pytest.raises(ValueError):
+        parse_shard(shard)
+
+
+def test_shards_split_every_video_once():
+    vids = [str(vid) for vid in range(1000, 1300)]
+    owners = [[i for i in range(1, 4) if in_shard(vid, i, 3)] for vid in vids]
+    assert all(len(owner) == 1 for owner in owners)
+    assert all(60 < sum(owner == [i] for owner in owners) < 140 for i in range(1, 4))
+
+
+def test_claim_once_across_workers(ledgers):
+    a, b = ledgers("a"), ledgers("b")
+    assert a.claim(video("1"))
+    assert not a.claim(video("1"))
+    assert not b.claim(video("1"))
+    a.complete("1")
+    assert not b.claim(video("1"))
+    assert not a.claim(video("1"))
+
+
+def test_complete_needs_the_claim(ledgers, clock):
+    a, b = ledgers("a"), ledgers("b")
+    a.claim(video("1"))
+    clock[0] += LEASE + 1
+    assert b.claim(video("1"))
+    a.complete("1")
+    b.fail("1", "boom")
+    assert a.claim(video("1"))
+
+
+def test_failed_video_is_retried_elsewhere(ledgers):
+    a, b = ledgers("a"), ledgers("b")
+    a.claim(video("1"))
+    a.fail("1", "boom")
+    assert list(a.orphans()) == []
+    assert list(b.orphans()) == [tuple(video("1"))]
+    assert b.claim(video("1"))
+    b.fail("1", "boom")
+    a.claim(video("1"))
+    a.fail("1", "boom")
+    assert not b.claim(video("1"))
+
+
+def test_orphans_of_a_stopped_worker(ledgers, clock):
+    a, b, d = ledgers("a"), ledgers("b"), ledgers("d")
+    a.claim(video("1"))
+    a.claim(video("2"))
+    a.complete("2")
+    assert not b.claim(video("1"))
+    clock[0] += LEASE + 1
+    orphans = b.orphans()
+    assert next(orphans) == tuple(video("1"))
+    # Taken by another worker in the meantime, which stops too
+    assert d.claim(video("1"))
+    clock[0] += LEASE + 1
+    assert next(orphans) == tuple(video("1"))
+    assert b.claim(video("1"))
+    assert list(orphans) == []
+
+
+def test_heartbeat_keeps_claims(ledgers, clock):
+    a, b = ledgers("a"), ledgers("b")
+    a.claim(video("1"))
+    clock[0] += LEASE * 0.9
+    a.beat()
+    clock[0] += LEASE * 0.9
+    assert not b.claim(video("1"))
+    clock[0] += LEASE * 0.2
+    assert b.claim(video("1"))
+
+
+def test_download_many_with_ledger(ledgers, clock, monkeypatch):
+    fetched = []
+
+    def fake_fetch_video(plan, *args, **kwargs):
+        fetched.append(plan.video.vid)
+        return xvideos_dl.Fetched(plan, None, None)
+
+    monkeypatch.setattr(xvideos_dl, "resolve_video", lambda video, *args: xvideos_dl.Plan(video, None, None, None))
+    monkeypatch.setattr(xvideos_dl, "fetch_video", fake_fetch_video)
+    a, b = ledgers("a"), ledgers("b")
+    for vid in "2378":
+        b.claim(video(vid))
+    b.fail("3", "boom")
+    b.complete("8")
+    clock[0] += LEASE + 1
+    videos = [video(str(i)) for i in range(5)]
+    failures = download_many(iter(videos), len(videos), 2, "./xvideos", "high", False, False, ledger=a)
+    assert failures == []
+    assert sorted(fetched) == ["0", "1", "2", "3", "4", "7"]
+    # Nothing was written, so no video is done
+    assert sorted(vid for vid, *_ in b.orphans()) == ["0", "1", "2", "3", "4", "7"]
@@ -0,0 +1,64 @@
+from xvideos_dl.m3u8 import parse_master, parse_media
+from xvideos_dl.xvideos_dl import parse_hls, parse_hls_list, parse_media_playlist
+
+MASTER = """#EXTM3U
+# recorded from the CDN, with an audio rendition added
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aac",NAME="English",DEFAULT=YES,URI="audio.m3u8"
+
+#EXT-X-STREAM-INF:PROGRAM-ID=1,BANDWIDTH=423936,RESOLUTION=360x640,NAME="360p",CODECS="avc1.4d401e,mp4a.40.2"
+hls-360p-045d9.m3u8
+#EXT-X-STREAM-INF:PROGRAM-ID=1,BANDWIDTH=155648,RESOLUTION=250x444,NAME="250p"
+# a comment between the tag and its URI
+hls-250p-639f7.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=1572864,RESOLUTION=1280x720,AUDIO="aac"
+https://other.example.com/hls-720p.m3u8
+"""
+
+MEDIA = """#EXTM3U
+#EXT-X-TARGETDURATION:10
+#EXT-X-BYTERANGE:1000@0
+#EXTINF:10.0,
+video.ts
+#EXTINF:10.0,
+#EXT-X-BYTERANGE:500
+video.ts
+#EXT-X-KEY:METHOD=NONE
+#EXTINF:5.0,
+#EXT-X-BYTERANGE:200@4000
+video.ts
+#EXT-X-ENDLIST
+"""
+
+
+def test_parse_master():
+    master = parse_master(MASTER)
+    assert [v.uri for v in master.variants] == [
+        "hls-360p-045d9.m3u8",
+        "hls-250p-639f7.m3u8",
+        "https://other.example.com/hls-720p.m3u8",
+    ]
+    assert master.variants[0].attributes["CODECS"] == "avc1.4d401e,mp4a.40.2"
+    assert master.media == [dict(TYPE="AUDIO", **{"GROUP-ID": "aac"}, NAME="English", DEFAULT="YES", URI="audio.m3u8")]
+
+
+def test_parse_hls_list():
+    hls_list = parse_hls_list("https://cdn.example.com/videos/hls/hls.m3u8?e=1", MASTER)
+    assert [(h.name, h.bandwidth, h.url) for h in hls_list] == [
+        ("250p", "155648", "https://cdn.example.com/videos/hls/hls-250p-639f7.m3u8"),
+        ("360p", "423936", "https://cdn.example.com/videos/hls/hls-360p-045d9.m3u8"),
+        ("720p", "1572864", "https://other.example.com/hls-720p.m3u8"),
+    ]
+    assert parse_hls("") == []
+
+
+def test_parse_media_byteranges():
+    media = parse_media(MEDIA)
+    assert [s.byterange for s in media.segments] == [(0, 1000), (1000, 500), (4000, 200)]
+    assert not media.encrypted
+    segments = parse_media_playlist(MEDIA, "https://cdn.example.com/hls/index.m3u8")
+    assert [(s.index, s.duration, s.url) for s in segments][-1] == (2, 5.0, "https://cdn.example.com/hls/video.ts")
+
+
+def test_parse_media_encrypted():
+    assert parse_media('#EXTM3U\n#EXT-X-KEY:METHOD=AES-128,URI="key"\n#EXTINF:1,\na.ts\n').encrypted
+    assert not parse_media("#EXTM3U\n#EXT-X-KEY:METHOD=NONE\n#EXTINF:1,\na.ts\n").encrypted
@@ -0,0 +1,52 @@
+import json
+import pstats
+
+import pytest
+from xvideos_dl.metrics import JsonLinesWriter, Profiler, Registry
+
+
+def test_render_counters_and_histograms():
+    registry = Registry(buckets=(0.1, 1.0))
+    registry.inc("downloaded_bytes", 100, kind="mp4")
+    registry.inc("downloaded_bytes", 50, kind="mp4")
+    registry.observe("http_request", 0.05, method="GET")
+    registry.observe("http_request", 0.5, method="GET")
+    registry.observe("http_request", 5, method="GET")
+    text = registry.render()
+    assert 'xvideos_dl_downloaded_bytes_total{kind="mp4"} 150' in text
+    assert 'xvideos_dl_http_request_seconds_bucket{method="GET",le="0.1"} 1' in text
+    assert 'xvideos_dl_http_request_seconds_bucket{method="GET",le="1"} 2' in text
+    assert 'xvideos_dl_http_request_seconds_bucket{method="GET",le="+Inf"} 3' in text
+    assert 'xvideos_dl_http_request_seconds_count{method="GET"} 3' in text
+
+
+def test_span_records_errors_and_calls_hooks(tmp_path):
+    registry = Registry()
+    writer = JsonLinesWriter(str(tmp_path / "metrics.jsonl"))
+    registry.add_hook(writer)
+    with registry.span("fragment", kind="hls") as span:
+        span.fields["url"] = "https://cdn/1.ts"
+    with pytest.raises(IOError):
+        with registry.span("fragment", kind="hls"):
+            raise IOError("gone")
+    writer.close(registry)
+
+    lines = [json.loads(line) for line in (tmp_path / "metrics.jsonl").read_text().splitlines()]
+    assert [line["event"] for line in lines] == ["fragment", "fragment", "summary"]
+    assert lines[0]["url"] == "https://cdn/1.ts" and "error" not in lines[0]
+    assert lines[1]["error"] == "OSError"
+    assert sorted(h["labels"].get("error", "") for h in lines[2]["histograms"]) == ["", "OSError"]
+
+
+def test_profiler(tmp_path):
+    profiler = Profiler()
+    with profiler.profile():
+        pass
+    assert not profiler.stop(str(tmp_path / "none.prof"))
+
+    profiler.enabled = True
+    with profiler.profile():
+        sorted(range(1000), key=lambda i: -i)
+    assert profiler.stop(str(tmp_path / "download.prof"))
+    assert not profiler.enabled
+    assert pstats.Stats(str(tmp_path / "download.prof")).total_calls > 0
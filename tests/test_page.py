@@ -0,0 +1,39 @@
+from xvideos_dl.page import PageScanner, scan_page
+
+PAGE = (
+    b'<html><head><meta property="og:title" content="Tom &amp; Jerry" />\n</head><body>'
+    + b"<div>filler</div>" * 1000
+    + b"<script>html5player.setVideoUrlLow('https://cdn/low.mp4');"
+    + b"html5player.setVideoUrlHigh('https://cdn/high.mp4');"
+    + b"html5player.setVideoHLS('https://cdn/hls.m3u8');</script>"
+    + b"<div>related</div>" * 1000
+)
+EXPECTED = {
+    "title": "Tom & Jerry",
+    "URL": "https://cdn/high.mp4",
+    "URL_LOW": "https://cdn/low.mp4",
+    "hls": "https://cdn/hls.m3u8",
+}
+
+
+def test_scan_page_across_chunks():
+    for size in (7, 100, 4096, len(PAGE)):
+        assert scan_page(PAGE[i : i + size] for i in range(0, len(PAGE), size)) == EXPECTED
+
+
+def test_scan_page_stops_early():
+    read = []
+
+    def chunks():
+        for i in range(0, len(PAGE), 1024):
+            read.append(i)
+            yield PAGE[i : i + 1024]
+
+    assert scan_page(chunks()) == EXPECTED
+    assert len(read) < len(PAGE) // 1024 * 3 // 4
+
+
+def test_scanner_missing_fields():
+    scanner = PageScanner()
+    assert not scanner.feed(b"<html>no player here</html>")
+    assert scanner.found == {}
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+from xvideos_dl.pipeline import Pipeline
+
+
+def test_stages_overlap():
+    spans = {}
+    lock = threading.Lock()
+
+    def stage(name, seconds):
+        def run(value):
+            started = time.time()
+            time.sleep(seconds)
+            with lock:
+                spans[(name, value)] = (started, time.time())
+            return value
+
+        return run
+
+    pipeline = Pipeline([("fetch", stage("fetch", 0.1), 1), ("finalize", stage("finalize", 0.1), 1)])
+    assert sorted(work.value for work in pipeline.run(range(3))) == [0, 1, 2]
+    # Video 0 is finalized while video 1 is fetched
+    assert spans[("finalize", 0)][0] < spans[("fetch", 1)][1]
+
+
+def test_failed_items_skip_the_next_stages():
+    finalized = []
+
+    def fetch(value):
+        if value == 2:
+            raise ValueError("boom")
+        return value * 10
+
+    pipeline = Pipeline([("fetch", fetch, 2), ("finalize", lambda v: finalized.append(v) or v, 1)])
+    works = sorted(pipeline.run(range(4)), key=lambda work: work.item)
+    assert [(w.item, w.value) for w in works if w.error is None] == [(0, 0), (1, 10), (3, 30)]
+    assert [str(w.error) for w in works if w.error is not None] == ["boom"]
+    assert sorted(finalized) == [0, 10, 30]
+
+
+def test_listing_error_is_raised_after_the_listed_items():
+    def items():
+        yield 1
+        yield 2
+        raise IOError("listing broke")
+
+    done = []
+    with pytest.raises(IOError):
+        for work in Pipeline([("fetch", lambda v: v, 1)]).run(items()):
+            done.append(work.value)
+    assert sorted(done) == [1, 2]
+
+
+def test_queues_are_bounded():
+    pulled = []
+    seen = []
+
+    def items():
+        for i in range(100):
+            pulled.append(i)
+            yield i
+
+    def fetch(value):
+        if value == 0:
+            time.sleep(0.2)
+            seen.append(len(pulled))
+        return value
+
+    assert len(list(Pipeline([("fetch", fetch, 1)], depth=1).run(items()))) == 100
+    # While the first item is fetched: one more waits in the queue and one in the feeder
+    assert seen == [3]
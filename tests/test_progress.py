@@ -0,0 +1,40 @@
+import json
+
+import pytest
+from xvideos_dl.progress import ProgressRenderer, Task, format_speed
+
+
+def test_task_counters():
+    task = Task("video", total=200)
+    task.update(50)
+    task.update(1, received=100)
+    assert (task.done, task.received, task.percent) == (51, 150, 25.5)
+
+
+@pytest.mark.parametrize(
+    ("speed", "expected"), [(512, " 512.00B/s"), (2048, "   2.00KB/s"), (3 * 1048576, "   3.00MB/s")]
+)
+def test_format_speed(speed, expected):
+    assert format_speed(speed) == expected
+
+
+def test_json_mode_reports_finished_tasks(capsys):
+    renderer = ProgressRenderer("json", refresh=1000)
+    with renderer.task("video", total=10) as task:
+        task.update(10)
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert lines[-1]["task"] == "video"
+    assert lines[-1]["finished"] is True
+    assert lines[-1]["percent"] == 100.0
+
+
+def test_quiet_mode_prints_nothing(capsys):
+    renderer = ProgressRenderer("quiet")
+    with renderer.task("video", total=10) as task:
+        task.update(5)
+    assert capsys.readouterr().out == ""
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        ProgressRenderer("fancy")
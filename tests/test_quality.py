@@ -0,0 +1,39 @@
+import pytest
+from xvideos_dl.quality import QualityPolicy
+from xvideos_dl.xvideos_dl import HLS
+
+VARIANTS = [
+    HLS("1080p", "4000000", "1080x1920", "hls-1080p.m3u8"),
+    HLS("250p", "155648", "250x444", "hls-250p.m3u8"),
+    HLS("480p", "800000", "480x854", "hls-480p.m3u8"),
+    HLS("360p", "423936", "360x640", "hls-360p.m3u8"),
+    HLS("720p", "1572864", "720x1280", "hls-720p.m3u8"),
+]
+
+
+def names(choice):
+    variant, field = choice
+    return variant.name, field
+
+
+@pytest.mark.parametrize(
+    "policy, quality, expected",
+    [
+        (QualityPolicy(), "high", ("1080p", None)),
+        (QualityPolicy(), "middle", ("480p", None)),
+        (QualityPolicy(), "low", ("250p", "URL_LOW")),
+        (QualityPolicy(max_height=720), "high", ("720p", None)),
+        (QualityPolicy(max_height=400), "high", ("360p", "URL")),
+        (QualityPolicy(max_height=100), "high", ("250p", "URL_LOW")),
+        (QualityPolicy(max_bandwidth=1000000), "high", ("480p", None)),
+        (QualityPolicy(prefer="mp4"), "high", ("360p", "URL")),
+        (QualityPolicy(prefer="hls"), "low", ("250p", None)),
+    ],
+)
+def test_choose(policy, quality, expected):
+    assert names(policy.choose(VARIANTS, quality)) == expected
+
+
+def test_invalid_preference():
+    with pytest.raises(ValueError):
+        QualityPolicy(prefer="flv")
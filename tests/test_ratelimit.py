@@ -0,0 +1,29 @@
+import pytest
+from xvideos_dl import ratelimit
+from xvideos_dl.ratelimit import TokenBucket, parse_rate
+
+
+def test_parse_rate():
+    assert parse_rate("100") == 100
+    assert parse_rate("2M") == 2 * 1024 ** 2
+    assert parse_rate("1g") == 1024 ** 3
+    assert parse_rate("800KB/s") == 800 * 1024
+    with pytest.raises(ValueError):
+        parse_rate("fast")
+
+
+def test_token_bucket(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(1000)
+    assert bucket.reserve(1000) == 0  # the initial burst
+    assert bucket.reserve(500) == 0.5
+    assert bucket.reserve(500) == 1.0
+    now[0] += 1
+    assert bucket.reserve(0) == 0
+    now[0] += 10
+    assert bucket.reserve(1500) == 0.5  # idle time only refills up to the burst
+
+
+def test_unlimited_token_bucket():
+    assert TokenBucket(0).reserve(1024 ** 3) == 0
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+import requests
+from benchmarks.mock_cdn import MockCDN
+from xvideos_dl import constant as c
+from xvideos_dl.server import Daemon, Job, make_server
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    with MockCDN(mp4_size=1024 ** 2, pages=2, videos_per_page=2) as cdn, cdn.patch():
+        daemon = Daemon(str(tmp_path / "xvideos"), "low", False, False, workers=2)
+        server = make_server(daemon, ("127.0.0.1", 0))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        yield cdn, f"http://127.0.0.1:{server.server_address[1]}"
+        server.shutdown()
+        server.server_close()
+        daemon.close()
+
+
+def wait_for(url, statuses=("finished", "failed", "cancelled")):
+    for _ in range(200):
+        job = requests.get(url).json()
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job did not finish: {job}")
+
+
+def test_submit_and_poll(api, tmp_path):
+    cdn, base = api
+    resp = requests.post(f"{base}/jobs", json={"urls": [f"{c.HOST}/profiles/mock", c.VIDEO_PAGE.format(vid=7)]})
+    assert resp.status_code == 201
+    job = wait_for(f"{base}/jobs/{resp.json()['id']}")
+    assert job["status"] == "finished", job
+    assert job["done"] == job["videos"] == 5
+    assert (tmp_path / "xvideos" / "Mock video 7(#7).mp4").read_bytes() == cdn.mp4("7")
+    assert [j["id"] for j in requests.get(f"{base}/jobs").json()] == [job["id"]]
+    metrics = requests.get(f"{base}/metrics")
+    assert metrics.headers["Content-Type"].startswith("text/plain")
+    assert 'xvideos_dl_downloaded_bytes_total{kind="mp4"}' in metrics.text
+
+
+def test_cancel(api):
+    cdn, base = api
+    cdn.bandwidth = 1024 * 64
+    job = requests.post(f"{base}/jobs", json={"urls": c.VIDEO_PAGE.format(vid=8)}).json()
+    wait_for(f"{base}/jobs/{job['id']}", statuses=("running",))
+    assert requests.delete(f"{base}/jobs/{job['id']}").status_code == 200
+    assert wait_for(f"{base}/jobs/{job['id']}")["status"] == "cancelled"
+
+
+def test_invalid_requests(api):
+    cdn, base = api
+    assert requests.post(f"{base}/jobs", json={"quality": "low"}).status_code == 400
+    assert requests.post(f"{base}/jobs", json={"urls": ["x"], "quality": "4k"}).status_code == 400
+    assert requests.get(f"{base}/jobs/nope").status_code == 404
+    assert requests.delete(f"{base}/jobs/nope").status_code == 404
+
+
+def test_finished_jobs_are_pruned(tmp_path):
+    daemon = Daemon(str(tmp_path / "xvideos"), "low", False, False, retention=60, max_finished=2)
+    now = time.time()
+    jobs = [Job([c.VIDEO_PAGE.format(vid=i)], daemon.dest, "low", False) for i in range(5)]
+    for job, finished in zip(jobs, [now - 120, now - 30, now - 20, now - 10, None]):
+        job.finished = finished
+        daemon.jobs[job.id] = job
+    daemon.prune()
+    assert list(daemon.jobs) == [jobs[2].id, jobs[3].id, jobs[4].id]
+    daemon.close()
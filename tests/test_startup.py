@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+HEAVY = ("bs4", "ffmpeg", "integv", "requests", "http.server", "xvideos_dl.xvideos_dl")
+IMPORT_BUDGET = 0.15  # seconds, about 0.05 now, and 0.2 once the downloader and requests are imported too
+
+
+def loaded_after(code: str) -> str:
+    check = f"import sys; {code}; print(' '.join(m for m in {HEAVY!r} if m in sys.modules))"
+    return subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, check=True).stdout.strip()
+
+
+def test_import_cli_is_light():
+    assert loaded_after("import xvideos_dl.__main__") == ""
+
+
+def test_version_is_light():
+    code = (
+        "from typer.testing import CliRunner; from xvideos_dl.__main__ import app; "
+        "assert CliRunner().invoke(app, ['--version']).exit_code == 0"
+    )
+    assert loaded_after(code) == ""
+
+
+def import_seconds(module: str) -> float:
+    """Cumulative import time of a module in a fresh interpreter, as reported by -X importtime."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True
+    ).stderr
+    for line in stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative) / 1e6
+    raise AssertionError(f"{module} not in the -X importtime output")
+
+
+def test_import_cli_within_budget():
+    # The best of a few runs, so that a busy machine does not fail the test
+    assert min(import_seconds("xvideos_dl.__main__") for _ in range(3)) < IMPORT_BUDGET
@@ -0,0 +1,40 @@
+import pytest
+from xvideos_dl.writer import WritePolicy, Writer, part_path
+
+
+class Recorder(Writer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writes = []
+
+    def write_at(self, offset, data):
+        self.writes.append((offset, len(data)))
+        super().write_at(offset, data)
+
+
+def test_buffer_writes_at_aligned_offsets(tmp_path):
+    data = bytes(range(256)) * 40
+    with Recorder(tmp_path / "video.mp4", len(data), WritePolicy(buffer_size=1024)) as writer:
+        buffer = writer.buffer(100)
+        for i in range(100, len(data), 300):
+            buffer.write(data[i : i + 300])
+        buffer.flush()
+        assert writer.writes == [(100, 924)] + [(offset, 1024) for offset in range(1024, len(data), 1024)]
+        writer.write_at(0, data[:100])
+        assert not (tmp_path / "video.mp4").exists()
+        writer.commit()
+    assert (tmp_path / "video.mp4").read_bytes() == data
+    assert not part_path(tmp_path / "video.mp4").exists()
+
+
+def test_writer_keeps_part_without_commit(tmp_path):
+    with pytest.raises(KeyboardInterrupt), Writer(tmp_path / "video.mp4", 10, WritePolicy(fsync="always")) as writer:
+        writer.write_at(0, b"12345")
+        raise KeyboardInterrupt
+    assert not (tmp_path / "video.mp4").exists()
+    assert part_path(tmp_path / "video.mp4").read_bytes() == b"12345" + bytes(5)
+
+
+def test_write_policy_fsync():
+    with pytest.raises(ValueError):
+        WritePolicy(fsync="sometimes")
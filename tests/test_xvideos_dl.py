@@ -1,13 +1,26 @@
+from types import SimpleNamespace
+
 import pytest
+from xvideos_dl import xvideos_dl
+from xvideos_dl.auth import CookieExpired, parse_cookies
 from xvideos_dl.xvideos_dl import (
-    download,
+    Video,
+    download_many,
     get_video_full_name,
     get_video_url,
-    parse_cookies,
+    is_encrypted_playlist,
+    iter_videos_from_urls,
+    iter_videos_from_user_page,
+    parse_media_playlist,
+    parse_thumb_blocks,
+    parse_user_page,
     parse_video_id,
     parse_video_name,
+    parse_video_title,
+    read_batch_file,
     read_cookie,
     save_cookie,
+    split_ranges,
 )
 
 COOKIE = (
@@ -148,3 +161,165 @@ def test_get_video_full_name(index, expected):
 )
 def test_get_video_url(vid, expected):
     assert get_video_url(vid, False, False).split("?")[0] == expected.split("?")[0]
+
+
+@pytest.mark.parametrize(
+    ("size", "connections", "expected"),
+    [
+        (0, 4, []),
+        (10, 1, [(0, 10)]),
+        (10, 3, [(0, 4), (4, 8), (8, 10)]),
+        (1024 ** 2 * 40, 1, [(0, 1024 ** 2 * 16), (1024 ** 2 * 16, 1024 ** 2 * 32), (1024 ** 2 * 32, 1024 ** 2 * 40)]),
+    ],
+)
+def test_split_ranges(size, connections, expected):
+    assert split_ranges(size, connections) == expected
+
+
+def test_split_ranges_skips_done():
+    assert split_ranges(10, 5, [(6, 8), (0, 2)]) == [(2, 4), (4, 6), (8, 10)]
+    assert split_ranges(10, 1, [(0, 10)]) == []
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_download_many_collects_failures(monkeypatch, jobs):
+    def fake_fetch_video(plan, *args, **kwargs):
+        if plan.video.vid == "3":
+            raise ValueError("boom")
+        return xvideos_dl.Fetched(plan, None, None)
+
+    monkeypatch.setattr(xvideos_dl, "resolve_video", lambda video, *args: xvideos_dl.Plan(video, None, None, None))
+    monkeypatch.setattr(xvideos_dl, "fetch_video", fake_fetch_video)
+    videos = [Video(vid=str(i), vname=f"v{i}", pname="", uname="", vpage="") for i in range(6)]
+    failures = download_many(iter(videos), len(videos), jobs, "./xvideos", "high", False, False)
+    assert [f.video.vid for f in failures] == ["3"]
+    assert str(failures[0].error) == "boom"
+
+
+def test_download_many_parks_videos_that_need_a_login(monkeypatch):
+    def fake_fetch_video(plan, *args, **kwargs):
+        if plan.video.vid in ("1", "4"):
+            raise CookieExpired("The cookie has expired")
+        return xvideos_dl.Fetched(plan, None, None)
+
+    monkeypatch.setattr(xvideos_dl, "resolve_video", lambda video, *args: xvideos_dl.Plan(video, None, None, None))
+    monkeypatch.setattr(xvideos_dl, "fetch_video", fake_fetch_video)
+    videos = [Video(vid=str(i), vname=f"v{i}", pname="", uname="", vpage="") for i in range(6)]
+    failures = download_many(iter(videos), len(videos), 2, "./xvideos", "high", False, False)
+    assert sorted(f.video.vid for f in failures) == ["1", "4"]
+
+
+MEDIA_PLAYLIST = """#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-TARGETDURATION:10
+#EXT-X-MEDIA-SEQUENCE:0
+#EXTINF:10.010,
+hls-360p-045d90.ts
+#EXTINF:4.004,
+hls-360p-045d91.ts?e=1615725210
+#EXT-X-ENDLIST
+"""
+
+
+def test_parse_media_playlist():
+    segments = parse_media_playlist(MEDIA_PLAYLIST, "https://cdn.example.com/videos/hls/hls-360p-045d9.m3u8?e=1")
+    assert [(s.index, s.duration, s.url) for s in segments] == [
+        (0, 10.01, "https://cdn.example.com/videos/hls/hls-360p-045d90.ts"),
+        (1, 4.004, "https://cdn.example.com/videos/hls/hls-360p-045d91.ts?e=1615725210"),
+    ]
+    assert not is_encrypted_playlist(MEDIA_PLAYLIST)
+    assert is_encrypted_playlist(MEDIA_PLAYLIST.replace("#EXTINF:10", '#EXT-X-KEY:METHOD=AES-128,URI="k"\n#EXTINF:10'))
+
+
+def test_parse_video_title():
+    page = '<head><meta property="og:title" content="Asian Webcam #2 camsex4u.life &amp; more" />'
+    assert parse_video_title(page) == "Asian Webcam #2 camsex4u.life & more"
+    assert parse_video_title("<head></head>") == ""
+
+
+def test_parse_user_page():
+    page = (
+        "123\n"
+        '<div id="video_1" data-id="1" class="thumb-block"><p class="title"><a title="One">One</a></p></div>'
+        '<div id="video_2" data-id="2" class="thumb-block"><p class="title"><a title="Two">Two</a></p></div>'
+    )
+    next_aid, videos = parse_user_page(page, "someone")
+    assert next_aid == "123"
+    assert [(v.vid, v.vname, v.uname, v.vpage) for v in videos] == [
+        ("1", "One", "someone", "https://www.xvideos.com/video1/_"),
+        ("2", "Two", "someone", "https://www.xvideos.com/video2/_"),
+    ]
+
+
+def test_parse_thumb_blocks():
+    page = (
+        '<div class="thumb-block thumb-block-profile" id="video_1" data-id="1"><div class="thumb-under">'
+        '<p class="title"><a href="/video1/_" title="Tom &amp; Jerry">Tom &amp; Jerry</a></p></div></div>'
+        '<div class="thumb-block-more"></div>'
+    )
+    assert parse_thumb_blocks(page) == [("1", "Tom & Jerry")]
+    assert parse_thumb_blocks('<div data-id="1" class="thumb-block"><p class="name">x</p></div>') is None
+
+
+def test_iter_videos_from_user_page(monkeypatch):
+    pages = {"0": ("7", ["1", "2"]), "7": ("3", ["3"]), "3": ("0", ["4"])}
+    requested = []
+
+    def fake_session_request(method, url, **kwargs):
+        aid = url.rsplit("/", 1)[-1]
+        requested.append(aid)
+        next_aid, vids = pages[aid]
+        blocks = "".join(
+            f'<div data-id="{vid}" class="thumb-block"><p class="title"><a title="v{vid}">v</a></p></div>'
+            for vid in vids
+        )
+        return SimpleNamespace(text=f"{next_aid}\n{blocks}")
+
+    monkeypatch.setattr(xvideos_dl, "session_request", fake_session_request)
+    videos = iter_videos_from_user_page("https://www.xvideos.com/profiles/someone", xvideos_dl.c.USER_UPLOAD_API)
+    assert [v.vid for v in videos] == ["1", "2", "3", "4"]
+    assert requested == ["0", "7", "3"]
+
+
+def test_iter_videos_from_urls_skips_without_requests(monkeypatch):
+    def fake_session_request(method, url, **kwargs):
+        raise AssertionError(f"unexpected request {url}")
+
+    monkeypatch.setattr(xvideos_dl, "session_request", fake_session_request)
+    urls = ["https://www.xvideos.com/video37177493/asian_webcam_2_camsex4u.life"]
+    assert list(iter_videos_from_urls(urls, False, skip=lambda vid: vid == "37177493")) == []
+
+
+def test_iter_videos_from_urls_dedupes(monkeypatch):
+    listed = {
+        "a": [Video("1", "one", "", "a", "p1"), Video("2", "two", "", "a", "p2")],
+        "b": [Video("2", "two", "", "b", "p2"), Video("3", "three", "", "b", "p3")],
+    }
+    calls = []
+
+    def fake_iter_videos_from_user_page(url, base_api):
+        calls.append(url)
+        return iter(listed[url.rstrip("/").rpartition("/")[2]])
+
+    def fake_get_videos_from_play_page(url):
+        raise AssertionError(f"unexpected request {url}")
+
+    monkeypatch.setattr(xvideos_dl, "iter_videos_from_user_page", fake_iter_videos_from_user_page)
+    monkeypatch.setattr(xvideos_dl, "get_videos_from_play_page", fake_get_videos_from_play_page)
+    urls = [
+        "https://www.xvideos.com/profiles/a",
+        "https://www.xvideos.com/profiles/b",
+        "https://www.xvideos.com/profiles/a/",
+        "https://www.xvideos.com/video3/three",
+    ]
+    assert [video.vid for video in iter_videos_from_urls(urls, False)] == ["1", "2", "3"]
+    assert len(calls) == 2
+
+
+def test_read_batch_file(tmp_path):
+    path = tmp_path / "urls.txt"
+    path.write_text("# favorites\nhttps://www.xvideos.com/video1/one\n\n  https://www.xvideos.com/video2/two  \n")
+    assert list(read_batch_file(str(path))) == [
+        "https://www.xvideos.com/video1/one",
+        "https://www.xvideos.com/video2/two",
+    ]
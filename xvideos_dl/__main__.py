@@ -1,21 +1,14 @@
 # type: ignore[attr-defined]
-from typing import List
+from typing import Iterable, List
 
 import sys
 from enum import Enum
+from itertools import chain, islice
+from pathlib import Path
 
 import typer
 from cursor import HiddenCursor
-from rich.console import Console
 from xvideos_dl import __version__
-from xvideos_dl.xvideos_dl import (
-    Process,
-    download,
-    get_videos_by_playlist_id,
-    get_videos_from_play_page,
-    get_videos_from_user_page,
-    parse_playlist_id,
-)
 
 from . import constant as c
 
@@ -24,7 +17,6 @@ app = typer.Typer(
     help="CLI to download videos from https://xvideos.com",
     add_completion=False,
 )
-console = Console()
 
 
 class Quality(str, Enum):
@@ -33,16 +25,47 @@ class Quality(str, Enum):
     low = "low"
 
 
+class Prefer(str, Enum):
+    auto = "auto"
+    mp4 = "mp4"
+    hls = "hls"
+
+
+class VerifyMode(str, Enum):
+    fast = "fast"
+    sample = "sample"
+    full = "full"
+
+
+class FsyncPolicy(str, Enum):
+    never = "never"
+    close = "close"
+    always = "always"
+
+
+class ProgressMode(str, Enum):
+    auto = "auto"
+    bar = "bar"
+    quiet = "quiet"
+    json = "json"
+
+
 def version_callback(value: bool):
     """Prints the version of the package."""
     if value:
-        console.print(f"[yellow]xvideos-dl[/] version: [bold blue]{__version__}[/]")
+        from rich.console import Console
+
+        Console().print(f"[yellow]xvideos-dl[/] version: [bold blue]{__version__}[/]")
         raise typer.Exit()
 
 
 @app.command(name="CLI to download videos from https://xvideos.com")
 def main(
-    urls: List[str] = typer.Argument(..., help="URL of the video web page."),
+    ctx: typer.Context,
+    urls: List[str] = typer.Argument(None, help="URL of the video web page."),
+    batch_file: str = typer.Option(
+        None, "-a", "--batch-file", help="File with one URL per line, '-' for stdin. Lines starting with # are ignored."
+    ),
     dest: str = typer.Option(
         "./xvideos",
         "-d",
@@ -53,8 +76,86 @@ def main(
     number: int = typer.Option(None, "-n", "--number", help="Quit after downloading number of videos."),
     reverse: bool = typer.Option(False, "-r", "--reverse", help="Download videos in reverse order."),
     quality: Quality = typer.Option(Quality.high, "-q", "--quality", help="Video quality to download."),
+    max_resolution: int = typer.Option(
+        0, "--max-resolution", min=0, help="Only choose --quality among variants at most this high, e.g. 480."
+    ),
+    max_bandwidth: str = typer.Option(
+        None, "--max-bandwidth", help="Only choose among variants of at most this many bits per second, e.g. 1M."
+    ),
+    prefer: Prefer = typer.Option(
+        Prefer.auto, "--prefer", help="Download the MP4 rendition of a variant when it has one, or always HLS."
+    ),
     overwrite: bool = typer.Option(False, "-o", "--overwrite", help="Overwrite the exist video files."),
+    connections: int = typer.Option(
+        c.CONNECTIONS, "-c", "--connections", min=1, help="Maximum number of parallel connections per video."
+    ),
+    jobs: int = typer.Option(1, "-j", "--jobs", min=1, help="Number of videos to download at the same time."),
+    limit_rate: str = typer.Option(
+        None, "--limit-rate", help="Total bandwidth of all downloads, in bytes per second, e.g. 800K or 2.5M."
+    ),
+    job_limit_rate: str = typer.Option(None, "--job-limit-rate", help="Bandwidth of each video, e.g. 500K."),
+    request_rate: float = typer.Option(
+        0, "--request-rate", min=0, help="Requests per second to the site and its API, 0 for unlimited."
+    ),
+    progress: ProgressMode = typer.Option(
+        ProgressMode.auto, "--progress", help="Progress display, auto shows bars only on a terminal."
+    ),
     reset_cookie: bool = typer.Option(False, "--reset-cookie", help="Use a new cookie."),
+    non_interactive: bool = typer.Option(
+        False,
+        "--non-interactive",
+        help="Never ask for a cookie, leave the videos that need a login failed and download the others.",
+    ),
+    no_cache: bool = typer.Option(False, "--no-cache", help="Do not read or write the metadata cache on disk."),
+    archive: Path = typer.Option(
+        None, "--archive", help="Index file of downloaded videos, videos found in it are skipped without any request."
+    ),
+    rebuild_archive: bool = typer.Option(
+        False, "--rebuild-archive", help="Rebuild the --archive index from the videos in the destination, then exit."
+    ),
+    verify: VerifyMode = typer.Option(
+        VerifyMode.sample,
+        "--verify",
+        help="How downloaded videos are checked against their stored hashes: size only, a few blocks, or all.",
+    ),
+    plan: bool = typer.Option(
+        False,
+        "--plan",
+        help="Only estimate the size of the videos, the free disk space and the time to download them, "
+        "as JSON with --progress json.",
+    ),
+    verify_archive: bool = typer.Option(
+        False, "--verify-archive", help="Verify every video in the --archive index, then exit."
+    ),
+    fsync: FsyncPolicy = typer.Option(
+        FsyncPolicy.close,
+        "--fsync",
+        help="When downloads are synced to disk: never, once before the file gets its final name, or after every write.",
+    ),
+    shard: str = typer.Option(
+        None, "--shard", help="Only download the videos of shard I of N, e.g. 2/3, so that N machines split a list."
+    ),
+    ledger: Path = typer.Option(
+        None,
+        "--ledger",
+        help="Work ledger shared by several workers, e.g. on a network drive. "
+        "Videos are claimed before downloading, those of stopped workers are taken over.",
+    ),
+    worker_id: str = typer.Option(
+        None, "--worker-id", help="Name of this worker in the --ledger, defaults to the host name and process id."
+    ),
+    metrics_file: Path = typer.Option(
+        None, "--metrics-file", help="Append a JSON line per request, fragment, download and retry to this file."
+    ),
+    metrics_address: str = typer.Option(
+        None, "--metrics-address", help="Serve Prometheus metrics at /metrics on [HOST:]PORT while downloading."
+    ),
+    profile: Path = typer.Option(None, "--profile", help="Profile the downloads with cProfile, save the stats here."),
+    serve: str = typer.Option(
+        None,
+        "--serve",
+        help="Run as a daemon taking jobs over HTTP on [HOST:]PORT, e.g. 8020. Downloads --jobs jobs at a time.",
+    ),
     version: bool = typer.Option(
         None,
         "-v",
@@ -65,37 +166,159 @@ def main(
     ),
 ):
     """CLI to download videos from https://xvideos.com"""
-    videos_to_download = []
+    # Imported here rather than at the top, so that --help and --version start fast
+    from xvideos_dl import backoff, ratelimit
+    from xvideos_dl.archive import Archive
+    from xvideos_dl.cache import metadata_cache
+    from xvideos_dl.ledger import Ledger, in_shard, parse_shard
+    from xvideos_dl.metrics import JsonLinesWriter, metrics, profiler, serve_metrics
+    from xvideos_dl.progress import renderer
+    from xvideos_dl.quality import policy
+    from xvideos_dl.ratelimit import parse_rate
+    from xvideos_dl.writer import write_policy
+    from xvideos_dl.xvideos_dl import (
+        Video,
+        console,
+        download_many,
+        iter_videos_from_urls,
+        read_batch_file,
+        session_pool,
+        verifier,
+    )
+
+    metadata_cache.enabled = not no_cache
+    renderer.mode = progress.value
+    if progress == ProgressMode.json:
+        # Keep stdout to JSON lines, the messages meant for people go to stderr
+        console.stderr = backoff.console.stderr = True
     try:
-        for url in urls:
-            if "/profiles/" in url:
-                videos = []
-                videos = get_videos_from_user_page(url, "0", c.USER_UPLOAD_API, videos)
-                videos_to_download.extend(videos)
-            elif "/channels/" in url:
-                videos = []
-                videos = get_videos_from_user_page(url, "0", c.CHANNEL_API, videos)
-                videos_to_download.extend(videos)
-            elif "/favorite/" in url:
-                pid = parse_playlist_id(url)
-                videos = get_videos_by_playlist_id(pid, reset_cookie)
-                videos_to_download.extend(videos)
-            else:
-                video = get_videos_from_play_page(url)
-                videos_to_download.append(video)
+        ratelimit.bandwidth.set_rate(parse_rate(limit_rate) if limit_rate else 0)
+        job_rate = parse_rate(job_limit_rate) if job_limit_rate else 0
+        policy.max_bandwidth = int(parse_rate(max_bandwidth)) if max_bandwidth else 0
+        shard_index, shard_count = parse_shard(shard) if shard else (1, 1)
+    except ValueError as e:
+        console.print(f"[red]{e}[/]")
+        raise typer.Exit(2)
+    policy.max_height = max_resolution
+    policy.prefer = prefer.value
+    ratelimit.request_rate.set_rate(request_rate, burst=max(request_rate, 1))
+    verifier.mode = verify.value
+    write_policy.fsync = fsync.value
+    session_pool.interactive = not non_interactive
+    index = Archive(archive) if archive else None
+    if (rebuild_archive or verify_archive) and index is None:
+        console.print("[red]--rebuild-archive and --verify-archive require --archive[/]")
+        raise typer.Exit(2)
+    if rebuild_archive:
+        count = index.rebuild(Path(dest))
+        console.print(f"Archived [white]{count}[/] videos from [white]{Path(dest).absolute()}[/] to {archive}")
+        raise typer.Exit()
+    if verify_archive:
+        entries = index.entries()
+        broken = [path for vid, path, size, digest in entries if not verifier.check(path, size, digest)]
+        console.print(f"Verified [white]{len(entries) - len(broken)}[/] of [white]{len(entries)}[/] videos")
+        for path in broken:
+            console.print(f"[red]  {path}[/]")
+        raise typer.Exit(1 if broken else 0)
+    if metrics_file:
+        writer = JsonLinesWriter(str(metrics_file))
+        metrics.add_hook(writer)
+
+        def close_writer() -> None:
+            metrics.remove_hook(writer)
+            writer.close(metrics)
+
+        ctx.call_on_close(close_writer)
+    if metrics_address:
+        from xvideos_dl.server import parse_address
+
+        try:
+            metrics_server = serve_metrics(metrics, parse_address(metrics_address))
+        except (OSError, ValueError) as e:
+            console.print(f"[red]Cannot serve metrics on {metrics_address}: {e}[/]")
+            raise typer.Exit(1)
+        ctx.call_on_close(metrics_server.server_close)
+        ctx.call_on_close(metrics_server.shutdown)
+    if profile:
+        profiler.enabled = True
 
+        def save_profile() -> None:
+            if profiler.stop(str(profile)):
+                console.print(f"Profile saved to [white]{profile}[/], read it with: python -m pstats {profile}")
+
+        ctx.call_on_close(save_profile)
+    if serve:
+        # Progress is polled over the API instead of drawn, and there is nobody to ask for a cookie
+        renderer.mode = "quiet"
+        session_pool.interactive = False
+        from xvideos_dl import server
+
+        daemon = server.Daemon(dest, quality.value, overwrite, reset_cookie, connections, jobs, index, job_rate)
+        try:
+            server.serve(daemon, serve)
+        except (OSError, ValueError) as e:
+            console.print(f"[red]Cannot serve on {serve}: {e}[/]")
+            raise typer.Exit(1)
+        raise typer.Exit()
+    if not urls and not batch_file:
+        console.print("[red]Missing argument 'URLS...'.[/]")
+        raise typer.Exit(2)
+
+    work_ledger = Ledger(ledger, worker_id) if ledger else None
+    if work_ledger is not None:
+        ctx.call_on_close(work_ledger.close)
+    skipped = []
+
+    def skip(vid: str) -> bool:
+        if not in_shard(vid, shard_index, shard_count):
+            return True
+        if index is not None and not overwrite and vid in index:
+            skipped.append(vid)
+            return True
+        return False
+
+    try:
+        # Download while the listings are still being fetched, unless the whole list is needed first
+        sources = chain(urls or [], read_batch_file(batch_file) if batch_file else [])
+        videos = iter_videos_from_urls(sources, reset_cookie, skip=skip)
+        stop = start - 1 + number if number else None
         if reverse:
-            videos_to_download = videos_to_download[::-1]
-        videos_to_download = videos_to_download[start - 1 :]
-        if number:
-            videos_to_download = videos_to_download[:number]
-
-        total = len(videos_to_download)
-        for idx, video in enumerate(videos_to_download):
-            with HiddenCursor():
-                process = Process(idx + 1, total)
-                console.print(f"Downloading: [cyan]{process.status()}[/]")
-                download(video, dest, quality, overwrite, reset_cookie)
+            videos_to_download: Iterable[Video] = list(videos)[::-1][start - 1 : stop]
+        else:
+            videos_to_download = islice(videos, start - 1, stop)
+
+        if plan:
+            from xvideos_dl.planner import estimate_videos, print_plan, summarize
+
+            estimates = estimate_videos(videos_to_download, dest, quality)
+            summary = summarize(estimates, dest, jobs)
+            print_plan(estimates, summary, as_json=progress == ProgressMode.json)
+            sys.exit(0 if summary["fits"] and not summary["failed"] else 1)
+
+        total = len(videos_to_download) if isinstance(videos_to_download, list) else 0
+        with HiddenCursor():
+            failures = download_many(
+                videos_to_download,
+                total,
+                jobs,
+                dest,
+                quality,
+                overwrite,
+                reset_cookie,
+                connections,
+                index,
+                job_rate,
+                work_ledger,
+            )
     except Exception as e:
         console.print(f"[red]{e}[/]")
         sys.exit(1)
+
+    if skipped:
+        console.print(f"Skipped [green]{len(skipped)}[/] videos already in the archive")
+
+    if failures:
+        console.print(f"[red]Failed to download {len(failures)} videos:[/]")
+        for video, error in failures:
+            console.print(f"[red]  {video.vpage} {error}[/]")
+        sys.exit(1)
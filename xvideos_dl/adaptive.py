@@ -0,0 +1,87 @@
+from typing import Iterable, Optional, Tuple
+
+import time
+from collections import deque
+
+from . import constant as c
+
+SMOOTHING = 0.3  # weight of the newest measurement in the moving average
+
+
+def clamp(value: int, low: int, high: int) -> int:
+    return max(low, min(value, high))
+
+
+def round_down_pow2(value: int) -> int:
+    return 1 << (max(value, 1).bit_length() - 1)
+
+
+class Controller:
+    """
+    Sizes range requests and read buffers from the measured throughput, so that a
+    range takes about RANGE_SECONDS and a read about CHUNK_SECONDS, and hill-climbs
+    the number of connections between 1 and max_connections on the total throughput.
+    """
+
+    def __init__(self, max_connections: int, fragment: int = c.INITIAL_FRAGMENT_SIZE, chunk: int = c.CHUNK_SIZE):
+        self.max_connections = max(1, max_connections)
+        self.connections = -(-self.max_connections // 2)
+        self.fragment = fragment
+        self.chunk = chunk
+        self.rate = 0.0  # bytes per second of one connection
+        self._direction = 1
+        self._last_total = 0.0
+        self._window_bytes = 0
+        self._window_ranges = 0
+        self._window_start = time.time()
+
+    def observe(self, size: int, seconds: float) -> None:
+        """Feed back one finished range."""
+        rate = size / max(seconds, 1e-3)
+        self.rate = rate if not self.rate else self.rate * (1 - SMOOTHING) + rate * SMOOTHING
+        self.fragment = clamp(int(self.rate * c.RANGE_SECONDS), c.MIN_FRAGMENT_SIZE, c.FRAGMENT_SIZE)
+        self.chunk = clamp(round_down_pow2(int(self.rate * c.CHUNK_SECONDS)), c.MIN_CHUNK_SIZE, c.MAX_CHUNK_SIZE)
+
+        self._window_bytes += size
+        self._window_ranges += 1
+        if self._window_ranges >= self.connections:
+            self._adjust_connections()
+
+    def _adjust_connections(self) -> None:
+        now = time.time()
+        total = self._window_bytes / max(now - self._window_start, 1e-3)
+        if total > self._last_total * 1.05:
+            step = self._direction
+        elif total < self._last_total * 0.95:
+            # The last step made things worse, go back the other way
+            self._direction = -self._direction
+            step = self._direction
+        else:
+            step = 0
+        self.connections = clamp(self.connections + step, 1, self.max_connections)
+        self._last_total = total
+        self._window_bytes = 0
+        self._window_ranges = 0
+        self._window_start = now
+
+
+class RangeAllocator:
+    """Hands out the missing byte ranges of a file one piece at a time, sized when asked."""
+
+    def __init__(self, gaps: Iterable[Tuple[int, int]]):
+        self.gaps = deque(sorted(gaps))
+        self.remaining = sum(end - start for start, end in self.gaps)
+
+    def take(self, length: int, connections: int = 1) -> Optional[Tuple[int, int]]:
+        if not self.gaps:
+            return None
+        # Near the end, share what is left between the connections instead of leaving one with a long tail
+        length = max(c.MIN_FRAGMENT_SIZE, min(length, -(-self.remaining // max(connections, 1))))
+        start, end = self.gaps[0]
+        stop = min(end, start + length)
+        if stop == end:
+            self.gaps.popleft()
+        else:
+            self.gaps[0] = (stop, end)
+        self.remaining -= stop - start
+        return start, stop
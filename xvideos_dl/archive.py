@@ -0,0 +1,68 @@
+from typing import List, Optional, Tuple
+
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from . import constant as c
+from .integrity import read_sidecar
+
+SAVE_NAME = re.compile(r"\(#(\d+)\)\.mp4$")
+
+
+class Archive:
+    """
+    Index of finished videos: vid -> path, size, hash, quality and timestamp.
+    Looking a video up here replaces verifying its file before every run.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=c.TIMEOUT, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS videos (vid TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, "
+            "hash TEXT, quality TEXT, timestamp REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def __contains__(self, vid: object) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM videos WHERE vid = ?", (vid,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(self._conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0])
+
+    def entries(self) -> List[Tuple[str, Path, int, Optional[str]]]:
+        """Every indexed video as (vid, path, size, hash)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT vid, path, size, hash FROM videos ORDER BY path").fetchall()
+        return [(vid, Path(path), size, digest) for vid, path, size, digest in rows]
+
+    def add(self, vid: str, path: Path, size: int, quality: Optional[str] = None, digest: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO videos (vid, path, size, hash, quality, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                (vid, str(Path(path).absolute()), size, digest, quality, time.time()),
+            )
+            self._conn.commit()
+
+    def rebuild(self, dest: Path) -> int:
+        """Index every finished video under dest, dropping what was indexed before."""
+        with self._lock:
+            self._conn.execute("DELETE FROM videos")
+            self._conn.commit()
+        count = 0
+        for path in Path(dest).rglob("*.mp4"):
+            find = SAVE_NAME.search(path.name)
+            # A journal next to the file means it is still being downloaded
+            if not find or path.with_name(path.name + ".journal").exists():
+                continue
+            digest = (read_sidecar(path) or {}).get("root")
+            self.add(find.group(1), path, path.stat().st_size, digest=digest)
+            count += 1
+        return count
@@ -0,0 +1,164 @@
+"""Logged-in sessions shared by every thread.
+
+Cookies are kept in ~/.xvideos-dl: `cookie` for the default account, and one
+file per further account in `cookies/`. A file is read again only when it
+changed. Each account has its own Session, on the connection pools of the
+shared one, and requests take the accounts in turn. An account whose cookie the
+site rejected is left out until its file changes. When none is left, one thread
+asks for a new cookie while the others wait for it, or, when nobody can answer,
+CookieExpired is raised so that the caller parks the work that needs a login.
+"""
+
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+from requests import Session
+from requests.cookies import cookiejar_from_dict
+
+from . import constant as c
+
+Account = namedtuple("Account", "name cookie session")
+ANONYMOUS_COOKIE = "foo=bar"  # sent while no cookie is saved
+RESET_COOKIE = "k=v"
+
+
+class CookieExpired(ValueError):
+    pass
+
+
+def parse_cookies(cookie: str) -> Dict[str, str]:
+    cookies = {}
+    for pair in cookie.split("; "):
+        key, sep, value = pair.partition("=")
+        if not sep:
+            return {}
+        cookies[key] = value.partition("=")[0]
+    return cookies
+
+
+class CookieStore:
+    def __init__(self, root: Optional[Path] = None):
+        self.root = root
+        self._cache: Dict[Path, Tuple[Tuple[int, int], str]] = {}  # by file: its mtime and size, and content
+        self._lock = threading.Lock()
+
+    @property
+    def dir(self) -> Path:
+        # The home directory is looked up every time, it is not known for good at import
+        return self.root or Path.home() / f".{c.APP_NAME}"
+
+    def path(self, name: str = "default") -> Path:
+        return self.dir / "cookie" if name == "default" else self.dir / "cookies" / name
+
+    def read(self, name: str = "default") -> Optional[str]:
+        path = self.path(name)
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        with open(path) as f:
+            cookie = f.read()
+        with self._lock:
+            self._cache[path] = (key, cookie)
+        return cookie
+
+    def save(self, cookie: str, name: str = "default") -> None:
+        path = self.path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(cookie)
+        stat = path.stat()
+        with self._lock:
+            self._cache[path] = ((stat.st_mtime_ns, stat.st_size), cookie)
+
+    def load(self) -> Dict[str, str]:
+        """The cookie of every account, the default one first."""
+        cookies = {"default": self.read() or ANONYMOUS_COOKIE}
+        accounts = self.dir / "cookies"
+        if accounts.is_dir():
+            for path in sorted(accounts.iterdir()):
+                cookie = self.read(path.name) if path.is_file() else None
+                if cookie and cookie.strip():
+                    cookies[path.name] = cookie
+        return cookies
+
+
+class SessionPool:
+    def __init__(self, base: Callable[[], Session], store: CookieStore):
+        self.base = base  # the shared session, whose connection pools the accounts use
+        self.store = store
+        self.interactive = True
+        self._accounts: Dict[str, Account] = {}
+        self._expired: Set[str] = set()  # cookies the site rejected
+        self._reset = False
+        self._turn = 0
+        self._lock = threading.Lock()
+        self._ask_lock = threading.Lock()
+
+    def _session(self, cookie: str) -> Session:
+        session = Session()
+        for prefix, adapter in self.base().adapters.items():
+            session.mount(prefix, adapter)
+        session.cookies = cookiejar_from_dict(parse_cookies(cookie.strip()))
+        return session
+
+    def accounts(self) -> List[Account]:
+        """The accounts whose cookie was not rejected."""
+        cookies = self.store.load()
+        with self._lock:
+            accounts = []
+            for name, cookie in cookies.items():
+                if cookie in self._expired:
+                    continue
+                account = self._accounts.get(name)
+                if account is None or account.cookie != cookie:
+                    account = self._accounts[name] = Account(name, cookie, self._session(cookie))
+                accounts.append(account)
+            return accounts
+
+    def take(self) -> Account:
+        while 1:
+            accounts = self.accounts()
+            if accounts:
+                with self._lock:
+                    self._turn += 1
+                    return accounts[self._turn % len(accounts)]
+            self.ask(self.interactive)
+
+    def expire(self, account: Account) -> None:
+        with self._lock:
+            self._expired.add(account.cookie)
+
+    def reset(self) -> None:
+        """Put the saved cookies aside and start this run from a new one, once."""
+        with self._lock:
+            if self._reset:
+                return
+            self._reset = True
+        for cookie in self.store.load().values():
+            if cookie != RESET_COOKIE:
+                with self._lock:
+                    self._expired.add(cookie)
+        self.store.save(RESET_COOKIE)
+
+    def ask(self, interactive: bool) -> None:
+        if not interactive:
+            raise CookieExpired(f"The cookie has expired, save a new one to {self.store.path()}")
+        with self._ask_lock:
+            # Another thread may have been given one while this one waited
+            if self.accounts():
+                return
+            cookie = input(
+                "The cookie has expired, please enter a new one:\n"
+                "(Log in https://xvideos.com with your account via a browser, "
+                "then open the developer mode, copy and paste the cookie here)\n"
+            ).strip()
+            self.store.save(cookie)
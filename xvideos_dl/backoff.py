@@ -0,0 +1,143 @@
+"""Retries with jittered exponential backoff, and a circuit breaker per host.
+
+Every worker thread shares the breaker: once a host keeps failing, or asks to
+slow down with 429 / Retry-After, all requests to it pause together, instead of
+each worker retrying on its own schedule or giving up on its video.
+"""
+
+from typing import Callable, Dict, Optional, TypeVar
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from requests import ConnectionError, HTTPError, RequestException, Response, Timeout
+from requests.exceptions import ChunkedEncodingError
+from rich.console import Console
+
+from . import constant as c
+from .metrics import metrics
+
+T = TypeVar("T")
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+console = Console()
+
+
+def retry_after(resp: Optional[Response]) -> Optional[float]:
+    """Seconds the server asked us to wait, from a Retry-After header in seconds or as a date."""
+    value = resp.headers.get("Retry-After") if resp is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUS
+    return isinstance(error, (ConnectionError, Timeout, ChunkedEncodingError))
+
+
+def delay(attempt: int, base: float = c.RETRY_DELAY, cap: float = c.RETRY_MAX_DELAY) -> float:
+    """Full jitter: anywhere between 0 and the exponential backoff of this attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures per host. After `threshold` of them the circuit
+    opens: requests to the host wait for `cooldown` seconds, then a single
+    request is let through to probe it while the others wait for its outcome.
+    A server asking to back off (429 or Retry-After) pauses every request to the
+    host for that long.
+    """
+
+    def __init__(self, threshold: int = c.BREAKER_THRESHOLD, cooldown: float = c.BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures: Dict[str, int] = {}
+        self._paused_until: Dict[str, float] = {}
+        self._probing: Dict[str, bool] = {}
+        self._changed = threading.Condition()
+
+    def acquire(self, host: str) -> None:
+        waited = False
+        with self._changed:
+            while 1:
+                wait = self._paused_until.get(host, 0) - time.time()
+                tripped = self._failures.get(host, 0) >= self.threshold
+                if tripped and not waited:
+                    metrics.inc("circuit_open", host=host)
+                    waited = True
+                if wait > 0:
+                    self._changed.wait(wait)
+                elif tripped and self._probing.get(host):
+                    self._changed.wait()
+                else:
+                    if tripped:
+                        self._probing[host] = True
+                    return
+
+    def success(self, host: str) -> None:
+        with self._changed:
+            self._failures[host] = 0
+            self._probing[host] = False
+            self._changed.notify_all()
+
+    def release(self, host: str) -> None:
+        """Give up a probe without an outcome, e.g. when the caller is interrupted."""
+        with self._changed:
+            self._probing[host] = False
+            self._changed.notify_all()
+
+    def failure(self, host: str, pause: Optional[float] = None) -> None:
+        """Record a failure, `pause` is how long the server asked every client to back off."""
+        with self._changed:
+            failures = self._failures[host] = self._failures.get(host, 0) + 1
+            self._probing[host] = False
+            if failures >= self.threshold:
+                pause = max(pause or 0, self.cooldown)
+            if pause:
+                self._paused_until[host] = max(self._paused_until.get(host, 0), time.time() + pause)
+            self._changed.notify_all()
+
+
+breaker = CircuitBreaker()
+
+
+def call(request: Callable[[], T], url: str, tries: int = c.RETRY_TRIES) -> T:
+    """Run request() until it succeeds, retrying transient errors through the host's breaker."""
+    host = urlsplit(url).netloc
+    attempt = 0
+    while 1:
+        breaker.acquire(host)
+        try:
+            result = request()
+        except RequestException as e:
+            if not is_retryable(e):
+                breaker.success(host)  # the host answered, it is the request that is wrong
+                raise
+            pause = retry_after(e.response)
+            breaker.failure(host, pause)
+            attempt += 1
+            if attempt >= tries:
+                raise
+            metrics.inc("retries", host=host, reason=type(e).__name__)
+            wait = max(delay(attempt), pause or 0)
+            console.print(f"[red]{e}, Retrying in {wait:.1f} seconds...[/]")
+            time.sleep(wait)
+            continue
+        except BaseException:
+            breaker.release(host)
+            raise
+        breaker.success(host)
+        return result
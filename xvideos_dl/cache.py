@@ -0,0 +1,111 @@
+from typing import Any, Optional
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from . import constant as c
+from .metrics import metrics
+
+
+class MetadataCache:
+    """
+    Video metadata (titles, HLS variants, MP4 URLs) kept in memory for the
+    running process and in a SQLite file across runs. Entries expire after
+    their TTL, and the least recently used ones are evicted beyond max_entries.
+    """
+
+    def __init__(self, path: Path, max_entries: int = c.CACHE_MAX_ENTRIES, memo_size: int = c.CACHE_MEMO_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.memo_size = memo_size
+        self.enabled = True
+        self._memo: "OrderedDict[str, Any]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), timeout=c.TIMEOUT, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS metadata "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+        return self._conn
+
+    def _remember(self, key: str, expires: float, value: Any) -> None:
+        self._memo[key] = (expires, value)
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+
+    def get(self, key: str) -> Any:
+        value = self._get(key)
+        metrics.inc("cache_requests", kind=key.partition(":")[0], result="miss" if value is None else "hit")
+        return value
+
+    def _get(self, key: str) -> Any:
+        now = time.time()
+        with self._lock:
+            if key in self._memo:
+                expires, value = self._memo[key]
+                if expires > now:
+                    self._memo.move_to_end(key)
+                    return value
+                del self._memo[key]
+            if not self.enabled:
+                return None
+            try:
+                db = self._db()
+                row = db.execute("SELECT value, expires FROM metadata WHERE key = ?", (key,)).fetchone()
+                if not row or row[1] <= now:
+                    return None
+                db.execute("UPDATE metadata SET accessed = ? WHERE key = ?", (now, key))
+                db.commit()
+            except sqlite3.Error:
+                return None
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, now + ttl, value)
+            if not self.enabled:
+                return
+            try:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO metadata (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now + ttl, now),
+                )
+                db.execute("DELETE FROM metadata WHERE expires <= ?", (now,))
+                db.execute(
+                    "DELETE FROM metadata WHERE key IN "
+                    "(SELECT key FROM metadata ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                db.commit()
+            except sqlite3.Error:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memo.clear()
+            if self.enabled:
+                self._db().execute("DELETE FROM metadata")
+                self._db().commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+metadata_cache = MetadataCache(Path.home() / f".{c.APP_NAME}" / "cache.sqlite3")
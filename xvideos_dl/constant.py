@@ -6,10 +6,43 @@ USER_UPLOAD_API = HOST + "/profiles/{u}/activity/{aid}"
 PLAYLIST_API = HOST + "/api/playlists/list/{pid}"
 CHANNEL_API = HOST + "/channels/{u}/activity/straight/{aid}"
 VIDEO_API = HOST + "/video-download/{vid}/"
-HAS_MP4_RESOUCE = ["360p", "250p"]
+MP4_FIELDS = {"360p": "URL", "250p": "URL_LOW"}  # variants also served as MP4, by their VIDEO_API field
+HAS_MP4_RESOUCE = list(MP4_FIELDS)
 TIMEOUT = 15  # seconds
-FRAGMENT_SIZE = 1024 ** 2 * 16  # 16MB
-CHUNK_SIZE = 1024 * 4  # 4KB
+FRAGMENT_SIZE = 1024 ** 2 * 16  # 16MB, the largest range requested at once
+MIN_FRAGMENT_SIZE = 1024 * 256  # 256KB
+INITIAL_FRAGMENT_SIZE = 1024 ** 2 * 2  # 2MB, until the throughput is measured
+RANGE_SECONDS = 5  # target duration of one range request
+CHUNK_SIZE = 1024 * 64  # 64KB, the initial read buffer
+MIN_CHUNK_SIZE = 1024 * 16  # 16KB
+MAX_CHUNK_SIZE = 1024 ** 2  # 1MB
+CHUNK_SECONDS = 0.02  # target duration of one read
+WRITE_BUFFER = 1024 ** 2  # 1MB, bytes of a range written to disk at once, at multiples of it
+HASH_BLOCK_SIZE = 1024 ** 2 * 4  # 4MB, files are hashed block by block
+VERIFY_SAMPLES = 4  # blocks hashed again by the sample verify mode
+CONNECTIONS = 4  # parallel ranges per video
+RETRY_TRIES = 5
+RETRY_DELAY = 0.5  # seconds, doubled on every retry
+RETRY_MAX_DELAY = 60  # seconds
+BREAKER_THRESHOLD = 5  # consecutive failures before a host is paused
+BREAKER_COOLDOWN = 30  # seconds
+POOL_SIZE = 32  # keep-alive connections per host
+RESOLVE_AHEAD = 4  # videos resolved concurrently ahead of the download queue
+FINALIZE_WORKERS = 2  # videos remuxed and hashed at the same time
+PIPELINE_DEPTH = 2  # videos waiting between two stages of the download pipeline
+LEDGER_LEASE = 120  # seconds a claim on the work ledger lasts without a heartbeat
+LEDGER_MAX_ATTEMPTS = 3  # tries of a video across workers before it is left failed
+JOB_RETENTION = 3600 * 24  # seconds the daemon keeps a finished job
+MAX_FINISHED_JOBS = 1000  # finished jobs the daemon keeps at most
+PARK_POLL = 30  # seconds between checks whether the jobs parked for a login can run again
+PLAN_WORKERS = 16  # videos resolved at the same time by --plan
+PLAN_SAMPLE = 1024 ** 2  # 1MB, fetched from a few videos by --plan to measure the throughput
+PROGRESS_REFRESH = 10  # progress redraws per second
+CACHE_TITLE_TTL = 3600 * 24 * 30  # 30 days
+CACHE_URL_TTL = 60 * 30  # 30 minutes, CDN links are signed and expire
+CACHE_MAX_ENTRIES = 100000
+CACHE_MEMO_SIZE = 4096
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # seconds
 
 SMILE_EMOJIS = [
     "😁",
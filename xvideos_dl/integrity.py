@@ -0,0 +1,178 @@
+from typing import Any, Dict, List, Optional
+
+import hashlib
+import json
+import mmap
+import os
+import random
+import threading
+from pathlib import Path
+
+from . import constant as c
+
+MODES = ("fast", "sample", "full")
+
+
+def sidecar(path: Path) -> Path:
+    return path.with_name(path.name + ".sha256")
+
+
+def block_digest(view: Any) -> str:
+    return hashlib.sha256(view).hexdigest()
+
+
+def root_digest(blocks: List[str]) -> str:
+    return hashlib.sha256(b"".join(bytes.fromhex(block) for block in blocks)).hexdigest()
+
+
+def hash_blocks(path: Path, indexes: Optional[List[int]] = None, block: int = c.HASH_BLOCK_SIZE) -> Dict[int, str]:
+    """Digests of some blocks of a file (all of them by default), read through mmap."""
+    size = path.stat().st_size
+    count = max(1, -(-size // block))
+    indexes = list(range(count)) if indexes is None else indexes
+    if not size:
+        return {i: block_digest(b"") for i in indexes}
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        view = memoryview(m)
+        try:
+            return {i: block_digest(view[i * block : (i + 1) * block]) for i in indexes}
+        finally:
+            view.release()
+
+
+class BlockHasher:
+    """
+    SHA-256 of every HASH_BLOCK_SIZE block of a file, computed from the chunks as
+    they are written, in any order: a chunk that arrives ahead of the rest of its
+    block waits in memory until the gap before it is filled. Blocks that were not
+    fed completely, e.g. written by an earlier run, are read back from disk.
+    """
+
+    def __init__(self, size: int, block: int = c.HASH_BLOCK_SIZE):
+        self.size = size
+        self.block = block
+        count = max(1, -(-size // block))
+        self._hashes = [hashlib.sha256() for _ in range(count)]
+        self._next = [i * block for i in range(count)]
+        self._pending: List[Dict[int, bytes]] = [{} for _ in range(count)]
+        self._locks = [threading.Lock() for _ in range(count)]
+
+    def update(self, offset: int, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            index = offset // self.block
+            piece = view[: (index + 1) * self.block - offset]
+            self._feed(index, offset, piece)
+            offset += len(piece)
+            view = view[len(piece) :]
+
+    def _feed(self, index: int, offset: int, piece: memoryview) -> None:
+        with self._locks[index]:
+            if offset != self._next[index]:
+                self._pending[index][offset] = bytes(piece)
+                return
+            self._hashes[index].update(piece)
+            self._next[index] += len(piece)
+            pending = self._pending[index]
+            while self._next[index] in pending:
+                data = pending.pop(self._next[index])
+                self._hashes[index].update(data)
+                self._next[index] += len(data)
+
+    def digests(self, path: Path) -> List[str]:
+        missing = [
+            i for i, end in enumerate(self._next) if end != min((i + 1) * self.block, self.size) or self._pending[i]
+        ]
+        reread = hash_blocks(path, missing, self.block) if missing else {}
+        return [reread[i] if i in reread else h.hexdigest() for i, h in enumerate(self._hashes)]
+
+
+def write_sidecar(path: Path, blocks: List[str], block: int = c.HASH_BLOCK_SIZE) -> str:
+    """Store the block digests next to the file, return the root digest."""
+    stat = path.stat()
+    root = root_digest(blocks)
+    data = dict(algorithm="sha256", size=stat.st_size, mtime=stat.st_mtime_ns, block=block, root=root, blocks=blocks)
+    tmp = sidecar(path).with_name(sidecar(path).name + ".tmp")
+    tmp.write_text(json.dumps(data))
+    os.replace(str(tmp), str(sidecar(path)))
+    return root
+
+
+def read_sidecar(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        data: Dict[str, Any] = json.loads(sidecar(path).read_text())
+        return data
+    except (OSError, ValueError):
+        return None
+
+
+def hash_file(path: Path) -> str:
+    """Hash a file that was written by someone else, e.g. ffmpeg, and store its sidecar."""
+    blocks = hash_blocks(path)
+    return write_sidecar(path, [blocks[i] for i in sorted(blocks)])
+
+
+def remove_sidecar(path: Path) -> None:
+    if sidecar(path).is_file():
+        sidecar(path).unlink()
+
+
+class Verifier:
+    """
+    Checks finished downloads against their sidecar:
+
+    - fast: the size and modification time still match the hashed file
+    - sample: fast, plus a few blocks hashed again
+    - full: every block hashed again
+
+    Files without a sidecar are left to integv, which parses the whole MP4.
+    """
+
+    def __init__(self, mode: str = "sample", samples: int = c.VERIFY_SAMPLES):
+        self.mode = mode
+        self.samples = samples
+        self._integv: Any = None
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode: str) -> None:
+        if mode not in MODES:
+            raise ValueError(f"unknown verify mode {mode}, choose from {', '.join(MODES)}")
+        self._mode = mode
+
+    def check(self, path: Path, size: int, digest: Optional[str] = None) -> bool:
+        """Verify a file against the size and root digest it was indexed with."""
+        if not path.is_file() or path.stat().st_size != size:
+            return False
+        if digest and (read_sidecar(path) or {}).get("root") != digest:
+            return False
+        return self.verify(str(path))
+
+    def verify(self, file: str) -> bool:
+        path = Path(file)
+        data = read_sidecar(path)
+        if data is None:
+            if self._integv is None:
+                from integv import FileIntegrityVerifier
+
+                self._integv = FileIntegrityVerifier()
+            return bool(self._integv.verify(file))
+
+        stat = path.stat()
+        if stat.st_size != data["size"] or (self.mode == "fast" and stat.st_mtime_ns != data["mtime"]):
+            return False
+        blocks = data["blocks"]
+        if self.mode == "fast":
+            return True
+        if self.mode == "sample":
+            # The first and last blocks, where MP4 boxes and truncation live, and a few in between
+            indexes = sorted(
+                {0, len(blocks) - 1} | set(random.sample(range(len(blocks)), min(self.samples, len(blocks))))
+            )
+        else:
+            indexes = list(range(len(blocks)))
+        digests = hash_blocks(path, indexes, data["block"])
+        return all(digests[i] == blocks[i] for i in indexes)
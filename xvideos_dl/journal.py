@@ -0,0 +1,91 @@
+from typing import Any, Dict, List, Optional
+
+import json
+import threading
+import zlib
+from pathlib import Path
+
+
+def checksum(data: bytes, value: int = 0) -> int:
+    return zlib.crc32(data, value)
+
+
+def file_checksum(path: Path, offset: int, length: int) -> Optional[int]:
+    value = 0
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while length > 0:
+            data = f.read(min(length, 1024 ** 2))
+            if not data:
+                return None
+            value = checksum(data, value)
+            length -= len(data)
+    return value
+
+
+class Journal:
+    """
+    Sidecar file next to a download, one JSON object per line:
+
+    {"kind": "mp4", "size": 52428800}
+    {"start": 0, "end": 16777216, "crc": 2031561847}
+    {"start": 33554432, "end": 50331648, "crc": 918272517}
+
+    The first line describes the download, every following line is a finished
+    byte range (mp4) or segment (hls) together with the CRC32 of its bytes.
+    """
+
+    def __init__(self, target: Path):
+        self.path = target.with_name(target.name + ".journal")
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return self.path.is_file()
+
+    def load(self, header: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Return the records of a previous run, or nothing if it was for a different download."""
+        if not self.exists():
+            return []
+        records = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # The last line may be cut off by the interruption
+                    break
+        if not records or records[0] != header:
+            return []
+        return records[1:]
+
+    def start(self, header: Dict[str, Any], records: List[Dict[str, Any]]) -> None:
+        with self._lock, open(self.path, "w") as f:
+            for record in [header] + records:
+                f.write(json.dumps(record) + "\n")
+
+    def record(self, **record: Any) -> None:
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def remove(self) -> None:
+        if self.exists():
+            self.path.unlink()
+
+
+def verified_ranges(target: Path, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keep the recorded byte ranges whose bytes on disk still match their checksum."""
+    return [r for r in records if file_checksum(target, r["start"], r["end"] - r["start"]) == r["crc"]]
+
+
+def verified_segments(stream: Path, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keep the unbroken run of recorded segments from the first one that still match their checksum."""
+    done: List[Dict[str, Any]] = []
+    offset = 0
+    for r in sorted(records, key=lambda r: r["index"]):
+        if r["index"] != len(done) or r["offset"] != offset:
+            break
+        if file_checksum(stream, r["offset"], r["length"]) != r["crc"]:
+            break
+        done.append(r)
+        offset += r["length"]
+    return done
@@ -0,0 +1,169 @@
+from typing import Dict, Iterator, Optional, Tuple
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+from . import constant as c
+
+
+class Claimed(Exception):
+    """The video is being downloaded, or was downloaded, by another worker."""
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """
+    >>> parse_shard("2/3")
+    (2, 3)
+    >>> parse_shard("4/3")
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid shard 4/3, use I/N with 1 <= I <= N, e.g. 1/3
+    """
+    index, _, count = shard.partition("/")
+    try:
+        i, n = int(index), int(count)
+    except ValueError:
+        i = n = 0
+    if not 1 <= i <= n:
+        raise ValueError(f"invalid shard {shard}, use I/N with 1 <= I <= N, e.g. 1/3")
+    return i, n
+
+
+def in_shard(vid: str, index: int, count: int) -> bool:
+    """Whether shard index of count owns a video, by a hash that is the same on every machine."""
+    return zlib.crc32(vid.encode()) % count == index - 1
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Ledger:
+    """
+    Work shared by several workers through one SQLite file, e.g. on shared
+    storage. A worker claims a video before downloading it, and keeps its claims
+    alive with a heartbeat. The claims of a worker that stopped heartbeating
+    for `lease` seconds, and failed videos, up to `max_attempts` tries, can be
+    claimed again by any worker.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        worker: Optional[str] = None,
+        lease: float = c.LEDGER_LEASE,
+        max_attempts: int = c.LEDGER_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.worker = worker or default_worker_id()
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Transactions are begun by hand, so that a claim reads and writes under one lock of the file
+        self._conn = sqlite3.connect(str(path), timeout=c.TIMEOUT, check_same_thread=False, isolation_level=None)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS work (vid TEXT PRIMARY KEY, vname TEXT, pname TEXT, uname TEXT, vpage TEXT, "
+            "state TEXT NOT NULL, worker TEXT, heartbeat REAL, attempts INTEGER NOT NULL, error TEXT)"
+        )
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._beat, name="ledger-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _free(self, state: str, heartbeat: float, attempts: int, now: float) -> bool:
+        if state == "claimed":
+            return heartbeat < now - self.lease
+        return state == "failed" and attempts < self.max_attempts
+
+    def claim(self, video: Tuple[str, str, str, str, str]) -> bool:
+        """
+        Claim a video, given as (vid, vname, pname, uname, vpage). False when a
+        worker, this one included, holds it or it is done.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT state, heartbeat, attempts FROM work WHERE vid = ?", (video[0],)).fetchone()
+            if row is not None and not self._free(row[0], row[1], row[2], now):
+                return False
+            db.execute(
+                "INSERT OR REPLACE INTO work (vid, vname, pname, uname, vpage, state, worker, heartbeat, attempts) "
+                "VALUES (?, ?, ?, ?, ?, 'claimed', ?, ?, ?)",
+                tuple(video) + (self.worker, now, (row[2] if row else 0) + 1),
+            )
+        return True
+
+    def complete(self, vid: str) -> None:
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE work SET state = 'done', error = NULL WHERE vid = ? AND worker = ? AND state = 'claimed'",
+                (vid, self.worker),
+            )
+
+    def fail(self, vid: str, error: str) -> None:
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE work SET state = 'failed', error = ? WHERE vid = ? AND worker = ? AND state = 'claimed'",
+                (error, vid, self.worker),
+            )
+
+    def orphans(self) -> Iterator[Tuple[str, str, str, str, str]]:
+        """
+        Videos given up by other workers: claimed by a worker that stopped, or
+        failed there. Waits as long as other workers still hold claims, so that
+        none is left behind if they stop too. A video is offered again when
+        another worker claimed it since, and gave it up in turn.
+        """
+        offered: Dict[str, int] = {}  # attempts of each video when it was offered
+        while not self._stop.is_set():
+            now = time.time()
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT vid, vname, pname, uname, vpage, state, heartbeat, attempts FROM work "
+                    "WHERE worker != ? AND state IN ('claimed', 'failed')",
+                    (self.worker,),
+                ).fetchall()
+            free = [row for row in rows if offered.get(row[0], 0) < row[7] and self._free(row[5], row[6], row[7], now)]
+            for row in free:
+                offered[row[0]] = row[7]
+                yield row[:5]
+            if not free:
+                if not any(row[5] == "claimed" for row in rows):
+                    return
+                self._stop.wait(self.lease / 4)
+
+    def beat(self) -> None:
+        """Renew the claims this worker holds."""
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE work SET heartbeat = ? WHERE worker = ? AND state = 'claimed'", (time.time(), self.worker)
+            )
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self.lease / 4):
+            try:
+                self.beat()
+            except sqlite3.Error:
+                pass  # the file is busy or unreachable for now, the lease leaves room for a few misses
+
+    def close(self) -> None:
+        self._stop.set()
+        self._heartbeat.join()
+        with self._lock:
+            self._conn.close()
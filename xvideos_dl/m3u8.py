@@ -0,0 +1,79 @@
+"""A small M3U8 parser for the master and media playlists of the CDN.
+
+Lines are handled one at a time: blank lines, comments and tags it does not
+know are skipped, instead of assuming that tags and URIs alternate. Attribute
+lists are split by one precompiled pattern that keeps quoted commas.
+"""
+
+from typing import Dict, Optional, Tuple
+
+import re
+from collections import namedtuple
+
+ATTRIBUTE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+BYTERANGE = re.compile(r"(\d+)(?:@(\d+))?")
+
+
+Variant = namedtuple("Variant", "attributes uri")
+MediaSegment = namedtuple("MediaSegment", "duration uri byterange")  # byterange: offset and length, or None
+Master = namedtuple("Master", "variants media")  # media: EXT-X-MEDIA renditions, e.g. separate audio
+Media = namedtuple("Media", "segments encrypted")
+
+
+def parse_attributes(value: str) -> Dict[str, str]:
+    """
+    >>> parse_attributes('BANDWIDTH=423936,CODECS="avc1.4d401e,mp4a.40.2",NAME="360p"')
+    {'BANDWIDTH': '423936', 'CODECS': 'avc1.4d401e,mp4a.40.2', 'NAME': '360p'}
+    """
+    return {key: raw[1:-1] if raw[:1] == '"' else raw for key, raw in ATTRIBUTE.findall(value)}
+
+
+def parse_master(text: str) -> Master:
+    variants = []
+    media = []
+    stream: Optional[Dict[str, str]] = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != "#":
+            if stream is not None:
+                variants.append(Variant(stream, line))
+                stream = None
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            stream = parse_attributes(line[18:])
+        elif line.startswith("#EXT-X-MEDIA:"):
+            media.append(parse_attributes(line[13:]))
+    return Master(variants, media)
+
+
+def parse_media(text: str) -> Media:
+    segments = []
+    encrypted = False
+    duration = 0.0
+    byterange: Optional[Tuple[int, int]] = None
+    next_offset: Dict[str, int] = {}  # where a sub-range without an offset starts, per resource
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != "#":
+            if byterange is not None:
+                offset, length = byterange
+                if offset < 0:
+                    offset = next_offset.get(line, 0)
+                byterange = (offset, length)
+                next_offset[line] = offset + length
+            segments.append(MediaSegment(duration, line, byterange))
+            duration = 0.0
+            byterange = None
+        elif line.startswith("#EXTINF:"):
+            duration = float(line[8:].partition(",")[0])
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            find = BYTERANGE.match(line, 17)
+            if find:
+                size, start = find.groups()
+                byterange = (int(start) if start is not None else -1, int(size))
+        elif line.startswith("#EXT-X-KEY:"):
+            encrypted = parse_attributes(line[11:]).get("METHOD", "NONE") != "NONE"
+    return Media(segments, encrypted)
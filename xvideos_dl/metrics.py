@@ -0,0 +1,243 @@
+"""Counters, latency histograms and trace events for network and disk operations.
+
+    with metrics.span("fragment", kind="mp4") as span:
+        ...
+        span.fields["bytes"] = size
+
+Everything is kept in the global `metrics` registry, which renders in the
+Prometheus text format. Hooks added with `add_hook` receive every finished span,
+e.g. a JsonLinesWriter appending one JSON object per operation to a file.
+"""
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import cProfile
+import json
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from . import constant as c
+
+Labels = Tuple[Tuple[str, str], ...]
+Hook = Callable[[Dict[str, Any]], None]
+
+
+def label_key(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Labels) -> str:
+    """
+    >>> format_labels((("host", "a.com"), ("le", "0.5")))
+    '{host="a.com",le="0.5"}'
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+
+class Span:
+    def __init__(self, name: str, labels: Dict[str, Any]):
+        self.name = name
+        self.labels = labels  # kept by the histogram, so only a few distinct values each
+        self.fields: Dict[str, Any] = {}  # only passed to the hooks, e.g. the URL
+        self.start = time.time()
+
+
+class Registry:
+    def __init__(self, buckets: Tuple[float, ...] = c.METRICS_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}  # bucket counts with +Inf, then sum and count
+        self._hooks: List[Hook] = []
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = (name, label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        key = (name, label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0.0] * (len(self.buckets) + 3)
+            histogram[bisect_left(self.buckets, seconds)] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """Time a block into a histogram, without a trace event: for frequent small operations."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def span(self, name: str, **labels: Any) -> Iterator[Span]:
+        """Time a block into a histogram and pass it to the hooks, labelled with the error it raised, if any."""
+        span = Span(name, labels)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.labels["error"] = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(name, seconds, **span.labels)
+            if self._hooks:
+                self.emit({**span.fields, **span.labels, "event": name, "time": span.start, "seconds": seconds})
+
+    def add_hook(self, hook: Hook) -> None:
+        with self._lock:
+            self._hooks = self._hooks + [hook]
+
+    def remove_hook(self, hook: Hook) -> None:
+        with self._lock:
+            self._hooks = [h for h in self._hooks if h is not hook]
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        for hook in self._hooks:
+            hook(event)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = [dict(name=name, labels=dict(labels), value=v) for (name, labels), v in self._counters.items()]
+            histograms = [
+                dict(name=name, labels=dict(labels), sum=h[-2], count=int(h[-1]))
+                for (name, labels), h in self._histograms.items()
+            ]
+        return dict(counters=counters, histograms=histograms)
+
+    def render(self, prefix: str = "xvideos_dl_") -> str:
+        """Everything in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, list(h)) for k, h in self._histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {prefix}{name}_total counter")
+                typed.add(name)
+            lines.append(f"{prefix}{name}_total{format_labels(labels)} {value:g}")
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {prefix}{name}_seconds histogram")
+                typed.add(name)
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), histogram):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{prefix}{name}_seconds_bucket{format_labels(labels + (('le', le),))} {cumulative:g}")
+            lines.append(f"{prefix}{name}_seconds_sum{format_labels(labels)} {histogram[-2]:g}")
+            lines.append(f"{prefix}{name}_seconds_count{format_labels(labels)} {histogram[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+
+class JsonLinesWriter:
+    """A hook appending every event to a file, and the final counters and histograms when closed."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self, registry: Optional[Registry] = None) -> None:
+        with self._lock:
+            if registry is not None:
+                self._file.write(json.dumps(dict(event="summary", time=time.time(), **registry.snapshot())) + "\n")
+            self._file.close()
+
+
+class Profiler:
+    """
+    cProfile around download() and the pipeline stages. cProfile only follows the
+    thread it is enabled on and only one can run at a time, so the calls that
+    start while another is profiled are left out.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.stats: Optional[pstats.Stats] = None
+        self._running = threading.Lock()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def profile(self) -> Iterator[None]:
+        if not self.enabled or not self._running.acquire(blocking=False):
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+        finally:
+            self._running.release()
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    def stop(self, path: str) -> bool:
+        """Stop and write the collected stats for `python -m pstats` or snakeviz, False when nothing ran."""
+        self.enabled = False
+        with self._lock:
+            stats, self.stats = self.stats, None
+        if stats is None:
+            return False
+        stats.dump_stats(path)
+        return True
+
+
+def serve_metrics(registry: "Registry", address: Tuple[str, int]) -> Any:
+    """Expose GET /metrics on a background thread, return the server to shut it down."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(address, Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+metrics = Registry()
+profiler = Profiler()
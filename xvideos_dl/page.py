@@ -0,0 +1,54 @@
+"""Single-pass extraction of the fields downloads need from a watch page.
+
+The page is several hundred KB, and the player setup sits in the middle of it.
+The scanner searches the raw bytes chunk by chunk as they arrive, for the
+fields still missing only, and the caller stops reading once all are found.
+"""
+
+from typing import Dict, Iterable
+
+import html
+import re
+
+FIELDS = {
+    "title": re.compile(rb'<meta property="og:title" content="([^"]*)"\s*/>'),
+    "hls": re.compile(rb"setVideoHLS\(['\"]([^'\"]+)['\"]\)"),
+    "URL": re.compile(rb"setVideoUrlHigh\(['\"]([^'\"]+)['\"]\)"),
+    "URL_LOW": re.compile(rb"setVideoUrlLow\(['\"]([^'\"]+)['\"]\)"),
+}
+OVERLAP = 4096  # bytes kept from the previous chunk, longer than any field, so none is cut in two
+
+
+class PageScanner:
+    def __init__(self) -> None:
+        self.found: Dict[str, str] = {}
+        self._missing = dict(FIELDS)
+        self._tail = b""
+
+    @property
+    def done(self) -> bool:
+        return not self._missing
+
+    def feed(self, chunk: bytes) -> bool:
+        """Search one more chunk of the page, return whether every field is found."""
+        data = self._tail + chunk if self._tail else chunk
+        for name, pattern in list(self._missing.items()):
+            find = pattern.search(data)
+            if find:
+                value = find.group(1).decode("utf-8", "replace")
+                self.found[name] = html.unescape(value) if name == "title" else value
+                del self._missing[name]
+        self._tail = data[-OVERLAP:]
+        return self.done
+
+
+def scan_page(chunks: Iterable[bytes]) -> Dict[str, str]:
+    """
+    >>> scan_page([b'<meta property="og:title" content="Tom &amp; Jerry" />', b"setVideoHLS('https://cdn/hls.m3u8')"])
+    {'title': 'Tom & Jerry', 'hls': 'https://cdn/hls.m3u8'}
+    """
+    scanner = PageScanner()
+    for chunk in chunks:
+        if scanner.feed(chunk):
+            break
+    return scanner.found
@@ -0,0 +1,128 @@
+"""Stages run on their own worker threads, connected by bounded queues.
+
+    pipeline = Pipeline([("resolve", resolve, 4), ("fetch", fetch, 2), ("finalize", finalize, 2)])
+    for work in pipeline.run(videos):
+        ...
+
+Each stage takes the value the previous one returned, starting with the item.
+An item whose stage raised skips the rest and comes out with its error, so one
+failure does not hold up the others. Items come out in the order they finish.
+"""
+
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import queue
+import threading
+
+from . import constant as c
+from .metrics import metrics, profiler
+
+DONE = object()  # passed down a queue once every item went through
+
+
+class Work:
+    __slots__ = ("item", "value", "error")
+
+    def __init__(self, item: Any):
+        self.item = item
+        self.value = item
+        self.error: Optional[BaseException] = None
+
+
+class Pipeline:
+    def __init__(self, stages: Sequence[Tuple[str, Callable[[Any], Any], int]], depth: int = c.PIPELINE_DEPTH):
+        self.stages = stages
+        self.depth = depth  # items waiting between two stages, on top of those being worked on
+
+    def run(self, items: Iterable[Any]) -> Iterator[Work]:
+        queues: List["queue.Queue[Any]"] = [queue.Queue(self.depth) for _ in range(len(self.stages) + 1)]
+        stop = threading.Event()
+        errors: List[BaseException] = []
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], stop, errors), name="feed")]
+        for i, (name, func, workers) in enumerate(self.stages):
+            left = [max(1, workers)]
+            threads += [
+                threading.Thread(
+                    target=self._work,
+                    args=(name, func, queues[i], queues[i + 1], stop, left, threading.Lock()),
+                    name=f"{name}-{n}",
+                )
+                for n in range(left[0])
+            ]
+        for thread in threads:
+            thread.daemon = True  # an interrupted run leaves them to finish their item or die with the process
+            thread.start()
+        try:
+            while 1:
+                work = get(queues[-1], stop)
+                if work is DONE:
+                    break
+                yield work
+        finally:
+            stop.set()
+        if errors:
+            raise errors[0]
+
+    def _feed(
+        self, items: Iterable[Any], out: "queue.Queue[Any]", stop: threading.Event, errors: List[BaseException]
+    ) -> None:
+        try:
+            for item in items:
+                if not put(out, Work(item), stop):
+                    return
+        except Exception as e:
+            # The items that were already listed still go through, then run() raises
+            errors.append(e)
+        put(out, DONE, stop)
+
+    def _work(
+        self,
+        name: str,
+        func: Callable[[Any], Any],
+        inbox: "queue.Queue[Any]",
+        out: "queue.Queue[Any]",
+        stop: threading.Event,
+        left: List[int],
+        lock: threading.Lock,
+    ) -> None:
+        while 1:
+            work = get(inbox, stop)
+            if work is None:
+                return
+            if work is DONE:
+                # Hand the marker to the next sibling; the last worker of the stage passes it on
+                put(inbox, DONE, stop)
+                with lock:
+                    left[0] -= 1
+                    last = left[0] == 0
+                if last:
+                    put(out, DONE, stop)
+                return
+            if work.error is None:
+                try:
+                    with profiler.profile(), metrics.span("stage", stage=name):
+                        work.value = func(work.value)
+                except Exception as e:
+                    work.error = e
+            if not put(out, work, stop):
+                return
+
+
+def get(q: "queue.Queue[Any]", stop: threading.Event) -> Any:
+    """The next value of q, or None once the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+
+def put(q: "queue.Queue[Any]", value: Any, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(value, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
@@ -0,0 +1,191 @@
+"""A dry run that estimates how much a download takes, before starting it.
+
+Every video is resolved, concurrently, to the variant the download would pick.
+An MP4 is sized by a HEAD request, an HLS stream by the duration of its media
+playlist times the bandwidth of the variant. The first bytes of a few videos
+are fetched at the same time to measure the throughput the ETA is based on.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional
+
+import json
+import shutil
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from . import constant as c
+from . import m3u8, ratelimit
+from .progress import format_speed
+from .xvideos_dl import Video, console, fetch_in_order, get_video_url, media_segments, resolve_video, session_request
+
+# size: bytes of the file, exact when it comes from the server or the disk
+# sample: a URL to measure the throughput on, the MP4 or the first segment
+Estimate = namedtuple("Estimate", "video path variant kind size exact downloaded sample error")
+
+
+def estimate_video(video: Video, dest: str, quality: str) -> Estimate:
+    plan = resolve_video(video, dest, quality, mkdir=False)
+    variant = plan.hls.name
+    if plan.path.is_file():
+        return Estimate(
+            video,
+            plan.path,
+            variant,
+            "mp4" if plan.mp4_field else "hls",
+            plan.path.stat().st_size,
+            True,
+            True,
+            None,
+            None,
+        )
+    if plan.mp4_field:
+        url = get_video_url(video.vid, plan.mp4_field == "URL_LOW", False)
+        head = session_request("HEAD", url, stream=True)
+        if not head:
+            raise IOError(f"{url} is not available")
+        return Estimate(video, plan.path, variant, "mp4", int(head.headers["Content-Length"]), True, False, url, None)
+    resp = session_request("GET", plan.hls.url)
+    if not resp:
+        raise IOError(f"{plan.hls.url} is not available")
+    segments = media_segments(m3u8.parse_media(resp.text), plan.hls.url)
+    if segments and all(s.byterange for s in segments):
+        size, exact = sum(s.byterange[1] for s in segments), True
+    else:
+        size, exact = int(sum(s.duration for s in segments) * int(plan.hls.bandwidth) / 8), False
+    sample = segments[0].url if segments and not segments[0].byterange else None
+    return Estimate(video, plan.path, variant, "hls", size, exact, False, sample, None)
+
+
+def estimate_videos(videos: Iterable[Video], dest: str, quality: str, workers: int = c.PLAN_WORKERS) -> List[Estimate]:
+    def estimate(video: Video) -> Estimate:
+        try:
+            return estimate_video(video, dest, quality)
+        except Exception as e:
+            return Estimate(video, None, None, None, 0, False, False, None, str(e))
+
+    return list(fetch_in_order(estimate, videos, workers))
+
+
+def measure_throughput(urls: List[str], workers: int) -> float:
+    """Bytes per second of fetching the first PLAN_SAMPLE bytes of up to `workers` URLs at the same time."""
+
+    def sample(url: str) -> int:
+        resp = session_request("GET", url, stream=True, headers={"Range": f"bytes=0-{c.PLAN_SAMPLE - 1}"})
+        if not resp:
+            return 0
+        try:
+            return sum(len(chunk) for chunk in resp.iter_content(c.CHUNK_SIZE))
+        finally:
+            resp.close()
+
+    urls = urls[:workers]
+    if not urls:
+        return 0
+    started = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            size = sum(executor.map(sample, urls))
+    except Exception:
+        return 0
+    seconds = time.time() - started
+    return size / seconds if seconds > 0 else 0
+
+
+def free_space(dest: str) -> int:
+    """Free bytes on the disk of dest, or of its nearest parent that exists."""
+    path = Path(dest).absolute()
+    while not path.exists():
+        path = path.parent
+    return shutil.disk_usage(str(path)).free
+
+
+def summarize(estimates: List[Estimate], dest: str, jobs: int) -> Dict[str, Any]:
+    pending = [e for e in estimates if not e.downloaded and not e.error]
+    download = sum(e.size for e in pending)
+    # An HLS stream is saved as .ts, then remuxed into a second file of about the same size
+    need = download + max([e.size for e in pending if e.kind == "hls"] or [0])
+    throughput = measure_throughput([e.sample for e in sorted(pending, key=lambda e: -e.size) if e.sample], jobs)
+    if ratelimit.bandwidth.rate:
+        throughput = min(throughput, ratelimit.bandwidth.rate) if throughput else ratelimit.bandwidth.rate
+    free = free_space(dest)
+    eta: Optional[float] = download / throughput if throughput else None
+    return dict(
+        videos=len(estimates),
+        downloaded=sum(e.downloaded for e in estimates),
+        failed=sum(bool(e.error) for e in estimates),
+        total_bytes=sum(e.size for e in estimates),
+        download_bytes=download,
+        need_bytes=need,
+        free_bytes=free,
+        fits=need <= free,
+        throughput=throughput,
+        eta_seconds=eta,
+    )
+
+
+def estimate_state(estimate: Estimate) -> Dict[str, Any]:
+    video = estimate.video
+    return dict(
+        vid=video.vid,
+        name=video.vname,
+        path=str(estimate.path) if estimate.path else None,
+        variant=estimate.variant,
+        kind=estimate.kind,
+        size=estimate.size,
+        exact=estimate.exact,
+        downloaded=estimate.downloaded,
+        error=estimate.error,
+    )
+
+
+def format_size(size: float) -> str:
+    return f"{size / 1024 ** 3:.2f} GB" if size >= 1024 ** 3 else f"{size / 1024 ** 2:.2f} MB"
+
+
+def format_duration(seconds: float) -> str:
+    """
+    >>> format_duration(3725)
+    '1:02:05'
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}"
+
+
+def print_plan(estimates: List[Estimate], summary: Dict[str, Any], as_json: bool = False) -> None:
+    if as_json:
+        print(json.dumps(dict(summary, estimates=[estimate_state(e) for e in estimates])))
+        return
+    from rich.table import Table
+
+    table = Table("ID", "Name", "Variant", "Size", "")
+    for e in estimates:
+        if e.error:
+            table.add_row(e.video.vid, e.video.vname, "", "", f"[red]{e.error}[/]")
+        else:
+            size = format_size(e.size) if e.exact else f"≈ {format_size(e.size)}"
+            table.add_row(
+                e.video.vid,
+                e.video.vname,
+                f"{e.variant} {e.kind}",
+                size,
+                "[green]downloaded[/]" if e.downloaded else "",
+            )
+    console.print(table)
+    console.print(
+        f"Videos     : [white]{summary['videos']}[/], {summary['downloaded']} downloaded already, "
+        f"{summary['failed']} not resolved"
+    )
+    console.print(f"To download: [white]{format_size(summary['download_bytes'])}[/]")
+    color = "green" if summary["fits"] else "red"
+    console.print(
+        f"Disk space : [{color}]{format_size(summary['need_bytes'])} needed, {format_size(summary['free_bytes'])} free[/]"
+    )
+    if summary["eta_seconds"] is None:
+        console.print("ETA        : [white]unknown[/], the throughput could not be measured")
+    else:
+        console.print(
+            f"ETA        : [white]{format_duration(summary['eta_seconds'])}[/] "
+            f"at {format_speed(summary['throughput']).strip()}"
+        )
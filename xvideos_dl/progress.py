@@ -0,0 +1,164 @@
+from typing import Any, Dict, Iterator, List, Optional
+
+import json
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from rich.console import Console
+from rich.live import Live
+from rich.markup import escape
+from rich.text import Text
+
+from . import constant as c
+
+MODES = ("auto", "bar", "quiet", "json")
+
+
+def format_speed(speed: float) -> str:
+    if speed < 1024:  # 1KB
+        return f"{speed:7.2f}B/s"
+    if speed < 1048576:  # 1MB
+        return f"{speed / 1024:7.2f}KB/s"
+    return f"{speed / 1048576:7.2f}MB/s"
+
+
+class Task:
+    """One progress bar. update() only bumps counters, drawing is left to the renderer thread."""
+
+    def __init__(self, name: str, total: int, done: int = 0):
+        self.name = name
+        self.total = total
+        self.done = done
+        self.received = 0
+        self.emoji = random.choice(c.SMILE_EMOJIS)
+        self.time_start = time.time()
+        self._lock = threading.Lock()
+
+    def update(self, n: int, received: Optional[int] = None) -> None:
+        with self._lock:
+            self.done += n
+            self.received += n if received is None else received
+
+    @property
+    def percent(self) -> float:
+        return int(min(self.done, self.total) / max(self.total, 1) * 1000) / 10
+
+    @property
+    def speed(self) -> float:
+        return self.received / max(time.time() - self.time_start, 1e-6)
+
+    def bar(self, width: int = 60) -> str:
+        bar_done = int(self.percent / 100 * width)
+        return (
+            f"{self.emoji} ╞{'█' * bar_done}{' ' * (width - bar_done)}╡ "
+            f"[green]{self.percent:5.1f}% {format_speed(self.speed)}[/]"
+        )
+
+    def state(self, **extra: Any) -> Dict[str, Any]:
+        return dict(
+            task=self.name,
+            done=self.done,
+            total=self.total,
+            percent=self.percent,
+            bytes=self.received,
+            speed=round(self.speed, 2),
+            **extra,
+        )
+
+
+class ProgressRenderer:
+    """
+    Draws every running Task at a fixed rate from a background thread:
+
+    - bar: rich bars, one line per concurrent download
+    - json: one JSON object per task and refresh on stdout, for logs and scripts
+    - quiet: nothing at all
+    """
+
+    def __init__(self, mode: str = "auto", refresh: float = c.PROGRESS_REFRESH):
+        self.console = Console()
+        self.mode = mode
+        self.refresh = refresh
+        self._tasks: List[Task] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._live: Optional[Live] = None
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode: str) -> None:
+        if mode not in MODES:
+            raise ValueError(f"unknown progress mode {mode}, choose from {', '.join(MODES)}")
+        if mode == "auto":
+            mode = "bar" if self.console.is_terminal else "quiet"
+        self._mode = mode
+
+    @contextmanager
+    def task(self, name: str, total: int, done: int = 0) -> Iterator[Task]:
+        task = Task(name, total, done)
+        with self._lock:
+            self._tasks.append(task)
+            if self._thread is None and self._mode != "quiet":
+                self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+                self._thread.start()
+        try:
+            yield task
+        finally:
+            with self._lock:
+                self._tasks.remove(task)
+                self._finish(task)
+
+    def snapshot(self) -> List[Task]:
+        with self._lock:
+            return list(self._tasks)
+
+    def _line(self, task: Task, many: bool) -> str:
+        if not many:
+            return task.bar()
+        return f"{escape(task.name[:24].ljust(24))} {task.bar(40)}"
+
+    def _finish(self, task: Task) -> None:
+        if self._mode == "bar":
+            line = self._line(task, many=bool(self._tasks))
+            if self._live is not None:
+                self._live.console.print(line)
+            else:
+                self.console.print(line)
+        elif self._mode == "json":
+            self._emit(task.state(finished=task.done >= task.total))
+
+    def _emit(self, state: Dict[str, Any]) -> None:
+        sys.stdout.write(json.dumps(state, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    def _render(self) -> Text:
+        many = len(self._tasks) > 1
+        return Text.from_markup("\n".join(self._line(task, many) for task in self._tasks))
+
+    def _run(self) -> None:
+        while 1:
+            with self._lock:
+                if not self._tasks:
+                    self._thread = None
+                    if self._live is not None:
+                        self._live.stop()
+                        self._live = None
+                    return
+                if self._mode == "bar":
+                    if self._live is None:
+                        self._live = Live(console=self.console, auto_refresh=False, transient=True)
+                        self._live.start()
+                    self._live.update(self._render(), refresh=True)
+                elif self._mode == "json":
+                    for task in self._tasks:
+                        self._emit(task.state(finished=False))
+            time.sleep(1 / self.refresh)
+
+
+renderer = ProgressRenderer()
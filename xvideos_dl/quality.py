@@ -0,0 +1,77 @@
+from typing import Any, List, Optional, Sequence, Tuple
+
+import re
+from dataclasses import dataclass
+
+from . import constant as c
+
+PREFERENCES = ("auto", "mp4", "hls")
+
+
+def variant_height(variant: Any) -> int:
+    """
+    The height of an HLS variant, from its name or else its resolution.
+
+    >>> from collections import namedtuple
+    >>> HLS = namedtuple("HLS", "name bandwidth resolution url")
+    >>> variant_height(HLS("480p", "800000", "480x854", ""))
+    480
+    >>> variant_height(HLS("hd", "800000", "1280x720", ""))
+    720
+    """
+    find = re.fullmatch(r"(\d+)p", variant.name)
+    if find:
+        return int(find.group(1))
+    return min(int(n) for n in variant.resolution.split("x"))
+
+
+@dataclass
+class QualityPolicy:
+    """
+    Which variant of a video to download. The variants are narrowed down to those
+    at most max_height high and max_bandwidth bits per second (keeping the lowest
+    one if none is), and the quality picks the highest, middle or lowest of them.
+
+    An MP4 rendition has the same bitrate as its HLS variant but is a single file
+    fetched with parallel ranges, without a request per segment or a remux, so
+    "auto" takes it whenever the chosen variant has one. "mp4" only considers the
+    variants that have an MP4 rendition, "hls" always streams.
+    """
+
+    max_height: int = 0
+    max_bandwidth: int = 0
+    prefer: str = "auto"
+
+    def __post_init__(self) -> None:
+        if self.prefer not in PREFERENCES:
+            raise ValueError(f"unknown preference {self.prefer}, choose from {', '.join(PREFERENCES)}")
+
+    def candidates(self, variants: Sequence[Any]) -> List[Any]:
+        ordered = sorted(variants, key=lambda v: int(v.bandwidth))
+        if self.prefer == "mp4":
+            ordered = [v for v in ordered if v.name in c.HAS_MP4_RESOUCE] or ordered
+        allowed = [
+            v
+            for v in ordered
+            if (not self.max_height or variant_height(v) <= self.max_height)
+            and (not self.max_bandwidth or int(v.bandwidth) <= self.max_bandwidth)
+        ]
+        return allowed or ordered[:1]
+
+    def choose(self, variants: Sequence[Any], quality: str) -> Tuple[Any, Optional[str]]:
+        """The variant to download, and the VIDEO_API field of its MP4 URL if it is taken as MP4."""
+        if not variants:
+            raise ValueError("the video has no HLS variants")
+        candidates = self.candidates(variants)
+        if quality == "high":
+            variant = candidates[-1]
+        elif quality == "middle":
+            variant = candidates[len(candidates) // 2]
+        else:
+            variant = candidates[0]
+        if self.prefer == "hls" or variant.name not in c.HAS_MP4_RESOUCE:
+            return variant, None
+        return variant, c.MP4_FIELDS[variant.name]
+
+
+policy = QualityPolicy()
@@ -0,0 +1,70 @@
+from typing import Optional
+
+import re
+import threading
+import time
+
+UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def parse_rate(rate: str) -> float:
+    """
+    Bytes per second from a rate like wget's --limit-rate.
+
+    >>> parse_rate("500k")
+    512000.0
+    >>> parse_rate("1.5M")
+    1572864.0
+    """
+    find = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?\s*", rate, re.IGNORECASE)
+    if not find:
+        raise ValueError(f"invalid rate: {rate}, use a number of bytes per second with an optional K, M or G suffix")
+    return float(find.group(1)) * UNITS[find.group(2).lower()]
+
+
+class TokenBucket:
+    """
+    Allows `rate` tokens per second, and bursts of up to `burst` tokens after being
+    idle. A rate of 0 means unlimited. Takers may run into debt, which they then pay
+    back by sleeping, so a large chunk is never starved by smaller ones.
+    """
+
+    def __init__(self, rate: float = 0, burst: Optional[float] = None):
+        self._lock = threading.Lock()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: float, burst: Optional[float] = None) -> None:
+        with self._lock:
+            self.rate = rate
+            self.burst = burst if burst is not None else rate
+            self._tokens = self.burst
+            self._updated = time.monotonic()
+
+    def reserve(self, n: float) -> float:
+        """Take n tokens, return how many seconds the caller has to wait before using them."""
+        if self.rate <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= n
+            return max(0.0, -self._tokens / self.rate)
+
+    def consume(self, n: float) -> None:
+        wait = self.reserve(n)
+        if wait > 0:
+            time.sleep(wait)
+
+
+bandwidth = TokenBucket()  # bytes of every download together
+request_rate = TokenBucket()  # requests to the site and its API
+
+
+def throttle(n: int, limit: Optional[TokenBucket] = None) -> None:
+    """Account for n bytes received, against the global bandwidth and a job's own limit."""
+    wait = bandwidth.reserve(n)
+    if limit is not None:
+        wait = max(wait, limit.reserve(n))
+    if wait > 0:
+        time.sleep(wait)
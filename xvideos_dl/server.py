@@ -0,0 +1,324 @@
+"""A long-running download daemon with a local HTTP/JSON API.
+
+    POST   /jobs        {"urls": [...], "quality": "high", "dest": "./xvideos", "overwrite": false}
+    GET    /jobs        every job, finished ones for a while (see JOB_RETENTION and MAX_FINISHED_JOBS)
+    GET    /jobs/<id>   one job, with the progress of the videos it is downloading
+    DELETE /jobs/<id>   cancel a job
+    GET    /metrics     counters and latency histograms in the Prometheus text format
+
+All jobs share the process: one connection pool, cookie store and metadata cache.
+A job that needs a login while no cookie is accepted is parked, and run again
+once a cookie file changes.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import json
+import queue
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import constant as c
+from .archive import Archive
+from .auth import CookieExpired
+from .integrity import read_sidecar
+from .metrics import metrics
+from .progress import renderer
+from .ratelimit import TokenBucket
+from .xvideos_dl import Cancelled, console, download, iter_videos_from_urls, resolve_ahead, session_pool
+
+QUALITIES = ("low", "middle", "high")
+
+
+class Job:
+    def __init__(self, urls: List[str], dest: str, quality: str, overwrite: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.urls = urls
+        self.dest = dest
+        self.quality = quality
+        self.overwrite = overwrite
+        self.status = "queued"
+        self.videos = 0
+        self.done = 0
+        self.skipped = 0
+        self.failures: List[Dict[str, str]] = []
+        self.current: List[str] = []
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.cancel = threading.Event()
+
+    def state(self) -> Dict[str, Any]:
+        progress = [
+            task.state() for task in renderer.snapshot() if any(task.name.endswith(f"(#{vid})") for vid in self.current)
+        ]
+        return dict(
+            id=self.id,
+            urls=self.urls,
+            dest=self.dest,
+            quality=self.quality,
+            status=self.status,
+            videos=self.videos,
+            done=self.done,
+            skipped=self.skipped,
+            failures=self.failures,
+            progress=progress,
+            error=self.error,
+            created=self.created,
+            started=self.started,
+            finished=self.finished,
+        )
+
+
+class Daemon:
+    """Runs submitted jobs on `workers` threads, each job downloading its videos one by one."""
+
+    def __init__(
+        self,
+        dest: str,
+        quality: str,
+        overwrite: bool,
+        reset_cookie: bool,
+        connections: int = c.CONNECTIONS,
+        workers: int = 1,
+        archive: Optional[Archive] = None,
+        job_rate: float = 0,
+        retention: float = c.JOB_RETENTION,
+        max_finished: int = c.MAX_FINISHED_JOBS,
+    ):
+        self.dest = dest
+        self.quality = quality
+        self.overwrite = overwrite
+        self.reset_cookie = reset_cookie
+        self.connections = connections
+        self.archive = archive
+        self.job_rate = job_rate
+        self.retention = retention
+        self.max_finished = max_finished
+        self.jobs: Dict[str, Job] = {}
+        self._parked: List[Job] = []
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, name=f"job-{i}", daemon=True) for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(
+        self,
+        urls: List[str],
+        dest: Optional[str] = None,
+        quality: Optional[str] = None,
+        overwrite: Optional[bool] = None,
+    ) -> Job:
+        job = Job(
+            urls,
+            dest or self.dest,
+            quality or self.quality,
+            self.overwrite if overwrite is None else bool(overwrite),
+        )
+        with self._lock:
+            self.jobs[job.id] = job
+        self._queue.put(job)
+        return job
+
+    def prune(self) -> None:
+        """Forget the jobs that finished more than `retention` seconds ago, and the oldest beyond max_finished."""
+        with self._lock:
+            finished = sorted((job.finished, job.id) for job in self.jobs.values() if job.finished is not None)
+            expired = time.time() - self.retention
+            for i, (at, job_id) in enumerate(finished):
+                if at < expired or i < len(finished) - self.max_finished:
+                    del self.jobs[job_id]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.cancel.set()
+            if job.status in ("queued", "parked"):
+                job.status = "cancelled"
+                job.finished = time.time()
+        return job
+
+    def close(self) -> None:
+        for job in list(self.jobs.values()):
+            self.cancel(job.id)
+        for _ in self._workers:
+            self._queue.put(None)
+
+    def _unpark(self) -> None:
+        """Queue the parked jobs again once a cookie is accepted, e.g. a cookie file was changed."""
+        with self._lock:
+            if not self._parked or not session_pool.accounts():
+                return
+            parked, self._parked = self._parked, []
+        for job in parked:
+            if job.status == "parked":
+                job.status = "queued"
+                self._queue.put(job)
+
+    def _work(self) -> None:
+        while 1:
+            try:
+                job = self._queue.get(timeout=c.PARK_POLL)
+            except queue.Empty:
+                self._unpark()
+                continue
+            if job is None:
+                return
+            if job.cancel.is_set():
+                continue
+            job.status = "running"
+            job.started = time.time()
+            try:
+                self._run(job)
+                job.status = "cancelled" if job.cancel.is_set() else "failed" if job.failures else "finished"
+            except Cancelled:
+                job.status = "cancelled"
+            except CookieExpired as e:
+                job.status = "parked"
+                job.error = str(e)
+                job.current = []
+                with self._lock:
+                    self._parked.append(job)
+                console.print(f"Job [white]{job.id}[/] parked: {e}")
+                continue
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+            job.current = []
+            job.finished = time.time()
+            console.print(f"Job [white]{job.id}[/] {job.status}: {job.done} downloaded, {len(job.failures)} failed")
+            self.prune()
+
+    def _run(self, job: Job) -> None:
+        def archived(vid: str) -> bool:
+            if self.archive is not None and vid in self.archive:
+                job.skipped += 1
+                return True
+            return False
+
+        # A parked job starts over, the videos it already downloaded are skipped
+        job.videos = job.done = job.skipped = 0
+        job.failures = []
+        job.error = None
+        videos = iter_videos_from_urls(job.urls, self.reset_cookie, skip=None if job.overwrite else archived)
+        for video in resolve_ahead(videos):
+            if job.cancel.is_set():
+                return
+            job.videos += 1
+            job.current = [video.vid]
+            limit = TokenBucket(self.job_rate) if self.job_rate else None
+            try:
+                downloaded = download(
+                    video,
+                    job.dest,
+                    job.quality,
+                    job.overwrite,
+                    self.reset_cookie,
+                    self.connections,
+                    True,
+                    limit,
+                    job.cancel,
+                )
+            except (Cancelled, CookieExpired):
+                raise
+            except Exception as e:
+                job.failures.append(dict(vid=video.vid, vpage=video.vpage, error=str(e)))
+                continue
+            if downloaded and self.archive is not None and downloaded.path.is_file():
+                digest = (read_sidecar(downloaded.path) or {}).get("root")
+                self.archive.add(video.vid, downloaded.path, downloaded.path.stat().st_size, downloaded.quality, digest)
+            job.done += 1
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """
+    >>> parse_address("8020")
+    ('127.0.0.1', 8020)
+    >>> parse_address("0.0.0.0:8020")
+    ('0.0.0.0', 8020)
+    """
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def make_server(daemon: Daemon, address: Tuple[str, int]) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def reply(self, status: int, data: Any, content_type: str = "application/json") -> None:
+            body = data.encode() if isinstance(data, str) else json.dumps(data, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def job(self) -> Optional[Job]:
+            job = daemon.jobs.get(self.path.rstrip("/").rpartition("/")[2])
+            if job is None:
+                self.reply(404, {"error": f"no such job: {self.path}"})
+            return job
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/") == "/jobs":
+                daemon.prune()
+                self.reply(200, [job.state() for job in list(daemon.jobs.values())])
+            elif self.path.startswith("/jobs/"):
+                job = self.job()
+                if job is not None:
+                    self.reply(200, job.state())
+            elif self.path.rstrip("/") == "/metrics":
+                self.reply(200, metrics.render(), "text/plain; version=0.0.4")
+            else:
+                self.reply(404, {"error": f"not found: {self.path}"})
+
+        def do_POST(self) -> None:
+            if self.path.rstrip("/") != "/jobs":
+                self.reply(404, {"error": f"not found: {self.path}"})
+                return
+            try:
+                data = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                urls = data["urls"]
+                if isinstance(urls, str):
+                    urls = [urls]
+                if not urls or not all(isinstance(url, str) for url in urls):
+                    raise ValueError("urls must be a non-empty list of URLs")
+                if data.get("quality", "high") not in QUALITIES:
+                    raise ValueError(f"quality must be one of {', '.join(QUALITIES)}")
+            except (KeyError, TypeError, ValueError) as e:
+                self.reply(400, {"error": f"invalid job: {e}"})
+                return
+            job = daemon.submit(urls, data.get("dest"), data.get("quality"), data.get("overwrite"))
+            self.reply(201, job.state())
+
+        def do_DELETE(self) -> None:
+            if not self.path.startswith("/jobs/"):
+                self.reply(404, {"error": f"not found: {self.path}"})
+                return
+            job = self.job()
+            if job is not None:
+                daemon.cancel(job.id)
+                self.reply(200, job.state())
+
+    server = ThreadingHTTPServer(address, Handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(daemon: Daemon, address: str) -> None:
+    host, port = parse_address(address)
+    server = make_server(daemon, (host, port))
+    port = server.server_port  # the one picked by the system when asked for 0
+    console.print(f"Serving on [underline]http://{host}:{port}/jobs[/], press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
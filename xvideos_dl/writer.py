@@ -0,0 +1,171 @@
+"""Writes a download into a .part file next to its final name.
+
+The file is preallocated to its full size, so that the filesystem can lay it
+out in one piece, then each connection writes its range through a buffer that
+is flushed at aligned offsets, a few large writes instead of one per chunk read.
+Once complete, the .part file is renamed to the final name, so that a file at
+the final name is always a finished download.
+"""
+
+from typing import Any, Optional
+
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from . import constant as c
+from .metrics import metrics
+
+FSYNC_POLICIES = ("never", "close", "always")
+_seek_lock = threading.Lock()
+
+
+@dataclass
+class WritePolicy:
+    """
+    fsync: never leaves flushing to the OS, close syncs a file before it is
+    renamed to its final name, always syncs after every write as well.
+    """
+
+    fsync: str = "close"
+    buffer_size: int = c.WRITE_BUFFER
+    preallocate: bool = True
+
+    def __post_init__(self) -> None:
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy {self.fsync}, choose from {', '.join(FSYNC_POLICIES)}")
+
+
+def part_path(path: Path) -> Path:
+    return path.with_name(path.name + ".part")
+
+
+def preallocate(fd: int, size: int) -> None:
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass  # not supported by the filesystem, the file is only extended
+    os.ftruncate(fd, size)
+
+
+def write_at(fd: int, data: bytes, offset: int) -> None:
+    metrics.inc("written_bytes", len(data))
+    with metrics.timer("disk_write"):
+        if hasattr(os, "pwrite"):
+            os.pwrite(fd, data, offset)
+            return
+        # Windows has no pwrite, serialize seek + write instead
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+
+
+def sync_directory(path: Path) -> None:
+    """Make a rename in the directory durable, where directories can be opened."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(str(path), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def commit(part: Path, path: Path, policy: Optional["WritePolicy"] = None) -> None:
+    """Rename a finished .part file to its final name, synced first as the policy says."""
+    policy = policy or write_policy
+    if policy.fsync != "never":
+        fd = os.open(str(part), os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    os.replace(str(part), str(path))
+    if policy.fsync != "never":
+        sync_directory(path.parent)
+
+
+class Writer:
+    """
+    A download of a known size, written in place from several threads.
+
+        with Writer(path, size) as writer:
+            buffer = writer.buffer(start)
+            buffer.write(chunk)
+            buffer.flush()
+            writer.commit()
+
+    Leaving the block without commit() keeps the .part file to resume from.
+    """
+
+    def __init__(self, path: Path, size: int, policy: Optional[WritePolicy] = None):
+        self.path = path
+        self.part = part_path(path)
+        self.size = size
+        self.policy = policy or write_policy
+        self.fd: Optional[int] = os.open(str(self.part), os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            if self.policy.preallocate and os.fstat(self.fd).st_size != size:
+                preallocate(self.fd, size)
+            else:
+                os.ftruncate(self.fd, size)
+        except BaseException:
+            self.close()
+            raise
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        if self.fd is None:
+            raise ValueError(f"{self.part} is closed")
+        write_at(self.fd, data, offset)
+        if self.policy.fsync == "always":
+            os.fsync(self.fd)
+
+    def buffer(self, offset: int) -> "Buffer":
+        return Buffer(self, offset, self.policy.buffer_size)
+
+    def commit(self) -> None:
+        self.close()
+        commit(self.part, self.path, self.policy)
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self) -> "Writer":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class Buffer:
+    """Consecutive bytes of one range, written out whenever they reach a multiple of size."""
+
+    def __init__(self, writer: Writer, offset: int, size: int = c.WRITE_BUFFER):
+        self.writer = writer
+        self.offset = offset  # where the buffered bytes start
+        self.size = size
+        self.data = bytearray()
+
+    def write(self, chunk: bytes) -> None:
+        self.data += chunk
+        end = self.offset + len(self.data)
+        if len(self.data) >= self.size:
+            # Cut at an aligned offset, so that the following writes start aligned
+            self._write(end - end % self.size - self.offset)
+
+    def flush(self) -> None:
+        self._write(len(self.data))
+
+    def _write(self, length: int) -> None:
+        if length <= 0:
+            return
+        self.writer.write_at(self.offset, bytes(self.data[:length]))
+        del self.data[:length]
+        self.offset += length
+
+
+write_policy = WritePolicy()
@@ -1,28 +1,67 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar
 
 import html
-import random
+import importlib.util
 import re
+import sys
+import threading
 import time
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from functools import wraps
+from functools import partial
+from itertools import chain
 from pathlib import Path
+from urllib.parse import urljoin, urlsplit
 
-import ffmpeg
-from bs4 import BeautifulSoup
-from integv import FileIntegrityVerifier
+from requests import ConnectionError as RequestsConnectionError
 from requests import Response, Session
-from requests.cookies import cookiejar_from_dict
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError
 from rich.console import Console
 
+from . import backoff
 from . import constant as c
-
+from . import m3u8, ratelimit
+from .adaptive import Controller, RangeAllocator
+from .archive import Archive
+from .auth import ANONYMOUS_COOKIE, CookieExpired, CookieStore, SessionPool
+from .cache import metadata_cache
+from .integrity import BlockHasher, Verifier, hash_file, read_sidecar, remove_sidecar, write_sidecar
+from .journal import Journal, checksum, verified_ranges, verified_segments
+from .ledger import Claimed, Ledger
+from .metrics import metrics, profiler
+from .page import scan_page
+from .pipeline import Pipeline
+from .progress import Task, renderer
+from .quality import policy
+from .ratelimit import TokenBucket, throttle
+from .writer import Writer, commit, part_path
+
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
 console = Console()
-session = Session()
-verifier = FileIntegrityVerifier()
+_session: Optional[Session] = None
+_session_lock = threading.Lock()
+verifier = Verifier()
 Video = namedtuple("Video", "vid vname pname uname vpage")
+Failure = namedtuple("Failure", "video error")
+Downloaded = namedtuple("Downloaded", "path quality")
+Plan = namedtuple("Plan", "video path hls mp4_field")  # mp4_field: the VIDEO_API field when taken as MP4
+Fetched = namedtuple("Fetched", "plan path stream")  # stream: the .ts file still to remux, if any
 HLS = namedtuple("HLS", "name bandwidth resolution url")
+Segment = namedtuple("Segment", "index duration url byterange")
+Segment.__new__.__defaults__ = (None,)  # byterange: offset and length, only for segments sharing a file
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class Cancelled(Exception):
+    pass
+
+
+def check_cancel(cancel: Optional[threading.Event]) -> None:
+    if cancel is not None and cancel.is_set():
+        raise Cancelled("cancelled")
 
 
 @dataclass
@@ -31,63 +70,51 @@ class Process:
     total: int = 1
 
     def status(self):
+        if self.total == 0:  # still being listed
+            return f"#{self.now}"
         if self.total > 1:
             return f"{self.now}/{self.total} ({self.now / self.total * 100:.0f}%)"
         return "⚓"
 
 
-def retry(exceptions=Exception, tries=3, delay=1, backoff=2):
-    def deco_retry(f):
-        @wraps(f)
-        def f_retry(*args, **kwargs):
-            mtries, mdelay = tries, delay
-            while mtries > 1:
-                try:
-                    return f(*args, **kwargs)
-                except exceptions as e:
-                    console.print(f"[red]{e}, Retrying in {mdelay} seconds...[/]")
-                    time.sleep(mdelay)
-                    mtries -= 1
-                    mdelay *= backoff
-            return f(*args, **kwargs)
+def get_session() -> Session:
+    """The shared Session, created on first use so that importing this module stays cheap."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session()
+            _session.mount("https://", HTTPAdapter(pool_maxsize=c.POOL_SIZE))
+            _session.mount("http://", HTTPAdapter(pool_maxsize=c.POOL_SIZE))
+        return _session
 
-        return f_retry
 
-    return deco_retry
+cookie_store = CookieStore()
+session_pool = SessionPool(get_session, cookie_store)
 
 
-@retry()
-def session_request(method: str, url: str, **kwargs) -> Optional[Response]:
-    resp = session.request(method, url, timeout=c.TIMEOUT, **kwargs)
-    if resp.status_code == 404:
-        console.print(f"[red]404 Client Error: Not Found for url: {url}[/]\n")
-        return None
-    resp.raise_for_status()
-    return resp
-
+def session_request(method: str, url: str, session: Optional[Session] = None, **kwargs) -> Optional[Response]:
+    def request() -> Optional[Response]:
+        ratelimit.request_rate.consume(1)
+        with metrics.span("http_request", method=method, host=urlsplit(url).netloc) as span:
+            span.fields["url"] = url
+            resp = (session or get_session()).request(method, url, timeout=c.TIMEOUT, **kwargs)
+            span.labels["status"] = resp.status_code
+        if resp.status_code == 404:
+            console.print(f"[red]404 Client Error: Not Found for url: {url}[/]\n")
+            return None
+        resp.raise_for_status()
+        return resp
 
-def parse_cookies(cookie: str) -> Dict[str, str]:
-    try:
-        key_values = cookie.split("; ")
-        return {kv.split("=")[0]: kv.split("=")[1] for kv in key_values}
-    except IndexError:
-        return {}
+    return backoff.call(request, url)
 
 
 def save_cookie(cookie: str) -> None:
-    cache_dir = Path.home() / f".{c.APP_NAME}"
-    cache_dir.mkdir(parents=True, exist_ok=True)
-    with open(cache_dir / "cookie", "w") as f:
-        f.write(cookie)
+    cookie_store.save(cookie)
 
 
 def read_cookie() -> str:
-    cookie = "foo=bar"
-    cache_file = Path.home() / f".{c.APP_NAME}/cookie"
-    if cache_file.is_file():
-        with open(cache_file) as f:
-            cookie = f.read()
-    return cookie
+    cookie = cookie_store.read()
+    return ANONYMOUS_COOKIE if cookie is None else cookie
 
 
 def find_from_string(pattern: str, string: str) -> str:
@@ -126,65 +153,108 @@ def parse_hls(index: str) -> List[HLS]:
     hls-250p-639f7.m3u8
     """
     hls_list = []
-    lines = index.strip().split("\n")
-    for idx, line in enumerate(lines):
-        if idx % 2 == 1:
-            args_str = line.split(":")[-1]
-            kwargs = {kv.split("=")[0]: kv.split("=")[1] for kv in args_str.split(",")}
-            hls_list.append(
-                HLS(
-                    name=kwargs["NAME"].replace('"', ""),
-                    bandwidth=kwargs["BANDWIDTH"],
-                    resolution=kwargs["RESOLUTION"],
-                    url=lines[idx + 1],
-                )
-            )
+    for variant in m3u8.parse_master(index).variants:
+        attributes = variant.attributes
+        resolution = attributes.get("RESOLUTION", "")
+        bandwidth = attributes.get("BANDWIDTH", "0")
+        name = attributes.get("NAME") or (f"{min(int(n) for n in resolution.split('x'))}p" if resolution else bandwidth)
+        hls_list.append(HLS(name=name, bandwidth=bandwidth, resolution=resolution, url=variant.uri))
 
     # sort by bandwidth
-    hls_list = sorted(hls_list, key=lambda x: int(x.bandwidth))
+    return sorted(hls_list, key=lambda x: int(x.bandwidth))
+
 
-    return hls_list
+def parse_media_playlist(index: str, playlist_url: str) -> List[Segment]:
+    """
+    #EXTM3U
+    #EXT-X-TARGETDURATION:10
+    #EXTINF:10.010,
+    hls-360p-045d90.ts
+    #EXTINF:4.004,
+    hls-360p-045d91.ts
+    #EXT-X-ENDLIST
+    """
+    return media_segments(m3u8.parse_media(index), playlist_url)
 
 
-def get_video_full_name(index: str) -> str:
-    resp = session_request("GET", index)
-    title_tab = re.search(r'(?<=<meta property="og:title" content=").*?(?="\s*/>)', resp.text)
+PLAIN_URI = re.compile(r"[\w-][^:]*")  # relative, without a scheme
+
+
+def media_segments(media: m3u8.Media, playlist_url: str) -> List[Segment]:
+    # Most segments are plain file names next to the playlist, join them without urljoin
+    base = urljoin(playlist_url, ".")
+    return [
+        Segment(
+            index=i,
+            duration=s.duration,
+            url=base + s.uri if PLAIN_URI.fullmatch(s.uri) and "./" not in s.uri else urljoin(playlist_url, s.uri),
+            byterange=s.byterange,
+        )
+        for i, s in enumerate(media.segments)
+    ]
+
+
+def is_encrypted_playlist(index: str) -> bool:
+    return m3u8.parse_media(index).encrypted
+
+
+VIDEO_TITLE = re.compile(r'(?<=<meta property="og:title" content=").*?(?="\s*/>)')
+
+
+def parse_video_title(index: str) -> str:
+    title_tab = VIDEO_TITLE.search(index)
     if title_tab:
         return str(html.unescape(title_tab.group()))
     return ""
 
 
-def request_with_cookie(method: str, url: str, return_when: str, reset_cookie: bool) -> Dict[str, Any]:
-    cookie_raw = "k=v" if reset_cookie else read_cookie()
-    cookies = parse_cookies(cookie_raw)
+def read_page(url: str) -> Optional[Dict[str, str]]:
+    """The title, HLS and MP4 URLs of a watch page, read only as far as the last of them."""
+    resp = session_request("GET", url, stream=True)
+    if not resp:
+        return None
+    try:
+        return scan_page(resp.iter_content(c.CHUNK_SIZE))
+    finally:
+        resp.close()
+
+
+def get_video_full_name(index: str) -> str:
+    return (read_page(index) or {}).get("title", "")
+
+
+def get_field(data: Dict[str, Any], path: str) -> Any:
+    value: Any = data
+    for key in path.split("."):
+        value = value.get(key, {})
+    return value
+
 
+def request_with_cookie(method: str, url: str, return_when: str, reset_cookie: bool) -> Dict[str, Any]:
+    if reset_cookie:
+        session_pool.reset()
     while 1:
-        session.cookies = cookiejar_from_dict(cookies)
-        resp = session_request(method, url)
-        data = resp.json()
-        keys = return_when.split(".")
-        value = data
-        for key in keys:
-            value = value.get(key, {})
-        if value:
-            save_cookie(cookie_raw)
-            break
+        account = session_pool.take()
+        resp = session_request(method, url, session=account.session)
+        if resp is None:
+            raise ValueError(f"{url} is not available")
+        data: Dict[str, Any] = resp.json()
+        if get_field(data, return_when):
+            return data
         error = data.get("ERROR")
         if error:
             raise ValueError(f"{error} {url}")
-        cookie_raw = input(
-            "The cookie has expired, please enter a new one:\n"
-            "(Log in https://xvideos.com with your account via a browser, "
-            "then open the developer mode, copy and paste the cookie here)\n"
-        ).strip()
-        cookies = parse_cookies(cookie_raw)
-
-    return data
+        session_pool.expire(account)
 
 
 def get_video_url(vid: str, low: bool, reset_cookie: bool) -> str:
-    video_api = c.VIDEO_API.format(vid=vid)
-    data = request_with_cookie("GET", video_api, return_when="URL", reset_cookie=reset_cookie)
+    with metrics.span("resolve", kind="mp4_url") as span:
+        span.fields["vid"] = vid
+        data = None if reset_cookie else metadata_cache.get(f"mp4:{vid}")
+        if not data:
+            video_api = c.VIDEO_API.format(vid=vid)
+            data = request_with_cookie("GET", video_api, return_when="URL", reset_cookie=reset_cookie)
+            metadata_cache.set(f"mp4:{vid}", {k: data.get(k) for k in ("URL", "URL_LOW")}, c.CACHE_URL_TTL)
 
     url_field = "URL"
     if low:
@@ -193,34 +263,150 @@ def get_video_url(vid: str, low: bool, reset_cookie: bool) -> str:
     return data.get(url_field)
 
 
+def fetch_video_page(page_url: str, vid: str) -> Dict[str, str]:
+    """Fetch a watch page and cache everything needed from it, so it is never fetched twice."""
+    page = read_page(page_url)
+    if page is None:
+        raise ValueError(f"can't download video from URL: {page_url}")
+    if page.get("title"):
+        metadata_cache.set(f"title:{vid}", page["title"], c.CACHE_TITLE_TTL)
+    if page.get("hls"):
+        metadata_cache.set(f"hls_url:{vid}", page["hls"], c.CACHE_URL_TTL)
+    # The same links VIDEO_API answers with, which saves asking it for 250p and 360p
+    if page.get("URL") and page.get("URL_LOW"):
+        metadata_cache.set(f"mp4:{vid}", {"URL": page["URL"], "URL_LOW": page["URL_LOW"]}, c.CACHE_URL_TTL)
+    return page
+
+
 def get_videos_from_play_page(page_url: str) -> Video:
     vid = parse_video_id(page_url)
-    vname = get_video_full_name(page_url) or parse_video_name(page_url)
+    vname = metadata_cache.get(f"title:{vid}")
+    if vname is None:
+        vname = fetch_video_page(page_url, vid).get("title", "")
+    vname = vname or parse_video_name(page_url)
     vpage = c.VIDEO_PAGE.format(vid=vid)
     return Video(vid=vid, vname=vname, pname="", uname="", vpage=vpage)
 
 
-def get_videos_from_user_page(page_url: str, aid: str, base_api: str, videos: List[Video]) -> List[Video]:
+THUMB_BLOCK = re.compile(r'<div\b[^>]*\bclass="(?:[^"]*\s)?thumb-block(?:\s[^"]*)?"[^>]*>')
+DATA_ID = re.compile(r'\bdata-id="(\d+)"')
+TITLE_LINK = re.compile(r'<p\b[^>]*\bclass="title"[^>]*>\s*<a\b[^>]*\btitle="([^"]*)"')
+
+
+def parse_thumb_blocks(index: str) -> Optional[List[Tuple[str, str]]]:
+    """Extract (vid, title) of every thumb-block with regexes, None if the markup is not as expected."""
+    blocks = list(THUMB_BLOCK.finditer(index))
+    found = []
+    for block, next_block in zip(blocks, blocks[1:] + [None]):
+        vid = DATA_ID.search(block.group())
+        title = TITLE_LINK.search(index, block.end(), next_block.start() if next_block else len(index))
+        if not vid or not title:
+            return None
+        found.append((vid.group(1), html.unescape(title.group(1))))
+    return found
+
+
+def parse_user_page(index: str, username: str) -> Tuple[str, List[Video]]:
+    next_aid = find_from_string(r"\d+", index.splitlines()[0])
+
+    blocks = parse_thumb_blocks(index)
+    if blocks is None:
+        from bs4 import BeautifulSoup
+
+        bs = BeautifulSoup(index, HTML_PARSER)
+        blocks = [
+            (str(block.get("data-id")), str(link.get("title")))
+            for block in bs.select("div.thumb-block")
+            for link in block.select("p.title a")[:1]
+        ]
+
+    videos = [
+        Video(vid=vid, vname=vname, pname="", uname=username, vpage=c.VIDEO_PAGE.format(vid=vid))
+        for vid, vname in blocks
+    ]
+    return next_aid, videos
+
+
+def iter_videos_from_user_page(page_url: str, base_api: str, aid: str = "0") -> Iterator[Video]:
     username = parse_username(page_url)
-    start_page = base_api.format(u=username, aid=aid)
-    resp = session_request("POST", start_page)
-    next_aid = find_from_string(r"\d+", resp.text.splitlines()[0])
-
-    bs = BeautifulSoup(resp.text, "html.parser")
-    blocks = bs.find_all("div", class_="thumb-block")
-    for block in blocks:
-        vid = block.attrs.get("data-id")
-        vname = block.find("p", class_="title").find("a").attrs.get("title")
-        vpage = c.VIDEO_PAGE.format(vid=vid)
-        videos.append(Video(vid=vid, vname=vname, pname="", uname=username, vpage=vpage))
-    if int(next_aid) > 0:
-        return get_videos_from_user_page(page_url, next_aid, base_api, videos)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future: "Optional[Future[Optional[Response]]]" = executor.submit(
+            session_request, "POST", base_api.format(u=username, aid=aid)
+        )
+        while future:
+            resp = future.result()
+            if resp is None:
+                return
+            next_aid = find_from_string(r"\d+", resp.text.splitlines()[0])
+            # Request the next page while this one is being parsed and downloaded
+            future = None
+            if int(next_aid) > 0:
+                future = executor.submit(session_request, "POST", base_api.format(u=username, aid=next_aid))
+            yield from parse_user_page(resp.text, username)[1]
+
+
+def get_videos_from_user_page(page_url: str, aid: str, base_api: str, videos: List[Video]) -> List[Video]:
+    videos.extend(iter_videos_from_user_page(page_url, base_api, aid))
     return videos
 
 
+def read_batch_file(path: str) -> Iterator[str]:
+    """URLs from a file, one per line, or from stdin for "-". Blank lines and # comments are ignored."""
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in f:
+            url = line.strip()
+            if url and not url.startswith("#"):
+                yield url
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def iter_videos_from_urls(
+    urls: Iterable[str],
+    reset_cookie: bool,
+    skip: Optional[Callable[[str], bool]] = None,
+    seen: Optional[Set[str]] = None,
+) -> Iterator[Video]:
+    """
+    Yield the videos behind each URL, leaving out the vids skip() returns True for.
+    Every vid is yielded once, however many of the URLs list it.
+    """
+    seen = set() if seen is None else seen
+    listed: Set[str] = set()
+    for url in urls:
+        if url.rstrip("/") in listed:
+            continue
+        listed.add(url.rstrip("/"))
+        if "/profiles/" in url:
+            videos: Iterable[Video] = iter_videos_from_user_page(url, c.USER_UPLOAD_API)
+        elif "/channels/" in url:
+            videos = iter_videos_from_user_page(url, c.CHANNEL_API)
+        elif "/favorite/" in url:
+            pid = parse_playlist_id(url)
+            videos = get_videos_by_playlist_id(pid, reset_cookie)
+        else:
+            # The id is in the URL, so a skipped or repeated video costs no request at all
+            vid = parse_video_id(url)
+            if vid in seen or (skip and skip(vid)):
+                continue
+            videos = [get_videos_from_play_page(url)]
+        for video in videos:
+            if video.vid in seen:
+                continue
+            seen.add(video.vid)
+            if not (skip and skip(video.vid)):
+                yield video
+
+
 def get_videos_by_playlist_id(pid: str, reset_cookie: bool) -> List[Video]:
     playlist_api = c.PLAYLIST_API.format(pid=pid)
     data = request_with_cookie("POST", playlist_api, return_when="logged", reset_cookie=reset_cookie)
+    return parse_playlist(data, playlist_api)
+
+
+def parse_playlist(data: Dict[str, Any], playlist_api: str) -> List[Video]:
     playlist_name = data.get("list", {}).get("name")
     videos_info = data.get("list", {}).get("videos")
     if not any([playlist_name, videos_info]):
@@ -249,122 +435,556 @@ def remove_illegal_chars(string: str) -> str:
     return ret_str
 
 
-def get_hls_list(video: Video) -> List[HLS]:
-    page_resp = session_request("GET", video.vpage)
-    hls_url = parse_video_hls(page_resp.text)
-    prefix = "/".join(hls_url.split("/")[:-1])
+def parse_hls_list(hls_url: str, index: str) -> List[HLS]:
+    return [hls._replace(url=urljoin(hls_url, hls.url)) for hls in parse_hls(index)]
 
-    hls_resp = session_request("GET", hls_url)
-    hls_list = parse_hls(hls_resp.text)
-    return [hls._replace(url=f"{prefix}/{hls.url}") for hls in hls_list]
 
+def get_hls_list(video: Video) -> List[HLS]:
+    with metrics.span("resolve", kind="hls_list") as span:
+        span.fields["vid"] = video.vid
+        cached = metadata_cache.get(f"hls:{video.vid}")
+        if cached:
+            return [HLS(*hls) for hls in cached]
+
+        hls_url = metadata_cache.get(f"hls_url:{video.vid}") or fetch_video_page(video.vpage, video.vid).get("hls")
+        if not hls_url:
+            raise ValueError(f"can't download video from URL: {video.vpage}")
+        hls_resp = session_request("GET", hls_url)
+        if not hls_resp:
+            raise ValueError(f"can't download video from URL: {video.vpage}")
+        hls_list = parse_hls_list(hls_url, hls_resp.text)
+        metadata_cache.set(f"hls:{video.vid}", [list(hls) for hls in hls_list], c.CACHE_URL_TTL)
+        return hls_list
+
+
+def split_ranges(size: int, connections: int, done: Iterable[Tuple[int, int]] = ()) -> List[Tuple[int, int]]:
+    """Split [0, size) minus the done ranges into half-open byte ranges, at most FRAGMENT_SIZE each."""
+    fragment = max(1, min(c.FRAGMENT_SIZE, -(-size // max(connections, 1))))
+    ranges = []
+    gap_start = 0
+    for done_start, done_end in sorted(done) + [(size, size)]:
+        for start in range(gap_start, done_start, fragment):
+            ranges.append((start, min(start + fragment, done_start)))
+        gap_start = max(gap_start, done_end)
+    return ranges
+
+
+def fetch_range(
+    url: str,
+    writer: Writer,
+    start: int,
+    end: int,
+    progress: Task,
+    journal: Journal,
+    chunk_size: int = c.CHUNK_SIZE,
+    limit: Optional[TokenBucket] = None,
+    hasher: Optional[BlockHasher] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Tuple[int, float]:
+    """Download [start, end) into the writer, return its size and how long it took."""
+    with metrics.span("fragment", kind="mp4") as span:
+        span.fields.update(url=url, start=start, end=end)
+        size, seconds = _fetch_range(url, writer, start, end, progress, journal, chunk_size, limit, hasher, cancel)
+        metrics.inc("downloaded_bytes", size, kind="mp4")
+    return size, seconds
+
+
+def _fetch_range(
+    url: str,
+    writer: Writer,
+    start: int,
+    end: int,
+    progress: Task,
+    journal: Journal,
+    chunk_size: int,
+    limit: Optional[TokenBucket],
+    hasher: Optional[BlockHasher],
+    cancel: Optional[threading.Event],
+) -> Tuple[int, float]:
+    time_start = time.time()
+    offset = start
+    crc = 0
+    attempt = 0
+    buffer = writer.buffer(start)
+    while 1:
+        # After a broken transfer, ask only for the bytes that are not written yet
+        resp = session_request("GET", url, stream=True, headers={"Range": f"bytes={offset}-{end - 1}"})
+        if resp is None:
+            raise IOError(f"range {start}-{end - 1} is not available: {url}")
+        if resp.status_code != 206 and offset > 0:
+            raise IOError(f"the server ignored the range request: {url}")
+        received = offset
+        try:
+            for chunk in resp.iter_content(chunk_size):
+                chunk = chunk[: end - offset]
+                buffer.write(chunk)
+                if hasher is not None:
+                    hasher.update(offset, chunk)
+                crc = checksum(chunk, crc)
+                offset += len(chunk)
+                progress.update(len(chunk))
+                throttle(len(chunk), limit)
+                check_cancel(cancel)
+                if offset >= end:
+                    break
+            error = None
+        except (ChunkedEncodingError, RequestsConnectionError) as e:
+            error = e
+        finally:
+            resp.close()
+        if offset >= end:
+            break
 
-def download_mp4_resource(video: Video, save_name: Path, overwrite: bool, low: bool, reset_cookie: bool) -> None:
-    done = 0
-    if save_name.is_file():
-        if overwrite:
-            save_name.unlink()
-        else:
-            done = save_name.stat().st_size
-            if verifier.verify(str(save_name)):
-                console.print(f"Video Size : [white]{done / 1024 ** 2:.2f}[/] MB [green](skip downloaded)[/]\n")
-                return None
+        attempt = 0 if offset > received else attempt + 1
+        if attempt >= c.RETRY_TRIES:
+            raise IOError(f"incomplete range {start}-{end - 1}: got {offset - start} of {end - start} bytes") from error
+        backoff.breaker.failure(urlsplit(url).netloc)
+        metrics.inc("retries", host=urlsplit(url).netloc, reason="broken_range")
+        wait = backoff.delay(attempt)
+        console.print(f"[red]Range {start}-{end - 1} broke off at byte {offset}, resuming in {wait:.1f} seconds...[/]")
+        time.sleep(wait)
+    buffer.flush()
+    journal.record(start=start, end=end, crc=crc)
+    return end - start, time.time() - time_start
+
+
+def download_mp4_resource(
+    video: Video,
+    save_name: Path,
+    overwrite: bool,
+    low: bool,
+    reset_cookie: bool,
+    connections: int = c.CONNECTIONS,
+    quiet: bool = False,
+    limit: Optional[TokenBucket] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Optional[Path]:
+    journal = Journal(save_name)
+    part = part_path(save_name)
+    if journal.exists() and save_name.is_file() and not part.is_file():
+        # Left at the final name by an older version, resume it as the partial download
+        save_name.replace(part)
+    if overwrite:
+        for path in (save_name, part):
+            if path.is_file():
+                path.unlink()
+        journal.remove()
+        remove_sidecar(save_name)
+    elif save_name.is_file() and verifier.verify(str(save_name)):
+        if not quiet:
+            console.print(
+                f"Video Size : [white]{save_name.stat().st_size / 1024 ** 2:.2f}[/] MB [green](skip downloaded)[/]\n"
+            )
+        return save_name
 
     url = get_video_url(video.vid, low, reset_cookie)
     head = session_request("HEAD", url, stream=True)
     if not head:
         return None
     size = int(head.headers["Content-Length"].strip())
-    console.print(f"Video Size : [white]{size / 1024 ** 2:.2f}[/] MB")
-
-    show_process_bar = False
-    if done < size:
-        show_process_bar = True
-        print()
-
-    emoji = random.choice(c.SMILE_EMOJIS)
-    while done < size:
-        time_start = time.time()
-        start = done
-        done += c.FRAGMENT_SIZE
-        if done > size:
-            done = size
-        end = done
-        headers = {"Range": f"bytes={start}-{end - 1}"}
-        resp = session_request("GET", url, stream=True, headers=headers)
-
-        with open(save_name, "ab") as f:
-            write = start
+    if not quiet:
+        console.print(f"Video Size : [white]{size / 1024 ** 2:.2f}[/] MB")
+
+    # Resume from the ranges a previous run journaled, if they are still intact on disk
+    header = {"kind": "mp4", "size": size}
+    records = verified_ranges(part, journal.load(header)) if part.is_file() else []
+    journal.start(header, records)
+    remove_sidecar(save_name)
+    done = [(r["start"], r["end"]) for r in records]
+
+    # Preallocate the .part file, then every connection writes its ranges in place.
+    # Ranges are cut when a connection asks for one, sized from the throughput measured so far.
+    controller = Controller(connections)
+    hasher = BlockHasher(size)
+    ranges = RangeAllocator(split_ranges(size, 1, done))
+    with Writer(save_name, size) as writer:
+        with renderer.task(save_name.stem, size, sum(end - start for start, end in done)) as progress:
+            with ThreadPoolExecutor(max_workers=connections) as executor:
+                running: "Set[Future[Tuple[int, float]]]" = set()
+                try:
+                    while 1:
+                        while len(running) < controller.connections:
+                            piece = ranges.take(controller.fragment, controller.connections)
+                            if piece is None:
+                                break
+                            running.add(
+                                executor.submit(
+                                    fetch_range,
+                                    url,
+                                    writer,
+                                    *piece,
+                                    progress,
+                                    journal,
+                                    controller.chunk,
+                                    limit,
+                                    hasher,
+                                    cancel,
+                                )
+                            )
+                        if not running:
+                            break
+                        finished, running = wait(running, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            controller.observe(*future.result())
+                except BaseException:
+                    for future in running:
+                        future.cancel()
+                    raise
+        writer.commit()
+    write_sidecar(save_name, hasher.digests(save_name))
+    journal.remove()
+
+    if not quiet:
+        console.print()
+    return save_name
+
+
+def fetch_in_order(fetch: Callable[[T], R], items: Iterable[T], workers: int) -> Iterator[R]:
+    """Fetch items concurrently but yield the results in order, keeping at most 2 * workers in memory."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: "Deque[Future[R]]" = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(fetch, item))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def fetch_segment(
+    segment: Segment, limit: Optional[TokenBucket] = None, cancel: Optional[threading.Event] = None
+) -> bytes:
+    with metrics.span("fragment", kind="hls") as span:
+        span.fields.update(url=segment.url, index=segment.index)
+        data = _fetch_segment(segment, limit, cancel)
+        metrics.inc("downloaded_bytes", len(data), kind="hls")
+    return data
+
+
+def _fetch_segment(segment: Segment, limit: Optional[TokenBucket], cancel: Optional[threading.Event]) -> bytes:
+    start, length = segment.byterange or (0, None)
+    data = bytearray()
+    attempt = 0
+    while 1:
+        # After a broken transfer, ask only for the bytes that are not received yet
+        headers = {}
+        if data or segment.byterange:
+            end = f"{start + length - 1}" if length is not None else ""
+            headers["Range"] = f"bytes={start + len(data)}-{end}"
+        resp = session_request("GET", segment.url, stream=True, headers=headers)
+        if not resp:
+            raise IOError(f"segment {segment.index} is not available: {segment.url}")
+        if data and resp.status_code != 206:
+            data.clear()  # the server ignored the range, the segment comes again from its start
+        received = len(data)
+        try:
             for chunk in resp.iter_content(c.CHUNK_SIZE):
-                f.write(chunk)
-
-                write += c.CHUNK_SIZE
-                percent_done = int(min(write, size) / size * 1000) / 10
-                bar_done = int(percent_done * 0.6)
-                console.print(
-                    f"{emoji} ╞{'█' * bar_done}{' ' * (60 - bar_done)} [green]{percent_done:5.1f}%[/]", end="\r"
-                )
-        # Download speed
-        speed = (end - start) / (time.time() - time_start)
-        if speed < 1024:  # 1KB
-            speed_text = f"{speed:7.2f}B/s"
-        elif speed < 1048576:  # 1MB
-            speed_text = f"{speed / 1024:7.2f}KB/s"
-        else:
-            speed_text = f"{speed / 1048576:7.2f}MB/s"
+                data += chunk
+                throttle(len(chunk), limit)
+                check_cancel(cancel)
+            error = None
+        except (ChunkedEncodingError, RequestsConnectionError) as e:
+            error = e
+        finally:
+            resp.close()
+        if error is None:
+            return bytes(data[:length] if length is not None else data)
+
+        attempt = 0 if len(data) > received else attempt + 1
+        if attempt >= c.RETRY_TRIES:
+            raise IOError(f"incomplete segment {segment.index}: got {len(data)} bytes of {segment.url}") from error
+        backoff.breaker.failure(urlsplit(segment.url).netloc)
+        metrics.inc("retries", host=urlsplit(segment.url).netloc, reason="broken_segment")
+        wait = backoff.delay(attempt)
         console.print(
-            f"{emoji} ╞{'█' * bar_done}{' ' * (60 - bar_done)}╡ [green]{percent_done:5.1f}% {speed_text}[/]", end="\r"
+            f"[red]Segment {segment.index} broke off at byte {len(data)}, resuming in {wait:.1f} seconds...[/]"
         )
-
-    if show_process_bar:
-        print(end="\n\n")
-
-
-def download_hls_stream(playlist: str, save_name: Path, overwrite: bool) -> None:
-    # Cause got playlist.m3u8, we can download video by ffmpeg
-    console.print("⏳ Wait a mininute...", end="\r")
-    ffnpeg_cmd = ffmpeg.input(playlist).output(str(save_name), codec="copy", loglevel="quiet")
-
-    if save_name.is_file():
-        if overwrite:
-            ffnpeg_cmd.run(overwrite_output=overwrite)
-            console.print(f"Video Size : [white]{save_name.stat().st_size / 1024 ** 2:.2f}[/] MB\n")
-        else:
+        time.sleep(wait)
+
+
+def download_hls_stream(
+    playlist: str,
+    save_name: Path,
+    overwrite: bool,
+    connections: int = c.CONNECTIONS,
+    quiet: bool = False,
+    limit: Optional[TokenBucket] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Optional[Path]:
+    path, stream = fetch_hls_stream(playlist, save_name, overwrite, connections, quiet, limit, cancel)
+    if stream is not None:
+        remux_stream(stream, save_name, quiet)
+    return path
+
+
+def fetch_hls_stream(
+    playlist: str,
+    save_name: Path,
+    overwrite: bool,
+    connections: int = c.CONNECTIONS,
+    quiet: bool = False,
+    limit: Optional[TokenBucket] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Tuple[Optional[Path], Optional[Path]]:
+    """Download a stream, return where the video goes and the .ts file still to remux into it, if any."""
+    stream = save_name.with_name(save_name.name + ".ts")
+    if overwrite:
+        for path in (save_name, part_path(save_name), stream):
+            if path.is_file():
+                path.unlink()
+        Journal(stream).remove()
+        remove_sidecar(save_name)
+    elif save_name.is_file():
+        if not quiet:
             console.print(
-                f"Video Size : [white]{save_name.stat().st_size / 1024 ** 2:.2f}[/] MB " "[green](skip downloaded)[/]\n"
+                f"Video Size : [white]{save_name.stat().st_size / 1024 ** 2:.2f}[/] MB [green](skip downloaded)[/]\n"
             )
-    else:
-        ffnpeg_cmd.run()
+        return save_name, None
+
+    resp = session_request("GET", playlist)
+    if not resp:
+        return None, None
+    media = m3u8.parse_media(resp.text)
+    if media.encrypted:
+        import ffmpeg
+
+        # Leave encrypted streams to ffmpeg, it knows how to fetch the keys and decrypt
+        if not quiet:
+            console.print("⏳ Wait a mininute...", end="\r")
+        part = part_path(save_name)
+        ffmpeg.input(playlist).output(str(part), f="mp4", codec="copy", loglevel="quiet").run(overwrite_output=True)
+        commit(part, save_name)
+        hash_file(save_name)
+        if not quiet:
+            console.print(f"Video Size : [white]{save_name.stat().st_size / 1024 ** 2:.2f}[/] MB\n")
+        return save_name, None
+
+    segments = media_segments(media, playlist)
+    if not quiet:
+        console.print(f"Segments   : [white]{len(segments)}[/] ({sum(s.duration for s in segments):.0f}s)")
+
+    # Fetch segments concurrently, append them to a .ts file in playlist order,
+    # then let ffmpeg only remux the local file into the mp4 container
+    # The variant is part of the header, the variants of a video have as many segments,
+    # and its path leaves out the signed query, which changes from one run to the next
+    journal = Journal(stream)
+    header = {"kind": "hls", "variant": urlsplit(playlist).path, "segments": len(segments)}
+    records = verified_segments(stream, journal.load(header)) if stream.is_file() else []
+    journal.start(header, records)
+    offset = sum(r["length"] for r in records)
+
+    with renderer.task(save_name.stem, len(segments), len(records)) as progress, open(
+        stream, "r+b" if records else "wb"
+    ) as f:
+        f.truncate(offset)
+        f.seek(offset)
+        for segment, data in zip(
+            segments[len(records) :],
+            fetch_in_order(partial(fetch_segment, limit=limit, cancel=cancel), segments[len(records) :], connections),
+        ):
+            metrics.inc("written_bytes", len(data))
+            with metrics.timer("disk_write"):
+                f.write(data)
+                f.flush()
+            journal.record(index=segment.index, offset=offset, length=len(data), crc=checksum(data))
+            offset += len(data)
+            progress.update(1, len(data))
+    return save_name, stream
+
+
+def remux_stream(stream: Path, save_name: Path, quiet: bool = False) -> None:
+    """Copy a downloaded .ts stream into the mp4 container, then hash the result."""
+    import ffmpeg
+
+    part = part_path(save_name)
+    with metrics.span("remux"):
+        ffmpeg.input(str(stream)).output(str(part), f="mp4", codec="copy", loglevel="quiet").run(overwrite_output=True)
+    commit(part, save_name)
+    stream.unlink()
+    Journal(stream).remove()
+    # ffmpeg writes the mp4 container, so its hash can only be taken afterwards
+    hash_file(save_name)
+
+    if not quiet:
         console.print(f"Video Size : [white]{save_name.stat().st_size / 1024 ** 2:.2f}[/] MB\n")
 
 
-def download(video: Video, dest: str, quality: str, overwrite: bool, reset_cookie: bool) -> None:
+def resolve_video(video: Video, dest: str, quality: str, mkdir: bool = True) -> Plan:
+    """Where a video goes and which variant of it to download."""
     save_dir = Path(dest) / (video.pname or video.uname)
-    save_dir.mkdir(parents=True, exist_ok=True)
-    video_name = remove_illegal_chars(video.vname)
-    save_name = save_dir / f"{video_name}(#{video.vid}).mp4"
-
-    console.print(f"Video ID   : [white]{video.vid}[/]")
-    console.print(f"Video Name : [yellow]{video_name}[/]")
-    console.print(f"Video Page : [underline]{video.vpage}[/]")
-
-    # Get all hls playlists
-    hls_list = get_hls_list(video)
-
-    # Choose video resolution
-    if quality == "high":
-        index = -1
-    elif quality == "middle":
-        index = int(len(hls_list) / 2)
-    else:
-        index = 0
-
-    hls = hls_list[index]
-    console.print(f"Resolution : [white]{hls.name} @ {hls.resolution}[/]")
-    console.print(f"Destination: [white]{save_name.absolute()}[/]")
-
-    if hls.name in c.HAS_MP4_RESOUCE:
-        low = True if quality == "low" else False
-        download_mp4_resource(video, save_name, overwrite, low, reset_cookie)
-    else:
-        download_hls_stream(hls.url, save_name, overwrite)
+    if mkdir:
+        save_dir.mkdir(parents=True, exist_ok=True)
+    save_name = save_dir / f"{remove_illegal_chars(video.vname)}(#{video.vid}).mp4"
+    hls, mp4_field = policy.choose(get_hls_list(video), quality)
+    return Plan(video, save_name, hls, mp4_field)
+
+
+def fetch_video(
+    plan: Plan,
+    overwrite: bool,
+    reset_cookie: bool,
+    connections: int = c.CONNECTIONS,
+    quiet: bool = False,
+    limit: Optional[TokenBucket] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Fetched:
+    video, save_name, hls, mp4_field = plan
+    if not quiet:
+        console.print(f"Video ID   : [white]{video.vid}[/]")
+        console.print(f"Video Name : [yellow]{save_name.stem[: -len(f'(#{video.vid})')]}[/]")
+        console.print(f"Video Page : [underline]{video.vpage}[/]")
+        console.print(f"Resolution : [white]{hls.name} @ {hls.resolution}[/]")
+        console.print(f"Destination: [white]{save_name.absolute()}[/]")
+
+    if mp4_field:
+        low = mp4_field == "URL_LOW"
+        path = download_mp4_resource(video, save_name, overwrite, low, reset_cookie, connections, quiet, limit, cancel)
+        return Fetched(plan, path, None)
+    path, stream = fetch_hls_stream(hls.url, save_name, overwrite, connections, quiet, limit, cancel)
+    return Fetched(plan, path, stream)
+
+
+def finalize_video(fetched: Fetched, quiet: bool = False) -> Optional[Downloaded]:
+    if fetched.path is None:
+        return None
+    if fetched.stream is not None:
+        remux_stream(fetched.stream, fetched.path, quiet)
+    return Downloaded(fetched.path, fetched.plan.hls.name)
+
+
+def download(
+    video: Video,
+    dest: str,
+    quality: str,
+    overwrite: bool,
+    reset_cookie: bool,
+    connections: int = c.CONNECTIONS,
+    quiet: bool = False,
+    limit: Optional[TokenBucket] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Optional[Downloaded]:
+    with profiler.profile(), metrics.span("download", quality=quality) as span:
+        span.fields["vid"] = video.vid
+        plan = resolve_video(video, dest, quality)
+        fetched = fetch_video(plan, overwrite, reset_cookie, connections, quiet, limit, cancel)
+        downloaded = finalize_video(fetched, quiet)
+        span.fields["path"] = downloaded.path if downloaded else None
+    metrics.inc("downloads", result="done" if downloaded else "missing")
+    return downloaded
+
+
+def resolve_ahead(videos: Iterable[Video], workers: int = c.RESOLVE_AHEAD) -> Iterator[Video]:
+    """Yield the videos in order while the next ones are resolved concurrently into the metadata cache."""
+
+    def resolve(video: Video) -> Video:
+        try:
+            get_hls_list(video)
+        except Exception:
+            pass  # download() resolves it again and reports the error
+        return video
+
+    return fetch_in_order(resolve, videos, workers)
+
+
+def download_many(
+    videos: Iterable[Video],
+    total: int,
+    jobs: int,
+    dest: str,
+    quality: str,
+    overwrite: bool,
+    reset_cookie: bool,
+    connections: int = c.CONNECTIONS,
+    archive: Optional[Archive] = None,
+    job_rate: float = 0,
+    ledger: Optional[Ledger] = None,
+) -> List[Failure]:
+    """
+    Download every video through a pipeline: while `jobs` videos transfer, the
+    next ones are resolved and the previous ones remuxed and verified. job_rate
+    caps the bandwidth of each video in bytes per second. With a ledger, only
+    the videos this worker claims are downloaded, then those other workers gave up.
+    """
+    quiet = jobs > 1
+    failures = []
+    claimed = 0
+    mine: Set[str] = set()  # vids this worker claimed, not to be taken again as orphans
+
+    def resolve(item: Tuple[Process, Video]) -> Tuple[Process, Plan]:
+        process, video = item
+        if ledger is not None:
+            if video.vid in mine or not ledger.claim(video):
+                raise Claimed(video.vid)
+            mine.add(video.vid)
+        return process, resolve_video(video, dest, quality)
+
+    def fetch(item: Tuple[Process, Plan]) -> Tuple[Process, Fetched]:
+        process, plan = item
+        if quiet:
+            console.print(f"[cyan]{process.status()}[/] ⏳ {plan.video.vname} (#{plan.video.vid})")
+        else:
+            console.print(f"Downloading: [cyan]{process.status()}[/]")
+        limit = TokenBucket(job_rate) if job_rate else None
+        return process, fetch_video(plan, overwrite, reset_cookie, connections, quiet, limit)
+
+    def finalize(item: Tuple[Process, Fetched]) -> Tuple[Video, Optional[Downloaded]]:
+        process, fetched = item
+        return fetched.plan.video, finalize_video(fetched, quiet)
+
+    def verify(item: Tuple[Video, Optional[Downloaded]]) -> float:
+        video, downloaded = item
+        if not downloaded or not downloaded.path.is_file():
+            return 0
+        if not verifier.verify(str(downloaded.path)):
+            raise IOError(f"{downloaded.path} does not match its hashes")
+        size: int = downloaded.path.stat().st_size
+        if archive is not None:
+            digest = (read_sidecar(downloaded.path) or {}).get("root")
+            archive.add(video.vid, downloaded.path, size, downloaded.quality, digest)
+        return size
+
+    pipeline = Pipeline(
+        [
+            ("resolve", resolve, c.RESOLVE_AHEAD),
+            ("fetch", fetch, jobs),
+            ("finalize", finalize, c.FINALIZE_WORKERS),
+            ("verify", verify, 1),
+        ]
+    )
+    items: Iterable[Tuple[Process, Video]] = ((Process(idx + 1, total), video) for idx, video in enumerate(videos))
+    if ledger is not None:
+        # Numbered on their own, after the listed videos
+        orphans = (Video._make(video) for video in ledger.orphans() if video[0] not in mine)
+        items = chain(items, ((Process(idx + 1, 0), video) for idx, video in enumerate(orphans)))
+    for work in pipeline.run(items):
+        process, video = work.item
+        if isinstance(work.error, Claimed):
+            claimed += 1
+            continue
+        parked = isinstance(work.error, CookieExpired)
+        metrics.inc(
+            "downloads",
+            result="parked" if parked else "failed" if work.error is not None else "done" if work.value else "missing",
+        )
+        if ledger is not None:
+            if work.error is not None or not work.value:
+                ledger.fail(video.vid, str(work.error or "missing"))
+            else:
+                ledger.complete(video.vid)
+        if parked:
+            # Needs a login nobody can give now, the other videos go on
+            console.print(f"[cyan]{process.status()}[/] [yellow]⏸ {video.vname} (#{video.vid}): {work.error}[/]")
+            failures.append(Failure(video, work.error))
+        elif work.error is not None:
+            console.print(f"[cyan]{process.status()}[/] [red]✘ {video.vname} (#{video.vid}): {work.error}[/]")
+            failures.append(Failure(video, work.error))
+        elif quiet:
+            size = work.value / 1024 ** 2
+            console.print(f"[cyan]{process.status()}[/] [green]✔[/] {video.vname} (#{video.vid}) {size:.2f} MB")
+    if claimed:
+        console.print(f"Skipped [green]{claimed}[/] videos claimed by other workers")
+    return failures